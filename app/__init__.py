@@ -1,7 +1,9 @@
+import os
 import dash
 from flask_sqlalchemy import SQLAlchemy
 from flask_caching import Cache
 from config import Config
+from app.database import database_file, connect_to_file, dataset_version, engine_options, read_only_engine_options, prefault_database_file
 
 
 app = dash.Dash(__name__)
@@ -10,11 +12,44 @@ server_flask = app.server
 # configure Flask settings
 server_flask.config.from_object(Config)
 
+# (the file the database connections are opened on, i.e. with the database file's symbolic link [if it is one] resolved, and the version that identifies its data for the cache keys that only depend
+# on it; see database.py)
+connect_to_file(database_file(server_flask))
+
+if not server_flask.config['DATASET_VERSION']:
+    server_flask.config['DATASET_VERSION'] = dataset_version(database_file(server_flask))
+
+# open the database read-only, with a pool of connections per process, if turned on (see database.py)
+server_flask.config['SQLALCHEMY_ENGINE_OPTIONS'] = read_only_engine_options(server_flask) if server_flask.config['SQLITE_READ_ONLY'] else engine_options(server_flask)
+
 # set up caching; (cache configuration settings in config file)
 cache = Cache(server_flask)
 
 db = SQLAlchemy(server_flask)
 
+if server_flask.config['SQLITE_READ_ONLY']:
+    # (SQLite connections can't be used across processes, so a gunicorn worker that's forked after connections have been opened starts with a new pool)
+    os.register_at_fork(after_in_child=lambda: db.get_engine(server_flask).dispose())
+
+    # load the database file into the page cache in the background
+    if server_flask.config['SQLITE_PREFAULT']:
+        prefault_database_file(database_file(server_flask))
+
 
 # this import is a workaround to circular imports in Flask since other modules need to import the app variable defined above
-from app import models, layout, interactivity, excel_export
\ No newline at end of file
+from app import models, lookups, dropdowns, layout, interactivity, excel_export, commands, columnar, warmup, metrics, jobs, datasets
+
+# load the utilization table into memory (or memory map its snapshot) if the columnar engine is turned on (otherwise the database is queried)
+if server_flask.config['COLUMNAR_ENGINE']:
+    columnar.load_columnar_table(server_flask.config['COLUMNAR_SNAPSHOT_DIR'])
+
+# build & serialize the layout (see layout.py), read the lookup tables (see lookups.py) and build the typeahead dropdowns' indexes for no upstream selections (see dropdowns.py) if turned on; (with
+# gunicorn's --preload this is done once, before the workers are forked, and the workers share them)
+if server_flask.config['LAYOUT_WARMUP_ON_STARTUP']:
+    layout.layout_json()
+    lookups.load_lookups()
+    dropdowns.load_prefix_indexes()
+
+# warm the cache in the background if turned on
+if server_flask.config['CACHE_WARMUP_ON_STARTUP']:
+    warmup.start_warm_cache_thread()
\ No newline at end of file
@@ -0,0 +1,89 @@
+// -----------------------------------------------------------------------------------------------------------------------
+// ------------------------------------------------ CLIENTSIDE CALLBACKS -------------------------------------------------
+// -----------------------------------------------------------------------------------------------------------------------
+// The callbacks that only toggle the disabled/hidden/style properties of the inputs & containers (vs. looking anything up), run in the browser instead of as requests to the server; they're
+// registered with app.clientside_callback() in interactivity.py, where their inputs/outputs & notes are, and each one does the same as the Python callback it replaced.
+// (Dash serves every file in the assets folder automatically.  Note that when the app first loads, nothing has triggered a callback, so callback_context.triggered is empty vs. the "." prop id
+// that the Python callbacks see.)
+
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ui: {
+
+        // the prop ids (e.g. "city_dropdown.options") of all of the triggers of the callback being run
+        triggered_prop_ids: function() {
+            return window.dash_clientside.callback_context.triggered.map(function(trigger) { return trigger.prop_id; });
+        },
+
+        // the prop id of the (first) trigger of the callback being run
+        triggered_prop_id: function() {
+            var prop_ids = window.dash_clientside.ui.triggered_prop_ids();
+            return prop_ids.length ? prop_ids[0] : '.';
+        },
+
+
+        // DROPDOWNS - ACCESS
+        // (disabled unless the dropdown's own options were among the triggers; used for every dropdown below the state dropdown)
+        dropdown_access: function() {
+            var output_id = window.dash_clientside.callback_context.inputs_list.slice(-1)[0].id;
+            return window.dash_clientside.ui.triggered_prop_ids().indexOf(output_id + '.options') === -1;
+        },
+
+
+        // SUBMIT BUTTON - ACCESS
+        // (disable submit button if any of the dropdowns are disabled, else enable; also change loaded value in memory store if applicable)
+        submit_button_visible: function() {
+            var args = Array.prototype.slice.call(arguments);
+            var dropdowns_disabled = args.slice(0, -1);
+            var loaded_value = args[args.length - 1]['loaded'];
+
+            if (dropdowns_disabled.some(Boolean)) {
+                return [true, {'loaded': loaded_value}];
+            } else {
+                return [false, {'loaded': loaded_value ? loaded_value : 1}];
+            }
+        },
+
+
+        // EXPORT LINK [& BUTTON] - VISIBILITY
+        // (show link [& button] if the results container (style) was the trigger and is visible... else hide link [& button])
+        export_button_visible: function() {
+            var results_container_style = arguments[arguments.length - 1] || {};
+
+            if (window.dash_clientside.ui.triggered_prop_id() === 'results_container.style' && ('display' in results_container_style ? results_container_style['display'] !== 'none' : true)) {
+                return {'display': 'initial'};
+            } else {
+                return {'display': 'none'};
+            }
+        },
+
+
+        // REQUIRED INPUTS MESSAGE - VALUES & VISIBILITY
+        required_inputs_message_update: function(submit_button_clicks, rank_position_value, rank_by_value) {
+            var mssg = [];
+            if (['Top', 'Bottom'].indexOf(rank_position_value) === -1) { mssg.push('"Top" will be used for the Rank Position value'); }
+            if (['Avg Charged', 'Patients'].indexOf(rank_by_value) === -1) { mssg.push('"Avg Charged" will be used for the Rank By value'); }
+            var plural_ending = mssg.length > 1 ? 's' : '';
+            mssg = mssg.join(' and ');
+
+            if (mssg) {
+                return [true, 'Rank Position and Rank By selections are required.  Instead of the invalid value' + plural_ending + ' provided, ' + mssg + '.'];
+            } else {
+                return [false, mssg];
+            }
+        },
+
+
+        // SPINNER - VISIBILITY
+        // (show spinner if the submit button (n_clicks) was the trigger and it has a value and the results are hidden... else hide spinner)
+        spinner_visible: function(submit_button_clicks, results_container_style) {
+            results_container_style = results_container_style || {};
+
+            if (window.dash_clientside.ui.triggered_prop_id() === 'submit_button.n_clicks' && submit_button_clicks && ('display' in results_container_style ? results_container_style['display'] === 'none' : false)) {
+                return {'minHeight': '100%', 'maxHeight': '100%', 'minWidth': '100%', 'maxWidth': '100%', 'display': 'initial'};
+            } else {
+                return {'display': 'none'};
+            }
+        }
+    }
+});
@@ -0,0 +1,190 @@
+import json
+import platform
+import statistics
+import time
+from app import app, server_flask, db, cache
+from app.models import Utilization
+from app.dropdowns import dropdown_default_values, default_state_value
+from app.results import results_user_inputs, calculate_results
+from app.partitions import partition_tables
+from app.excel_export import excel_export
+
+
+# the default selection (see dropdowns.py), by dropdown component id
+default_values = {f'{col}_dropdown.value': value for col, value in dict(dropdown_default_values, state=[default_state_value]).items()}
+default_values.update({'rank_position_dropdown.value': 'Top', 'rank_by_dropdown.value': 'Avg Charged'})
+
+# callback scenarios to time, as (name, callback function name, prop values, triggered props); prop values are by "component_id.property" (props that aren't given are None)
+callback_scenarios = [
+    ('dropdowns_update (app load)', 'dropdowns_update', {'state_dropdown.value': default_state_value, 'memory_store.data': {'loaded': 0}}, []),
+    ('dropdowns_update (state changed)', 'dropdowns_update', {'state_dropdown.value': [default_state_value], 'memory_store.data': {'loaded': 1}}, ['state_dropdown.value']),
+    ('dropdowns_update (all states)', 'dropdowns_update', {'state_dropdown.value': [], 'memory_store.data': {'loaded': 1}}, ['state_dropdown.value']),
+    ('dropdowns_update (city changed)', 'dropdowns_update', dict(default_values, **{'memory_store.data': {'loaded': 1}}), ['city_dropdown.value']),
+    ('hcpcs_description_update', 'hcpcs_description_update',
+     {'hcpcs_description_checkbox.value': ['yes'], 'hcpcs_code_dropdown.options': [{'label': code, 'value': code} for code in dropdown_default_values['hcpcs_code']]}, ['hcpcs_description_checkbox.value'])
+]
+
+# user interactions to count the callbacks of, as (name, props changed by the user)
+interaction_scenarios = [
+    ('app load', []),
+    ('state changed', ['state_dropdown.value']),
+    ('city changed', ['city_dropdown.value']),
+    ('HCPCS code changed', ['hcpcs_code_dropdown.value']),
+    ('rank by changed', ['rank_by_dropdown.value']),
+    ('submit button pressed', ['submit_button.n_clicks'])
+]
+
+# results selections to time results_update & excel_export() with: the default selection, a single state (answered from the rollup tables) and all states
+results_scenarios = [
+    ('default selection', default_values),
+    ('state', {'state_dropdown.value': [default_state_value], 'rank_position_dropdown.value': 'Top', 'rank_by_dropdown.value': 'Patients'}),
+    ('all states', {'rank_position_dropdown.value': 'Bottom', 'rank_by_dropdown.value': 'Avg Charged'})
+]
+
+# selections to time calculate_results() with, with the ten table & bar chart queries run one after the other vs. at the same time (see run_concurrently() in results.py): the results selections above
+# plus broad selections that aren't answered from the rollup tables, i.e. where both queries read the utilization table
+concurrency_scenarios = results_scenarios + [
+    ('HCPCS code', {'hcpcs_code_dropdown.value': ['99213'], 'rank_position_dropdown.value': 'Top', 'rank_by_dropdown.value': 'Avg Charged'}),
+    ('credential', {'credential_dropdown.value': ['MD'], 'rank_position_dropdown.value': 'Bottom', 'rank_by_dropdown.value': 'Patients'})
+]
+
+
+
+# CALLBACK REQUEST
+# the request body the browser sends to run a callback (i.e. to /_dash-update-component) with the given prop values and triggered props
+def callback_request(callback_name, values, triggered):
+    for output, callback in app.callback_map.items():
+        if 'callback' in callback and callback['callback'].__name__ == callback_name:
+            break
+    else:
+        raise KeyError(f'Callback not found: {callback_name}')
+
+    def props(dependencies):
+        return [dict(dependency, value=values.get(f"{dependency['id']}.{dependency['property']}")) for dependency in dependencies]
+
+    return {'output': output, 'inputs': props(callback['inputs']), 'state': props(callback['state']), 'changedPropIds': triggered}
+
+
+
+# CALLBACKS PER INTERACTION
+# the callbacks that run after a user interaction, i.e. the ones with a changed prop as an input, then the ones with those callbacks' outputs as an input, etc. (every callback runs when the app
+# first loads); returns the number of them that are requests to the server vs. run in the browser (clientside callbacks, see assets/clientside.js).  (Dash runs a callback once all of the callbacks
+# that it's waiting on have finished, so each one is counted once.)
+def callbacks_per_interaction(changed_props):
+    # (a callback with several outputs is keyed by "..output_1...output_2..")
+    def outputs(output):
+        return output[2:-2].split('...') if output.startswith('..') else [output]
+
+    if changed_props:
+        changed_props = set(changed_props)
+        triggered = set()
+        while True:
+            newly_triggered = {output for output, callback in app.callback_map.items()
+                               if output not in triggered and any(f"{dependency['id']}.{dependency['property']}" in changed_props for dependency in callback['inputs'])}
+            if not newly_triggered:
+                break
+
+            triggered |= newly_triggered
+            changed_props |= {prop for output in newly_triggered for prop in outputs(output)}
+    else:
+        triggered = set(app.callback_map)
+
+    server_requests = sum(1 for output in triggered if 'callback' in app.callback_map[output])
+
+    return {'server_requests': server_requests, 'clientside_callbacks': len(triggered) - server_requests}
+
+
+
+# TIME
+# run a function repeatedly (with an optional setup function before each run, which isn't timed) and return the timing stats in milliseconds
+def time_runs(function, repeat, setup=None):
+    timings = []
+
+    for _ in range(repeat):
+        if setup:
+            setup()
+
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+
+    return {
+        'runs': repeat,
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 3),
+        'max_ms': round(timings[-1], 3)
+    }
+
+
+
+# BENCHMARK
+# time each callback (through the same endpoint the browser uses, so the JSON [de]serialization is included) and excel_export() against the configured database; returns the results as a
+# dictionary that's ready to be written as JSON.  (Note that this clears the cache, since the results are timed both uncached & cached.)
+def benchmark(repeat=5):
+    client = server_flask.test_client()
+    results = []
+
+    def post_callback(body):
+        response = client.post('/_dash-update-component', data=json.dumps(body), content_type='application/json')
+        if response.status_code not in [200, 204]:
+            raise RuntimeError(f"{body['output']} returned {response.status_code}: {response.get_data(as_text=True)[:500]}")
+
+    # ---- callbacks per interaction ----
+    for name, changed_props in interaction_scenarios:
+        results.append(dict(name=f'callbacks per interaction ({name})', callback='callbacks_per_interaction', **callbacks_per_interaction(changed_props)))
+
+    # ---- callbacks ----
+    for name, callback_name, values, triggered in callback_scenarios:
+        body = callback_request(callback_name, values, triggered)
+
+        # (the dropdown options are cached [see dropdowns.py], so they're timed both uncached & cached like the results below)
+        if callback_name == 'dropdowns_update':
+            results.append(dict(name=f'{name[:-1]}, not cached)', callback=callback_name, **time_runs(lambda: post_callback(body), repeat, setup=cache.clear)))
+            results.append(dict(name=f'{name[:-1]}, cached)', callback=callback_name, **time_runs(lambda: post_callback(body), repeat)))
+        else:
+            results.append(dict(name=name, callback=callback_name, **time_runs(lambda: post_callback(body), repeat)))
+
+    # ---- results & export ----
+    for name, values in results_scenarios:
+        body = callback_request('results_update', dict(values, **{'submit_button.n_clicks': 1}), ['submit_button.n_clicks'])
+
+        results.append(dict(name=f'results_update ({name}, not cached)', callback='results_update', **time_runs(lambda: post_callback(body), repeat, setup=cache.clear)))
+        results.append(dict(name=f'results_update ({name}, cached)', callback='results_update', **time_runs(lambda: post_callback(body), repeat)))
+
+        selections = {key[:-len('_dropdown.value')]: value for key, value in values.items()}
+        user_inputs = results_user_inputs(selections, selections['rank_position'], selections['rank_by'])
+        ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values = calculate_results(user_inputs)
+
+        results.append(dict(name=f'excel_export ({name})', callback='excel_export',
+                            **time_runs(lambda: b''.join(excel_export(user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values)), repeat)))
+
+    # ---- results queries, one after the other vs. at the same time ----
+    query_threads = server_flask.config['RESULTS_QUERY_THREADS']
+
+    try:
+        for name, values in concurrency_scenarios:
+            selections = {key[:-len('_dropdown.value')]: value for key, value in values.items()}
+            user_inputs = results_user_inputs(selections, selections['rank_position'], selections['rank_by'])
+
+            for label, threads in [('one after the other', 0), ('at the same time', query_threads or 2)]:
+                server_flask.config['RESULTS_QUERY_THREADS'] = threads
+                results.append(dict(name=f'calculate_results ({name}, {label})', callback='calculate_results', **time_runs(lambda: calculate_results(user_inputs), repeat)))
+    finally:
+        server_flask.config['RESULTS_QUERY_THREADS'] = query_threads
+
+    return {
+        'rows': Utilization.query.count(),
+        'database': str(db.engine.url),
+        'columnar_engine': server_flask.config['COLUMNAR_ENGINE'],
+        'rollup_levels': server_flask.config['ROLLUP_LEVELS'],
+        'state_partitions': bool(partition_tables()),
+        'cache_type': server_flask.config['CACHE_TYPE'],
+        'results_query_threads': server_flask.config['RESULTS_QUERY_THREADS'],
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': results
+    }
@@ -0,0 +1,317 @@
+import collections
+import contextlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from flask_caching.backends.base import BaseCache
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# -------------------------------------------------- CACHE BACKENDS -----------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+# (Flask-Caching backends; set CACHE_TYPE in the config file to the import path of a factory function below to use one, e.g. "app.cache_backends.sqlite_lru", or to a built-in
+# Flask-Caching type such as "redis".)
+
+
+# SQLITE LRU CACHE
+# a cache kept in a SQLite file so that it's shared by all of the gunicorn workers (SQLite handles the locking between processes).  Entries are evicted least recently used first once the total
+# size of the cached values goes over max_bytes, and expire after their timeout (in seconds; 0 means they don't expire).  Hits, misses and evictions are counted across all workers (see stats()).
+# Reads only take SQLite's read lock, so the workers' lookups don't wait on each other [WAL mode lets them read while one writes]; the access times the LRU order is kept by, and the hit/miss counts,
+# are collected in memory per worker and written along with the worker's next write, or every access_flush_interval seconds if the write lock is free then, so the LRU order is up to that far
+# behind.  The total size of the entries is kept as a running count [in cache_stat] vs. added up on every write.
+class SQLiteLRUCache(BaseCache):
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, default_timeout=300, access_flush_interval=1.0):
+        super(SQLiteLRUCache, self).__init__(default_timeout)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.access_flush_interval = access_flush_interval
+
+        # (one connection per thread [and process] since SQLite connections can't be shared between threads, e.g. the cache warm-up thread)
+        self._local = threading.local()
+
+        # (the access times by key and the hit/miss counts that haven't been written yet; shared by the threads of a worker)
+        self._pending_lock = threading.Lock()
+        self._pending_accessed = {}
+        self._pending_counts = collections.Counter()
+        self._pending_pid = os.getpid()
+        self._flushed = time.monotonic()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        with self._transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_entry (key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, accessed REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_entry_accessed ON cache_entry (accessed)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_cache_entry_expires ON cache_entry (expires)')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_stat (name TEXT PRIMARY KEY, count INTEGER)')
+            for name in ['hits', 'misses', 'evictions']:
+                connection.execute('INSERT OR IGNORE INTO cache_stat (name, count) VALUES (?, 0)', (name, ))
+
+            # (the running total of the entries' sizes, added up once for a cache file from before it was kept)
+            connection.execute("INSERT OR IGNORE INTO cache_stat (name, count) SELECT 'bytes', COALESCE(SUM(size), 0) FROM cache_entry")
+
+    # ---- connection ----
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+
+        # (a new connection is also needed in each gunicorn worker when the app is loaded before the workers are forked, since a SQLite connection can't be used across processes)
+        if connection is None or self._local.pid != os.getpid():
+            # (autocommit mode so transactions are started explicitly below; WAL lets the workers read while another one writes)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    # (BEGIN IMMEDIATE takes the write lock up front so that e.g. the size check & evictions of two workers can't interleave; a read-only transaction [BEGIN] only takes the read lock when it reads)
+    @contextlib.contextmanager
+    def _transaction(self, read_only=False):
+        connection = self._connection()
+        connection.execute('BEGIN' if read_only else 'BEGIN IMMEDIATE')
+
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        else:
+            connection.execute('COMMIT')
+
+    def _expires(self, timeout):
+        timeout = self.default_timeout if timeout is None else timeout
+        return time.time() + timeout if timeout else None
+
+    @staticmethod
+    def _count(connection, name, count=1):
+        connection.execute('UPDATE cache_stat SET count = count + ? WHERE name = ?', (count, name))
+
+    # ---- access times & hit/miss counts ----
+    # (what a worker forked from a preloaded app inherited is the parent's to write; called with the pending lock held)
+    def _forget_parent_pending(self):
+        if self._pending_pid != os.getpid():
+            self._pending_accessed, self._pending_counts, self._pending_pid = {}, collections.Counter(), os.getpid()
+
+    def _record_access(self, hit_keys, miss_count):
+        with self._pending_lock:
+            self._forget_parent_pending()
+
+            now = time.time()
+            self._pending_accessed.update((key, now) for key in hit_keys)
+            self._pending_counts.update(hits=len(hit_keys), misses=miss_count)
+
+    def _take_pending(self):
+        with self._pending_lock:
+            self._forget_parent_pending()
+
+            accessed, counts = self._pending_accessed, self._pending_counts
+            self._pending_accessed, self._pending_counts = {}, collections.Counter()
+            self._flushed = time.monotonic()
+
+        return accessed, counts
+
+    # write the pending access times & counts (or the ones given, already taken) within a write transaction
+    def _write_pending(self, connection, pending=None):
+        accessed, counts = pending or self._take_pending()
+
+        # (an entry that was replaced or deleted in the meantime keeps its own access time)
+        connection.executemany('UPDATE cache_entry SET accessed = MAX(accessed, ?) WHERE key = ?', [(accessed_time, key) for key, accessed_time in accessed.items()])
+        for name, count in counts.items():
+            if count:
+                self._count(connection, name, count)
+
+    # (after a read: write the pending access times & counts if it's been access_flush_interval seconds, but only if the write lock is free, i.e. without waiting on another worker's write; if it
+    # isn't, they're put back and written later)
+    def _flush_pending(self):
+        if time.monotonic() - self._flushed < self.access_flush_interval:
+            return
+
+        connection = self._connection()
+        accessed, counts = self._take_pending()
+
+        if not accessed and not any(counts.values()):
+            return
+
+        connection.execute('PRAGMA busy_timeout = 0')
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError:
+            with self._pending_lock:
+                for key, accessed_time in accessed.items():
+                    self._pending_accessed[key] = max(accessed_time, self._pending_accessed.get(key, 0))
+                self._pending_counts.update(counts)
+            return
+        finally:
+            connection.execute('PRAGMA busy_timeout = 30000')
+
+        try:
+            self._write_pending(connection, (accessed, counts))
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        else:
+            connection.execute('COMMIT')
+
+    # ---- size ----
+    def _add_bytes(self, connection, count):
+        if count:
+            self._count(connection, 'bytes', count)
+
+    def _total_bytes(self, connection):
+        return connection.execute("SELECT count FROM cache_stat WHERE name = 'bytes'").fetchone()[0]
+
+    # ---- eviction ----
+    # remove expired entries, then the least recently used ones until the cache is within its size budget
+    def _evict(self, connection):
+        now = time.time()
+
+        expired_count, expired_bytes = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entry WHERE expires <= ?', (now, )).fetchone()
+        if expired_count:
+            connection.execute('DELETE FROM cache_entry WHERE expires <= ?', (now, ))
+            self._add_bytes(connection, -expired_bytes)
+
+        total_bytes = self._total_bytes(connection)
+        evicted_keys = []
+
+        if total_bytes > self.max_bytes:
+            evicted_bytes = 0
+            for key, size in connection.execute('SELECT key, size FROM cache_entry ORDER BY accessed'):
+                evicted_keys.append(key)
+                evicted_bytes += size
+                if total_bytes - evicted_bytes <= self.max_bytes:
+                    break
+
+            connection.executemany('DELETE FROM cache_entry WHERE key = ?', [(key, ) for key in evicted_keys])
+            self._add_bytes(connection, -evicted_bytes)
+
+        if expired_count or evicted_keys:
+            self._count(connection, 'evictions', expired_count + len(evicted_keys))
+
+    # ---- cache interface (see Flask-Caching's BaseCache) ----
+    def _get(self, connection, key):
+        row = connection.execute('SELECT value, expires FROM cache_entry WHERE key = ?', (key, )).fetchone()
+
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+
+        return row[0]
+
+    def _set(self, connection, key, value, timeout):
+        row = connection.execute('SELECT size FROM cache_entry WHERE key = ?', (key, )).fetchone()
+
+        connection.execute('INSERT OR REPLACE INTO cache_entry (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)',
+                           (key, value, len(value), self._expires(timeout), time.time()))
+        self._add_bytes(connection, len(value) - (row[0] if row else 0))
+
+    def _delete(self, connection, condition, parameters):
+        deleted_count, deleted_bytes = connection.execute(f'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entry WHERE {condition}', parameters).fetchone()
+
+        if deleted_count:
+            connection.execute(f'DELETE FROM cache_entry WHERE {condition}', parameters)
+            self._add_bytes(connection, -deleted_bytes)
+
+        return deleted_count
+
+    def get(self, key):
+        return self.get_many(key)[0]
+
+    # (several keys in one read, e.g. the options of every dropdown below the one that changed)
+    def get_many(self, *keys):
+        with self._transaction(read_only=True) as connection:
+            values = [self._get(connection, key) for key in keys]
+
+        self._record_access([key for key, value in zip(keys, values) if value is not None], sum(value is None for value in values))
+        self._flush_pending()
+
+        return [None if value is None else pickle.loads(value) for value in values]
+
+    def set(self, key, value, timeout=None):
+        return self.set_many({key: value}, timeout)
+
+    def set_many(self, mapping, timeout=None):
+        values = {key: pickle.dumps(value, pickle.HIGHEST_PROTOCOL) for key, value in mapping.items()}
+
+        # (values bigger than the whole budget aren't cached since they'd evict everything else and then themselves)
+        too_big = [key for key, value in values.items() if len(value) > self.max_bytes]
+
+        with self._transaction() as connection:
+            self._write_pending(connection)
+
+            for key, value in values.items():
+                if key not in too_big:
+                    self._set(connection, key, value, timeout)
+
+            self._evict(connection)
+
+        return not too_big
+
+    # (the check & the insert are in one transaction, so that when several workers add the same key at once only one of them succeeds, e.g. for the results leases in results.py)
+    def add(self, key, value, timeout=None):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        with self._transaction() as connection:
+            self._write_pending(connection)
+
+            row = connection.execute('SELECT expires FROM cache_entry WHERE key = ?', (key, )).fetchone()
+            if row is not None and (row[0] is None or row[0] > time.time()):
+                return False
+
+            self._set(connection, key, value, timeout)
+            self._evict(connection)
+
+        return True
+
+    def has(self, key):
+        row = self._connection().execute('SELECT expires FROM cache_entry WHERE key = ?', (key, )).fetchone()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def delete(self, key):
+        with self._transaction() as connection:
+            self._write_pending(connection)
+
+            return self._delete(connection, 'key = ?', (key, )) > 0
+
+    # (deletes a batch at a time so that other workers aren't kept waiting for the write lock while e.g. a swapped-out data set's entries are purged [see datasets.py]; returns the number deleted)
+    def delete_prefix(self, prefix, batch_size=1000):
+        deleted_count = 0
+
+        while True:
+            with self._transaction() as connection:
+                count = self._delete(connection, 'key IN (SELECT key FROM cache_entry WHERE key >= ? AND key < ? LIMIT ?)', (prefix, prefix + '\uffff', batch_size))
+            deleted_count += count
+
+            if count < batch_size:
+                return deleted_count
+
+    def clear(self):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM cache_entry')
+            connection.execute("UPDATE cache_stat SET count = 0 WHERE name = 'bytes'")
+
+        return True
+
+    # ---- stats ----
+    # hit/miss/eviction counts (across all workers, since the cache was created; this worker's pending counts are written first) plus the current number of entries and their total size
+    def stats(self):
+        with self._transaction() as connection:
+            self._write_pending(connection)
+
+        connection = self._connection()
+        stats = dict(connection.execute('SELECT name, count FROM cache_stat'))
+        stats['entries'] = connection.execute('SELECT COUNT(*) FROM cache_entry').fetchone()[0]
+
+        return stats
+
+
+
+# (factory function with the signature Flask-Caching expects for a custom CACHE_TYPE)
+def sqlite_lru(app, config, args, kwargs):
+    kwargs.update(dict(
+        path=os.path.join(config['CACHE_DIR'], 'cache.db'),
+        max_bytes=config['CACHE_MAX_BYTES']
+    ))
+
+    return SQLiteLRUCache(*args, **kwargs)
@@ -0,0 +1,229 @@
+import collections
+import json
+import os
+import time
+import numpy as np
+from app import server_flask, db
+from app.lookups import coded_columns, code_labels, column_name
+from app.database import database_file, dataset_version
+
+
+# the utilization columns held in the columnar table; (the string columns are dictionary encoded, i.e. each value is stored as an integer code that points to its label)
+string_columns = ['state', 'city', 'zip_code', 'place_of_service', 'provider_type', 'credential', 'hcpcs_code']
+number_columns = collections.OrderedDict([
+    ('record_id', np.int64),
+    ('provider_id', np.int64),
+    ('num_beneficiaries', np.int64),
+    ('avg_allowed', np.float64),
+    ('avg_charged', np.float64),
+    ('avg_paid', np.float64)
+])
+
+# (the rows returned have the same attribute names as the SQL results so they can be used interchangeably)
+TenTableRow = collections.namedtuple('TenTableRow', ['provider_id', 'num_beneficiaries', 'avg_charged', 'avg_allowed', 'avg_paid'])
+
+# the loaded columnar table (None if the columnar engine isn't turned on in the config file, in which case the database is queried instead)
+columnar_table = None
+
+
+
+# COLUMNAR TABLE
+# the utilization table held in memory as one NumPy array per column.  Filters are applied as boolean masks over whole columns (vs. row by row) which is much faster than SQLite for the
+# dashboard's queries since they only ever filter on a fixed set of columns and only need a few columns back.
+class ColumnarTable(object):
+    def __init__(self, codes, labels, numbers):
+        self.codes = codes                          # string column -> array of integer codes (one per row)
+        self.labels = labels                        # string column -> array of labels, sorted, so the codes are in the same order as the labels
+        self.numbers = numbers                      # number column -> array of values (one per row)
+
+        # label -> code, per string column, to look up filter values
+        self.label_codes = {col: {label: code for code, label in enumerate(labels[col])} for col in labels}
+
+    def __len__(self):
+        return len(self.numbers['record_id'])
+
+    # (filters are the non-blank dropdown values, in lists, by column name, same as for the SQL queries)
+    def mask(self, filters):
+        mask = np.ones(len(self), dtype=bool)
+
+        for col, value in filters.items():
+            # (values that aren't in the data set match nothing, same as in SQL)
+            value_codes = [self.label_codes[col][label] for label in value if label in self.label_codes[col]]
+            mask &= np.isin(self.codes[col], value_codes)
+
+        return mask
+
+    # ---- distinct options (i.e. dropdown options) ----
+    # the distinct values of a column within the filtered rows, in order
+    def distinct(self, col, filters):
+        counts = np.bincount(self.codes[col][self.mask(filters)], minlength=len(self.labels[col]))
+        return self.labels[col][np.flatnonzero(counts)].tolist()
+
+    # ---- top n (i.e. ten table) ----
+    # the first n filtered rows ordered by a column, descending for "Top" and ascending for "Bottom"; (record id breaks ties in the same direction, like the SQL query)
+    def top_n(self, filters, order_by_col, rank_position, n):
+        rows = np.flatnonzero(self.mask(filters))
+        values = self.numbers[order_by_col][rows]
+
+        # narrow the rows down to the ones that could be in the first n (including ties) before sorting, so that only a handful of rows are sorted
+        if len(rows) > n:
+            if rank_position == 'Top':
+                cutoff = np.partition(values, len(values) - n)[len(values) - n]
+                keep = values >= cutoff
+            else:
+                cutoff = np.partition(values, n - 1)[n - 1]
+                keep = values <= cutoff
+
+            rows = rows[keep]
+            values = values[keep]
+
+        # (lexsort sorts by the last key first)
+        order = np.lexsort((self.numbers['record_id'][rows], values))
+        order = order[::-1] if rank_position == 'Top' else order
+        rows = rows[order[:n]]
+
+        return [TenTableRow(*(self.numbers[col][row].item() for col in TenTableRow._fields)) for row in rows]
+
+    # ---- histogram input (i.e. bar chart) ----
+    # the avg charged amounts and patients of the filtered rows, to be bucketed and totaled (see histogram.py)
+    def charged_values(self, filters):
+        mask = self.mask(filters)
+        return self.numbers['avg_charged'][mask], self.numbers['num_beneficiaries'][mask]
+
+
+
+# READ COLUMNAR TABLE
+# read the utilization table into a columnar table, in chunks so the rows don't all need to be held as Python objects at once
+def read_columnar_table(chunk_size=100000):
+    lookups = {col: {} for col in string_columns}
+    codes = {col: [] for col in string_columns}
+    numbers = {col: [] for col in number_columns}
+
+    # (the coded columns are read as their codes, which are encoded like the strings and swapped for their labels below)
+    result = db.engine.execute(f"SELECT {', '.join([column_name(col) for col in string_columns] + list(number_columns))} FROM utilization ORDER BY record_id")
+
+    while True:
+        chunk = result.fetchmany(chunk_size)
+        if not chunk:
+            break
+
+        chunk_columns = list(zip(*chunk))
+
+        # encode strings in the order they're first seen; (these codes are re-mapped to the sorted order of the labels after loading)
+        for col, values in zip(string_columns, chunk_columns):
+            lookup = lookups[col]
+            codes[col].append(np.array([lookup.setdefault(value, len(lookup)) for value in values], dtype=np.int32))
+
+        for (col, dtype), values in zip(number_columns.items(), chunk_columns[len(string_columns):]):
+            numbers[col].append(np.array(values, dtype=dtype))
+
+    labels = {}
+    for col in string_columns:
+        unsorted_labels = [code_labels(col)[code] for code in lookups[col]] if col in coded_columns else list(lookups[col])
+        sorted_positions = sorted(range(len(unsorted_labels)), key=unsorted_labels.__getitem__)
+
+        # (maps each first-seen code to its position in the sorted labels)
+        remap = np.empty(len(unsorted_labels), dtype=np.int32)
+        remap[sorted_positions] = np.arange(len(unsorted_labels), dtype=np.int32)
+
+        labels[col] = np.array([unsorted_labels[position] for position in sorted_positions], dtype=object)
+        codes[col] = remap[np.concatenate(codes[col])] if codes[col] else np.array([], dtype=np.int32)
+
+    for col, dtype in number_columns.items():
+        numbers[col] = np.concatenate(numbers[col]) if numbers[col] else np.array([], dtype=dtype)
+
+    return ColumnarTable(codes, labels, numbers)
+
+
+
+# ---- snapshots ----
+# A snapshot is a columnar table saved to a folder as one .npy file per column (the integer codes for the string columns, plus a JSON file of each string column's labels) and a manifest.json
+# that lists them.  Loading a snapshot memory maps the .npy files read-only vs. reading them into memory, so the gunicorn workers share one copy of the data (in the operating system's page cache)
+# and a worker starts up without reading the whole table.
+# (The manifest also has the version of the database file the snapshot was exported from [see dataset_version() in database.py], and a snapshot is only used with that same file, so the app doesn't
+# serve a copy of old data once the database is rebuilt or swapped.)
+snapshot_format_version = 1
+
+
+# a snapshot that's not of the database file the app is using
+class StaleSnapshotError(ValueError):
+    pass
+
+
+# SAVE COLUMNAR SNAPSHOT
+# (the folder must not exist yet; the files are written to a temporary folder that's renamed once they're all written, so a snapshot that's in use [i.e. memory mapped] is never written over)
+def save_columnar_snapshot(table, directory, source='', version=''):
+    if os.path.exists(directory):
+        raise FileExistsError(f'{directory} already exists.')
+
+    temp_directory = f'{directory}.tmp{os.getpid()}'
+    os.makedirs(temp_directory)
+
+    manifest = {'format_version': snapshot_format_version, 'rows': len(table), 'source': source, 'dataset_version': version, 'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'string_columns': {}, 'number_columns': {}}
+
+    for col in string_columns:
+        np.save(os.path.join(temp_directory, f'{col}.codes.npy'), table.codes[col])
+        with open(os.path.join(temp_directory, f'{col}.labels.json'), 'w') as labels_file:
+            json.dump(table.labels[col].tolist(), labels_file)
+
+        manifest['string_columns'][col] = {'codes': f'{col}.codes.npy', 'labels': f'{col}.labels.json', 'dtype': str(table.codes[col].dtype)}
+
+    for col in number_columns:
+        np.save(os.path.join(temp_directory, f'{col}.npy'), table.numbers[col])
+        manifest['number_columns'][col] = {'values': f'{col}.npy', 'dtype': str(table.numbers[col].dtype)}
+
+    with open(os.path.join(temp_directory, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+    os.rename(temp_directory, directory)
+
+    return manifest
+
+
+# LOAD COLUMNAR SNAPSHOT
+# (raises StaleSnapshotError if a version is given and the snapshot was exported from another version of the database file)
+def load_columnar_snapshot(directory, version=None):
+    with open(os.path.join(directory, 'manifest.json')) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if manifest['format_version'] != snapshot_format_version:
+        raise ValueError(f"{directory} is a version {manifest['format_version']} snapshot (expected version {snapshot_format_version}).")
+
+    if version is not None and manifest.get('dataset_version') != version:
+        raise StaleSnapshotError(f"{directory} is a snapshot of dataset {manifest.get('dataset_version') or '[unknown]'}, not of the database's dataset {version}.")
+
+    codes, labels, numbers = {}, {}, {}
+
+    for col in string_columns:
+        files = manifest['string_columns'][col]
+        codes[col] = np.load(os.path.join(directory, files['codes']), mmap_mode='r')
+        with open(os.path.join(directory, files['labels'])) as labels_file:
+            labels[col] = np.array(json.load(labels_file), dtype=object)
+
+    for col in number_columns:
+        numbers[col] = np.load(os.path.join(directory, manifest['number_columns'][col]['values']), mmap_mode='r')
+
+    if any(len(values) != manifest['rows'] for values in list(codes.values()) + list(numbers.values())):
+        raise ValueError(f'{directory} has columns with different numbers of rows.')
+
+    return ColumnarTable(codes, labels, numbers)
+
+
+
+# LOAD COLUMNAR TABLE
+# load the columnar table the queries use, from a snapshot if given (see above) or else from the database; (a snapshot of another version of the database file is refused and the table is read
+# from the database instead, with an error logged, since the snapshot would serve old data)
+def load_columnar_table(snapshot_directory=None):
+    global columnar_table
+
+    table = None
+
+    if snapshot_directory:
+        try:
+            table = load_columnar_snapshot(snapshot_directory, dataset_version(database_file(server_flask)))
+        except StaleSnapshotError as error:
+            server_flask.logger.error(f'Not using the columnar snapshot: {error}  Reading the columnar table from the database instead; export a new snapshot (flask export-columnar-snapshot).')
+
+    columnar_table = table if table is not None else read_columnar_table()
+
+    return columnar_table
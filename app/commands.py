@@ -0,0 +1,271 @@
+import json
+import os
+import sqlite3
+import click
+from app import server_flask, db
+from app.models import Utilization, ChargedGroupRollup, RankingRollup
+from app.results import charged_group_sql, partition_charged_group_sql
+from app.partitions import partition_table, partition_table_name
+from app.lookups import column_name
+from app.query_plans import check_query_plans
+from app.warmup import default_selections, load_selections, warm_cache
+from app.benchmark import benchmark
+from app.columnar import read_columnar_table, save_columnar_snapshot
+from app.database import database_file, dataset_version, swap_database_link
+
+
+# (migrations are SQL files named with their version number first, e.g. 0001_composite_indexes.sql)
+migrations_dir = os.path.join(os.path.dirname(__file__), 'migrations')
+
+# the indexes of each state partition, by name suffix: the utilization table's indexes without the state column (see the migrations), plus the ones for no filters other than the state, which the
+# utilization table's state indexes cover
+partition_indexes = {
+    'avg_charged': 'avg_charged, record_id',
+    'num_beneficiaries': 'num_beneficiaries, record_id',
+    'charged_group': f'{partition_charged_group_sql}, num_beneficiaries',
+    'city_avg_charged': 'city_id, avg_charged, record_id',
+    'city_num_beneficiaries': 'city_id, num_beneficiaries, record_id',
+    'city_charged_group': f'city_id, {partition_charged_group_sql}, num_beneficiaries, zip_code, place_of_service_id, provider_type_id, credential_id, hcpcs_code_id',
+    'hcpcs_code_avg_charged': 'hcpcs_code_id, avg_charged, record_id',
+    'hcpcs_code_num_beneficiaries': 'hcpcs_code_id, num_beneficiaries, record_id',
+    'hcpcs_code_charged_group': f'hcpcs_code_id, {partition_charged_group_sql}, num_beneficiaries, city_id, zip_code, place_of_service_id, provider_type_id, credential_id',
+    'zip_code': 'zip_code',
+    'place_of_service_id': 'place_of_service_id',
+    'provider_type_id': 'provider_type_id',
+    'credential_id': 'credential_id'
+}
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ------------------------------------------------- COMMAND LINE (flask) ------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+
+
+# BUILD ROLLUP TABLES
+# (re)builds the rollup tables from the utilization table for each level in the config file; run "flask build-rollups" after the utilization table is loaded or changed.
+# (Note that the window function used for the ranking rollup requires SQLite 3.25+.)
+@server_flask.cli.command('build-rollups')
+def build_rollups():
+    rollup_levels = server_flask.config['ROLLUP_LEVELS']
+    top_k = server_flask.config['ROLLUP_TOP_K']
+
+    for model in [ChargedGroupRollup, RankingRollup]:
+        model.__table__.drop(db.engine, checkfirst=True)
+        model.__table__.create(db.engine)
+
+    for level in rollup_levels:
+        level_name = ','.join(level)
+        # (the coded columns are grouped by their codes, e.g. city_id)
+        level_cols = ''.join(f'{column_name(col)}, ' for col in level)
+        partition_by = f"PARTITION BY {', '.join(column_name(col) for col in level)} " if level else ''
+
+        click.echo(f"Building rollup level: {level_name or '(no filters)'}")
+
+        # ---- bar chart ----
+        # (same groupings as the bar chart query in results.py)
+        db.session.execute(
+            f'INSERT INTO charged_group_rollup (level, {level_cols}charged_group, patients) '
+            f'SELECT :level, {level_cols}{charged_group_sql} AS charged_group, SUM(num_beneficiaries) '
+            f'FROM utilization GROUP BY {level_cols}charged_group',
+            {'level': level_name}
+        )
+
+        # ---- ten table ----
+        # (the top/bottom k records per group, for each rank by column; record id breaks ties like in results.py)
+        for rank_by in ['avg_charged', 'num_beneficiaries']:
+            for rank_position, direction in [('Top', 'DESC'), ('Bottom', 'ASC')]:
+                db.session.execute(
+                    f'INSERT INTO ranking_rollup (level, rank_by, rank_position, {level_cols}rank_value, record_id, provider_id, num_beneficiaries, avg_allowed, avg_charged, avg_paid) '
+                    f'SELECT :level, :rank_by, :rank_position, {level_cols}{rank_by}, record_id, provider_id, num_beneficiaries, avg_allowed, avg_charged, avg_paid '
+                    f'FROM (SELECT *, ROW_NUMBER() OVER ({partition_by}ORDER BY {rank_by} {direction}, record_id {direction}) AS rank_number FROM utilization) '
+                    f'WHERE rank_number <= :top_k',
+                    {'level': level_name, 'rank_by': rank_by, 'rank_position': rank_position, 'top_k': top_k}
+                )
+
+        db.session.commit()
+
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+    click.echo('Rollup tables built.')
+
+
+
+# BUILD STATE PARTITIONS
+# (re)builds the state partitions (see partitions.py) from the utilization table, i.e. a table per state with that state's rows and the partition indexes above, listed in the utilization_partition
+# table; run "flask build-partitions" after the utilization table is loaded or changed, then set STATE_PARTITIONS.  (The partitions take up about as much space as the utilization table.)
+@server_flask.cli.command('build-partitions')
+def build_partitions():
+    if db.engine.dialect.has_table(db.engine, 'utilization_partition'):
+        for table_name, in db.session.execute('SELECT table_name FROM utilization_partition').fetchall():
+            db.session.execute(f'DROP TABLE IF EXISTS {table_name}')
+        db.session.execute('DROP TABLE utilization_partition')
+
+    db.session.execute('CREATE TABLE utilization_partition (state VARCHAR(2) PRIMARY KEY, table_name VARCHAR(20) NOT NULL)')
+
+    columns = ', '.join(column.name for column in Utilization.__table__.columns)
+
+    for state, in db.session.execute('SELECT DISTINCT state FROM utilization ORDER BY state').fetchall():
+        table_name = partition_table_name(state)
+
+        click.echo(f'Building state partition: {table_name}')
+
+        # (the rows are copied in record id order, i.e. the primary key's order, before the indexes are created)
+        partition_table(table_name).create(db.session.connection())
+        db.session.execute(f'INSERT INTO {table_name} ({columns}) SELECT {columns} FROM utilization WHERE state = :state ORDER BY record_id', {'state': state})
+
+        for suffix, index_columns in partition_indexes.items():
+            db.session.execute(f'CREATE INDEX ix_{table_name}_{suffix} ON {table_name} ({index_columns})')
+
+        db.session.execute('INSERT INTO utilization_partition (state, table_name) VALUES (:state, :table_name)', {'state': state, 'table_name': table_name})
+        db.session.commit()
+
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+    click.echo('State partitions built.')
+
+
+
+# MIGRATE
+# applies the migrations (in version order) that haven't been applied to the database yet; (the database's version is kept in SQLite's user_version pragma)
+@server_flask.cli.command('migrate')
+def migrate():
+    db_version = db.session.execute('PRAGMA user_version').scalar()
+
+    for file_name in sorted(os.listdir(migrations_dir)):
+        version = int(file_name.split('_')[0])
+
+        if version > db_version:
+            click.echo(f'Applying migration: {file_name}')
+
+            with open(os.path.join(migrations_dir, file_name)) as migration_file:
+                # (executescript is used since a migration can have multiple statements; it's only available on the underlying sqlite3 connection)
+                connection = db.engine.raw_connection()
+                try:
+                    connection.executescript(migration_file.read() + f'\nPRAGMA user_version = {version};')
+                finally:
+                    connection.close()
+
+            db_version = version
+
+    click.echo(f'Database is at version {db_version}.')
+
+
+
+# SWAP DATASET
+# points the database file (a symbolic link, see datasets.py) at another database file, e.g. a new year's data, in one step; the app's workers switch to it within DATASET_SWAP_CHECK_INTERVAL
+# seconds without a restart.  The new file needs to have been migrated to the latest version and its rollup tables [and state partitions, if turned on] built first.  (Not with a columnar
+# snapshot [COLUMNAR_SNAPSHOT_DIR], which is a copy of the current data set, in which case the app is restarted with a snapshot of the new one instead.)
+@server_flask.cli.command('swap-dataset')
+@click.argument('new_database_file')
+def swap_dataset(new_database_file):
+    link = database_file(server_flask)
+
+    # (a columnar snapshot is a copy of the current data set, which the workers would otherwise stop using [see switch_dataset() in datasets.py] until they're restarted)
+    if server_flask.config['COLUMNAR_ENGINE'] and server_flask.config['COLUMNAR_SNAPSHOT_DIR']:
+        raise click.UsageError(f"The columnar engine is using the snapshot in {server_flask.config['COLUMNAR_SNAPSHOT_DIR']}, which is a copy of the current dataset; export a snapshot of the new "
+                               f"dataset (flask export-columnar-snapshot) and restart the app with it and DATABASE_URL pointing to {new_database_file} instead.")
+
+    if os.path.exists(link) and not os.path.islink(link):
+        raise click.UsageError(f'{link} is a file, not a symbolic link; move it (e.g. to datasets/app-2017.db) and link to it with "ln -s" first.')
+
+    latest_version = max(int(file_name.split('_')[0]) for file_name in os.listdir(migrations_dir))
+
+    # (the new file is checked read-only so that it isn't created if it doesn't exist)
+    if not os.path.exists(new_database_file):
+        raise click.BadParameter(f'{new_database_file} does not exist.', param_hint='NEW_DATABASE_FILE')
+
+    connection = sqlite3.connect(f'file:{os.path.abspath(new_database_file)}?mode=ro', uri=True)
+    try:
+        db_version = connection.execute('PRAGMA user_version').fetchone()[0]
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        connection.close()
+
+    if db_version != latest_version:
+        raise click.BadParameter(f'{new_database_file} is at version {db_version}, not {latest_version}; run "flask migrate" against it first.', param_hint='NEW_DATABASE_FILE')
+
+    if server_flask.config['ROLLUP_LEVELS'] and not {'charged_group_rollup', 'ranking_rollup'} <= tables:
+        raise click.BadParameter(f'{new_database_file} has no rollup tables; run "flask build-rollups" against it first.', param_hint='NEW_DATABASE_FILE')
+
+    if server_flask.config['STATE_PARTITIONS'] and 'utilization_partition' not in tables:
+        raise click.BadParameter(f'{new_database_file} has no state partitions; run "flask build-partitions" against it first.', param_hint='NEW_DATABASE_FILE')
+
+    swap_database_link(link, new_database_file)
+
+    click.echo(f'{link} now points to {os.path.abspath(new_database_file)}.')
+
+
+
+# CHECK QUERY PLANS
+# explains the queries the callbacks run and exits with an error if any of them read a whole table or sort with a temp b-tree (e.g. because an index is missing or a query changed so
+# that it no longer matches its index); run "flask check-query-plans" after changing the queries or indexes.
+@server_flask.cli.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Show the query plan of every query.')
+def check_query_plans_command(verbose):
+    plans, problems = check_query_plans()
+
+    if verbose:
+        for name, plan in plans:
+            click.echo(name)
+            for step in plan:
+                click.echo(f'    {step}')
+
+    for name, step in problems:
+        click.echo(f'PROBLEM - {name}: {step}', err=True)
+
+    if problems:
+        raise SystemExit(1)
+
+    click.echo(f'All {len(plans)} query plans use indexes without temp b-tree sorts (other than the accepted ones, see query_plans.py).')
+
+
+
+
+# WARM CACHE
+# calculates & caches the results of the default selection plus the selections in a JSON file (see warmup.py), e.g. after a deploy or once the cache has expired
+@server_flask.cli.command('warm-cache')
+@click.option('--selections-file', default=None, help='JSON file with a list of selections to warm the cache with, in addition to the default selection.')
+def warm_cache_command(selections_file):
+    selections = default_selections()
+
+    selections_file = selections_file or server_flask.config['CACHE_WARMUP_SELECTIONS_FILE']
+    if selections_file:
+        selections += load_selections(selections_file)
+
+    calculated_count = warm_cache(selections)
+
+    click.echo(f'Warmed the cache with {len(selections)} selections ({calculated_count} calculated, {len(selections) - calculated_count} already cached).')
+
+
+
+# EXPORT COLUMNAR SNAPSHOT
+# writes the utilization table to a columnar snapshot folder (see columnar.py) that the columnar engine can memory map (set COLUMNAR_SNAPSHOT_DIR in the config file to it); run this again, to a new
+# folder, after the database file is changed (the app only uses a snapshot of the database file it's using, so export it after the rollup tables & partitions are built)
+@server_flask.cli.command('export-columnar-snapshot')
+@click.argument('directory')
+def export_columnar_snapshot(directory):
+    if os.path.exists(directory):
+        raise click.BadParameter(f'{directory} already exists; export to a new folder (a snapshot can be in use by the app, so it is never written over).', param_hint='DIRECTORY')
+
+    manifest = save_columnar_snapshot(read_columnar_table(), directory, source=str(db.engine.url), version=dataset_version(database_file(server_flask)))
+
+    click.echo(f"Exported {manifest['rows']:,} rows to {directory}.")
+
+
+
+# BENCHMARK
+# times the callbacks and the Excel export against the configured database and writes the results as JSON (see benchmark.py in the app folder; to compare data set sizes, use benchmark.py in the
+# project folder instead, which creates synthetic databases and runs this for each one).  Note that this clears the cache.
+@server_flask.cli.command('benchmark')
+@click.option('--repeat', default=5, help='Number of times to run each callback.')
+@click.option('--output', default=None, help='File to write the JSON results to (instead of printing them).')
+def benchmark_command(repeat, output):
+    results = benchmark(repeat)
+
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        click.echo(json.dumps(results, indent=2))
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+# DATABASE FILE
+# the SQLite file from the database url, made absolute the same way Flask-SQLAlchemy does it (i.e. relative to the app folder)
+def database_file(app):
+    database = make_url(app.config['SQLALCHEMY_DATABASE_URI']).database
+    return database if os.path.isabs(database) else os.path.join(app.root_path, database)
+
+
+
+# CONNECTED FILE
+# the file that connections are opened on: the database file with its symbolic link (if it is one, see datasets.py) resolved when the app starts, and then again only when the process switches to a
+# new dataset (see switch_dataset() in datasets.py) vs. by every connection, so that a process that hasn't switched yet keeps reading the file that what it holds in memory (e.g. the lookup tables)
+# came from, even after the link has been swapped.  (The connections open it through the engine's creator, see engine_options() below.)
+connected_file = None
+
+
+def connect_to_file(file_name):
+    global connected_file
+
+    connected_file = os.path.realpath(file_name)
+
+    return connected_file
+
+
+
+# DATASET VERSION
+# identifies the data in the database file, for the cache keys of things that only depend on the data (the results & dropdown options; see results.py & dropdowns.py): the name [of the file a
+# symbolic link points to, see datasets.py], size & modification time of the file, which change whenever the file is replaced, swapped or written to, so a new data set doesn't serve stale cache entries
+def dataset_version(file_name):
+    if not os.path.exists(file_name):
+        return ''
+
+    stat = os.stat(file_name)
+    return f'{os.path.basename(os.path.realpath(file_name))}-{stat.st_size}-{stat.st_mtime_ns}'
+
+
+# the prefix of the cache keys of a dataset version, so that the cache entries of a data set that has been swapped out can be found & purged (see datasets.py)
+def dataset_cache_prefix(version):
+    return f'dataset_{hashlib.md5(version.encode()).hexdigest()[:12]}_'
+
+
+
+# SWAP DATABASE LINK
+# point the database file, a symbolic link, at another file in one step: a new link is created next to it and renamed over it, which replaces it atomically, so a connection that's opened at the same
+# time gets either the old file or the new one
+def swap_database_link(link, target):
+    temp_link = f'{link}.{os.getpid()}.tmp'
+
+    os.symlink(os.path.abspath(target), temp_link)
+    os.replace(temp_link, link)
+
+
+
+# READ-ONLY CONNECTION
+# a connection to the database file opened as read-only & immutable, i.e. SQLite doesn't lock the file or check whether it has changed (so the file must not be changed while the app is running).
+# mmap_size reads the file through memory mapping vs. read calls (SQLite caps this at its compile time limit, often 2GB), cache_size is in KB, temp storage (e.g. for sorts) is kept in memory and
+# query_only rejects any writes.
+def read_only_connection(database_file, mmap_size, cache_size_kb):
+    connection = sqlite3.connect(f'file:{pathname2url(database_file)}?mode=ro&immutable=1', uri=True, check_same_thread=False)
+
+    for pragma in [f'mmap_size = {mmap_size}', f'cache_size = -{cache_size_kb}', 'temp_store = MEMORY', 'query_only = ON']:
+        connection.execute(f'PRAGMA {pragma}')
+
+    return connection
+
+
+
+# SQLITE POOL SIZE
+# the connections a process can use at the same time, i.e. one per thread that queries: the request thread, the RESULTS_QUERY_THREADS, the STATE_PARTITION_THREADS, the cache warm-up thread and
+# the RESULTS_JOB_WORKERS, if turned on (unless SQLITE_POOL_SIZE is set in the config file).  (The results query & partition threads are each one pool per process that every request & job shares
+# [see run_concurrently() in results.py and fan_out() in partitions.py], so they're added once vs. per request.)
+def sqlite_pool_size(config):
+    if config['SQLITE_POOL_SIZE']:
+        return config['SQLITE_POOL_SIZE']
+
+    return (1 + config['RESULTS_QUERY_THREADS'] + config['STATE_PARTITION_THREADS'] + (1 if config['CACHE_WARMUP_ON_STARTUP'] else 0) +
+            (config['RESULTS_JOB_WORKERS'] if config['RESULTS_JOBS'] else 0))
+
+
+
+# ENGINE OPTIONS
+# SQLAlchemy engine options that open the connections on the connected file (see above) vs. the database url's path, with a new connection for every query [i.e. no pool], which is Flask-SQLAlchemy's
+# default for SQLite files
+def engine_options(app):
+    return {
+        'creator': lambda: sqlite3.connect(connected_file)
+    }
+
+
+# READ-ONLY ENGINE OPTIONS
+# SQLAlchemy engine options that open read-only connections on the connected file and keep them open in a pool, so the pragmas above and SQLite's page cache carry over from query to query.  The pool
+# is per process, so its size is per gunicorn worker; the overflow covers the threads that aren't counted, e.g. the columnar table's loader after a dataset swap (see datasets.py), and a connection
+# that's opened as overflow is closed when it's returned.  (A dataset switch disposes of the pool, so the pooled connections are on the connected file too.)
+def read_only_engine_options(app):
+    pool_size = sqlite_pool_size(app.config)
+
+    return {
+        'creator': lambda: read_only_connection(connected_file, app.config['SQLITE_MMAP_SIZE'], app.config['SQLITE_CACHE_SIZE_KB']),
+        'poolclass': QueuePool,
+        'pool_size': pool_size,
+        'max_overflow': pool_size
+    }
+
+
+
+# PRE-FAULT DATABASE FILE
+# read the whole database file once (and throw the data away) so that it's in the operating system's page cache, i.e. the first queries read from memory vs. disk; (done in a background thread
+# so the app can start serving requests in the meantime)
+def prefault_database_file(file_name, chunk_size=16 * 1024 * 1024):
+    def run():
+        buffer = bytearray(chunk_size)
+
+        with open(file_name, 'rb', buffering=0) as database:
+            while database.readinto(buffer):
+                pass
+
+    thread = threading.Thread(target=run, name='prefault_database_file', daemon=True)
+    thread.start()
+
+    return thread
@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from app import server_flask, db, cache, database, columnar, lookups, layout, interactivity, dropdowns, partitions
+from app.database import database_file, connect_to_file, dataset_version, dataset_cache_prefix, prefault_database_file
+from app.metrics import increment
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ------------------------------------------------------ DATASETS -------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+# The database file (the path in DATABASE_URL) can be a symbolic link to a versioned database file, e.g. app.db -> datasets/app-2018.db, so that a new data set can be loaded into a new file
+# while the app keeps serving the current one, and then swapped in without a restart:
+#
+#   python load_cms_data.py Medicare_Provider_Util_Payment_PUF_CY2018.txt datasets/app-2018.db
+#   DATABASE_URL=sqlite:///datasets/app-2018.db flask migrate && DATABASE_URL=sqlite:///datasets/app-2018.db flask build-rollups
+#   flask swap-dataset datasets/app-2018.db
+#
+# "flask swap-dataset" replaces the link in one step (see swap_database_link() in database.py).  Each worker checks the file's version (see dataset_version() in database.py) at most every
+# DATASET_SWAP_CHECK_INTERVAL seconds, before a request, and when it has changed: the link is resolved and new connections are opened on the file it points to (the queries already running finish on
+# the old one), what's kept in memory from the old file is dropped, and DATASET_VERSION, which every cache key of the results & dropdown options starts with, is changed to the new version.  The old
+# version's cache entries are then purged in a background thread (by one of the workers).  (Until then the worker's connections are opened on the old file [see CONNECTED FILE in database.py], so
+# it doesn't query the new file with what it has in memory from the old one.)
+# (The old file can be deleted once every worker has switched, i.e. after DATASET_SWAP_CHECK_INTERVAL seconds plus the longest request.)
+
+
+# the version of the database file this process is using; (the file's, vs. DATASET_VERSION, which can be set in the config file)
+file_version = dataset_version(database.connected_file)
+checked = 0
+check_lock = threading.Lock()
+
+
+
+# CHECK DATASET
+@server_flask.before_request
+def check_dataset():
+    global checked
+
+    interval = server_flask.config['DATASET_SWAP_CHECK_INTERVAL']
+    if not interval or time.monotonic() - checked < interval:
+        return
+
+    # (one thread per process checks & switches; the others carry on with the current version in the meantime)
+    if not check_lock.acquire(blocking=False):
+        return
+
+    try:
+        checked = time.monotonic()
+
+        # (the link is resolved once so that the version & the file connected to are of the same file, even if the link is swapped again in the meantime)
+        file_name = os.path.realpath(database_file(server_flask))
+        version = dataset_version(file_name)
+
+        if version and version != file_version:
+            switch_dataset(version, file_name)
+    finally:
+        check_lock.release()
+
+
+
+# SWITCH DATASET
+# (everything read from the old file is dropped before the new version is used in the cache keys, so nothing from the old file is cached under the new version)
+def switch_dataset(version, file_name):
+    global file_version
+
+    old_version = server_flask.config['DATASET_VERSION']
+    start = time.perf_counter()
+
+    # ---- connections ----
+    # (new connections are opened on the new file from here on, so the pool is replaced; connections that are in use are closed once they're returned)
+    connect_to_file(file_name)
+    db.engine.dispose()
+
+    if server_flask.config['SQLITE_READ_ONLY'] and server_flask.config['SQLITE_PREFAULT']:
+        prefault_database_file(file_name)
+
+    # ---- in memory ----
+    for function in [lookups.label_codes, lookups.code_labels, lookups.hcpcs_descriptions, interactivity.hcpcs_description_text, layout.state_options, layout.layout_json,
+                     partitions.partition_tables]:
+        function.cache_clear()
+
+    with dropdowns.prefix_indexes_lock:
+        dropdowns.prefix_indexes.clear()
+
+    # (the old file's columnar table is dropped too, and the queries use the database until the new file's table is loaded in a background thread [see below].  A snapshot [COLUMNAR_SNAPSHOT_DIR]
+    # is a copy of a particular data set, so with one the columnar engine stays off until the app is restarted with a snapshot of the new data set; "flask swap-dataset" refuses to swap in that case.)
+    if server_flask.config['COLUMNAR_ENGINE']:
+        columnar.columnar_table = None
+
+        if server_flask.config['COLUMNAR_SNAPSHOT_DIR']:
+            server_flask.logger.warning('Turned the columnar engine off since COLUMNAR_SNAPSHOT_DIR is a snapshot of the old dataset; export one for the new dataset and restart the app with it.')
+
+    file_version = version
+    server_flask.config['DATASET_VERSION'] = version
+
+    if server_flask.config['COLUMNAR_ENGINE'] and not server_flask.config['COLUMNAR_SNAPSHOT_DIR']:
+        start_columnar_thread(version)
+
+    increment('dataset_swaps_total')
+    server_flask.logger.info(f'Switched from dataset {old_version} to {version} in {time.perf_counter() - start:.1f} seconds.')
+
+    # ---- old cache entries ----
+    # (the first worker to switch purges them)
+    if old_version and cache.add(f'dataset_purge_{dataset_cache_prefix(old_version)}', True, timeout=server_flask.config['DATASET_PURGE_TIMEOUT']):
+        start_purge_thread(old_version)
+
+
+
+# LOAD COLUMNAR TABLE
+# read the new dataset's columnar table (see columnar.py) in a background thread, off the request path, and swap it in once it's read; (unless the dataset has been switched again in the meantime,
+# in which case the next version's thread loads its table instead)
+def load_dataset_columnar_table(version):
+    start = time.perf_counter()
+
+    try:
+        with server_flask.app_context():
+            table = columnar.read_columnar_table()
+    except Exception:
+        server_flask.logger.exception(f'Failed to load the columnar table of dataset {version}; the database is queried instead.')
+        return None
+
+    # (the lock keeps a switch from happening between the check & the swap)
+    with check_lock:
+        if file_version != version:
+            return None
+
+        columnar.columnar_table = table
+
+    server_flask.logger.info(f'Loaded the columnar table of dataset {version} in {time.perf_counter() - start:.1f} seconds.')
+
+    return table
+
+
+def start_columnar_thread(version):
+    thread = threading.Thread(target=load_dataset_columnar_table, args=(version, ), name='load_dataset_columnar_table', daemon=True)
+    thread.start()
+
+    return thread
+
+
+
+# PURGE DATASET CACHE
+# delete the cache entries of a dataset version, in a background thread; (only the SQLite LRU cache can delete entries by their prefix, the entries of other cache types expire instead)
+def purge_dataset_cache(version):
+    backend = cache.cache
+
+    if not hasattr(backend, 'delete_prefix'):
+        server_flask.logger.info(f'Not purging the cache entries of dataset {version}; the {server_flask.config["CACHE_TYPE"]} cache type can\'t delete entries by prefix.')
+        return 0
+
+    deleted_count = backend.delete_prefix(dataset_cache_prefix(version))
+
+    increment('dataset_cache_purged_total', deleted_count)
+    server_flask.logger.info(f'Purged {deleted_count:,} cache entries of dataset {version}.')
+
+    return deleted_count
+
+
+def start_purge_thread(version):
+    thread = threading.Thread(target=purge_dataset_cache, args=(version, ), name='purge_dataset_cache', daemon=True)
+    thread.start()
+
+    return thread
@@ -0,0 +1,235 @@
+import bisect
+import collections
+import hashlib
+import pickle
+import threading
+from sqlalchemy import literal, union_all
+from app import server_flask, db, cache, columnar
+from app.models import DropdownCombination
+from app.lookups import column, label, filter_query
+from app.database import dataset_cache_prefix
+from app.metrics import increment
+
+
+# dropdowns ordered from the most upstream to the most downstream; (the options of each dropdown are filtered by the values of all of the dropdowns above it)
+dropdown_columns = ['state', 'city', 'zip_code', 'place_of_service', 'provider_type', 'credential', 'hcpcs_code']
+
+# default value of the state dropdown (used in layout.py); (the state dropdown has no upstream dropdowns it depends on so it's not cleared like the others)
+default_state_value = 'TN'
+
+# (note that state is excluded since its default value is set in layout.py from the value above)
+dropdown_default_values = {
+    'city':['Nashville'],
+    'zip_code': '',                         # using [''] causes problems so only using ''
+    'place_of_service': ['Non-Facility'],
+    'provider_type': ['Family Practice', 'General Practice'],
+    'credential': '',
+    'hcpcs_code': ['99213', '99214', '99215']
+}
+
+# the dropdowns that are searched as the user types when DROPDOWN_TYPEAHEAD is turned on (see TYPEAHEAD below)
+typeahead_columns = server_flask.config['DROPDOWN_TYPEAHEAD_COLUMNS'] if server_flask.config['DROPDOWN_TYPEAHEAD'] else []
+
+
+
+# RESOLVE THE OPTIONS & VALUES OF ALL DROPDOWNS DOWNSTREAM OF THE ONE THAT CHANGED
+# (When a dropdown's value changes, every dropdown below it is cleared [or set to its default value when the app first loads] and its options are refreshed.  Since the values
+# of the downstream dropdowns are known up front, the options of all of them can be calculated at once instead of one dropdown at a time.  One query is built per downstream
+# dropdown and they're combined with UNION ALL so that the database is only hit once.)
+def dropdowns_filters(selections, trigger_column, loaded_value):
+    filters = {}
+    dropdown_filters = {}
+    dropdown_values = {}
+
+    trigger_position = dropdown_columns.index(trigger_column)
+
+    # the values of the trigger dropdown and the ones above it stay as they are and filter the options of every downstream dropdown
+    for col in dropdown_columns[:trigger_position + 1]:
+        value = selections.get(col)
+
+        # if not blank, ensure values are in a list; (note that there are no blank or NULL values, but there are "[unknown]" values, in the dataset)
+        value = [value, ] if value and not isinstance(value, list) else value
+
+        if value: filters[col] = value
+
+    for col in dropdown_columns[trigger_position + 1:]:
+        # use the default dropdown value if applicable
+        dropdown_values[col] = '' if loaded_value else dropdown_default_values[col]
+
+        dropdown_filters[col] = dict(filters)
+
+        # the new value of this dropdown also filters the options of the dropdowns below it (only applicable when default values are used)
+        value = dropdown_values[col]
+        value = [value, ] if value and not isinstance(value, list) else value
+        if value: filters[col] = value
+
+    return dropdown_filters, dropdown_values
+
+
+def dropdown_options_query(col, filters):
+    # build query (the dropdown's name is included so the results can be split back up per dropdown)
+    # (the options of the coded columns come back as codes and are turned into labels in query_dropdown_options())
+    query = DropdownCombination.query.with_entities(literal(col).label('dropdown'), column(DropdownCombination, col).label('option')).group_by(column(DropdownCombination, col))
+    query = filter_query(query, DropdownCombination, filters)
+
+    return query.statement
+
+
+def dropdowns_queries(selections, trigger_column, loaded_value):
+    dropdown_filters, dropdown_values = dropdowns_filters(selections, trigger_column, loaded_value)
+    queries = [dropdown_options_query(col, filters) for col, filters in dropdown_filters.items()]
+
+    return queries, dropdown_values
+
+
+# the options of each dropdown (by column) given its filters, in one query
+def query_dropdown_options(dropdown_filters):
+    queries = [dropdown_options_query(col, filters) for col, filters in dropdown_filters.items()]
+
+    dropdown_options = {col: [] for col in dropdown_filters}
+
+    # (sorted in Python vs. in the query since SQLite doesn't allow an ORDER BY per query within a UNION ALL; the ordering is the same as the "order by" the options used to have)
+    options = [(result.dropdown, label(result.dropdown, result.option)) for result in db.session.execute((union_all(*queries) if len(queries) > 1 else queries[0]).execution_options(metric='dropdown_options'))]
+
+    for dropdown, option in sorted(options, key=lambda option: option[1]):
+        dropdown_options[dropdown].append({'label': option, 'value': option})
+
+    return dropdown_options
+
+
+
+# DROPDOWN OPTIONS CACHE KEY
+# the options of a dropdown only depend on the data and the values of the dropdowns above it, so they're cached (in the same cache as the results, i.e. shared by the gunicorn workers) by the
+# dropdown, its filters with the values sorted [so the order they were picked in doesn't matter] and the dataset version [a key prefix, see database.py, so a new data set doesn't get the options of
+# the old one]
+def canonical_filters(filters):
+    return tuple((filter_col, tuple(sorted(filters[filter_col]))) for filter_col in dropdown_columns if filter_col in filters)
+
+
+def dropdown_options_cache_key(col, filters):
+    return dataset_cache_prefix(server_flask.config['DATASET_VERSION']) + 'dropdown_options_' + hashlib.md5(pickle.dumps((col, canonical_filters(filters)))).hexdigest()
+
+
+
+# the (full) options of each dropdown (by column) given its filters, from the cache or else calculated & cached
+def dropdowns_options(dropdown_filters):
+    # cached options first; (the cache is read & written once for all of the dropdowns)
+    cache_keys = {col: dropdown_options_cache_key(col, filters) for col, filters in dropdown_filters.items()}
+    dropdown_options = {col: options for col, options in zip(cache_keys, cache.get_many(*cache_keys.values())) if options is not None}
+
+    missing_filters = {col: filters for col, filters in dropdown_filters.items() if col not in dropdown_options}
+
+    increment('dropdown_cache_requests_total', len(dropdown_options), result='hit')
+    increment('dropdown_cache_requests_total', len(missing_filters), result='miss')
+
+    if missing_filters:
+        # (when the columnar engine is turned on, the options come from memory instead of the database; the table is read once since it's dropped while a new dataset's table is loaded)
+        table = columnar.columnar_table
+
+        if table is not None:
+            missing_options = {col: [{'label': option, 'value': option} for option in table.distinct(col, filters)] for col, filters in missing_filters.items()}
+        else:
+            missing_options = query_dropdown_options(missing_filters)
+
+        cache.set_many({cache_keys[col]: options for col, options in missing_options.items()}, timeout=server_flask.config['DROPDOWN_CACHE_TIMEOUT'])
+        dropdown_options.update(missing_options)
+
+    return {col: dropdown_options[col] for col in dropdown_filters}
+
+
+def resolve_dropdowns(selections, trigger_column, loaded_value):
+    dropdown_filters, dropdown_values = dropdowns_filters(selections, trigger_column, loaded_value)
+    dropdown_options = dropdowns_options(dropdown_filters)
+
+    # (the typeahead dropdowns with a lot of options only get the first few of them, plus their values)
+    for col in typeahead_columns:
+        if col in dropdown_options:
+            dropdown_options[col] = typeahead_options(col, dropdown_filters[col], dropdown_options[col], dropdown_values[col])
+
+    return dropdown_options, dropdown_values
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ------------------------------------------------------ TYPEAHEAD ------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+# With no upstream selections, the city, zip code & HCPCS code dropdowns have tens of thousands of options, which make for a large callback response and a slow dropdown in the browser.  When
+# DROPDOWN_TYPEAHEAD is turned on, a dropdown in DROPDOWN_TYPEAHEAD_COLUMNS with more than DROPDOWN_TYPEAHEAD_LIMIT options only gets the first DROPDOWN_TYPEAHEAD_LIMIT of them (plus its selected
+# values), and the others are found by typing: dropdowns_update is also triggered by the dropdown's search value and returns the first DROPDOWN_TYPEAHEAD_LIMIT options that start with it (see
+# interactivity.py), so the response stays the same size however many options there are.
+# (The options are searched in a sorted index per dropdown & upstream selections that's built from the full options [i.e. the cached ones] and kept in memory, in each process, for the
+# DROPDOWN_TYPEAHEAD_INDEXES most recently used selections.)
+
+
+# PREFIX INDEX
+# a dropdown's options sorted case-insensitively, so the ones that start with some text are next to each other and found with a binary search
+class PrefixIndex(object):
+    def __init__(self, options):
+        entries = sorted((option.casefold(), option) for option in options)
+        self.keys = [key for key, _ in entries]
+        self.options = [option for _, option in entries]
+
+    def search(self, prefix, limit):
+        prefix = prefix.casefold()
+        matches = []
+
+        for position in range(bisect.bisect_left(self.keys, prefix), len(self.keys)):
+            if len(matches) == limit or not self.keys[position].startswith(prefix):
+                break
+            matches.append(self.options[position])
+
+        return matches
+
+
+prefix_indexes = collections.OrderedDict()
+prefix_indexes_lock = threading.Lock()
+
+
+# the prefix index of a dropdown given its filters; (built from its options if given, else from its cached/calculated options, and keyed by the dataset version like the options cache)
+def prefix_index(col, filters, options=None):
+    key = (server_flask.config['DATASET_VERSION'], col, canonical_filters(filters))
+
+    with prefix_indexes_lock:
+        if key in prefix_indexes:
+            prefix_indexes.move_to_end(key)
+            return prefix_indexes[key]
+
+    if options is None:
+        options = dropdowns_options({col: filters})[col]
+    index = PrefixIndex(option['value'] for option in options)
+
+    with prefix_indexes_lock:
+        prefix_indexes[key] = index
+        while len(prefix_indexes) > server_flask.config['DROPDOWN_TYPEAHEAD_INDEXES']:
+            prefix_indexes.popitem(last=False)
+
+    return index
+
+
+# (the ones with the most options, i.e. with nothing selected above them)
+def load_prefix_indexes():
+    for col in typeahead_columns:
+        prefix_index(col, {})
+
+
+# the options a typeahead dropdown gets: the ones that start with the search value (the first ones if there's no search value), with its selected values included so they stay selected
+def typeahead_options(col, filters, options=None, value=None, search_value=''):
+    limit = server_flask.config['DROPDOWN_TYPEAHEAD_LIMIT']
+
+    # (all of them if there aren't many)
+    if options is not None and len(options) <= limit:
+        return options
+
+    value = [value, ] if value and not isinstance(value, list) else value or []
+
+    matches = prefix_index(col, filters, options).search(search_value or '', limit)
+
+    return [{'label': option, 'value': option} for option in [option for option in value if option not in matches] + matches]
+
+
+# the options of a typeahead dropdown for its search value, given the values of all of the dropdowns
+def search_dropdown_options(col, search_value, selections):
+    # (filtered by the dropdowns above it, same as when its options are refreshed)
+    dropdown_filters, _ = dropdowns_filters(selections, dropdown_columns[dropdown_columns.index(col) - 1], 1)
+
+    return typeahead_options(col, dropdown_filters[col], value=selections.get(col), search_value=search_value)
@@ -1,106 +1,127 @@
-import io
+import queue
+import threading
+import time
+import warnings
 from openpyxl import Workbook
-from openpyxl.styles import NamedStyle, Font, Alignment, PatternFill
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill
 from openpyxl.worksheet.table import Table, TableStyleInfo
 from openpyxl.chart import BarChart, Reference
 from openpyxl.styles.borders import Border, Side, BORDER_THIN
+from app.metrics import observe
 
 
-def excel_export(user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values):
-    wb = Workbook()
+# (openpyxl warns on every table added to a write-only worksheet, since it can't fill in the table's columns from the worksheet's cells; the ten table's columns are added before it's added
+# [see excel_workbook() below], so the warning doesn't apply and would otherwise be logged on every export)
+warnings.filterwarnings('ignore', message='In write-only mode you must add table columns manually', category=UserWarning)
 
-    # ---- create styles/formats to be used later ----
-    # for applicable numerical values
-    comma_no_decimal_style = NamedStyle(name='comma_no_decimal_style')
-    comma_no_decimal_style.number_format = '#,##0'
-    comma_no_decimal_style.alignment = Alignment(horizontal='left')   # left align like text is by default in Excel
 
-    # for table header
-    ten_table_header_style = NamedStyle(name='ten_table_header_style')
-    ten_table_header_style.font = Font(bold=True)
-    ten_table_header_style.fill = PatternFill(start_color='8DB4E2', end_color='8DB4E2', fill_type='solid')
-    ten_table_header_style.border = Border(top=Side(border_style=BORDER_THIN, color='00000000'), bottom=Side(border_style=BORDER_THIN, color='00000000'),
-                                     left=Side(border_style=BORDER_THIN, color='00000000'), right=Side(border_style=BORDER_THIN, color='00000000'))
+# ---- styles/formats ----
+# (style objects are immutable so they're created once here and shared by every export; each style is the cell attributes to set)
+# for applicable numerical values
+comma_no_decimal_style = dict(number_format='#,##0', alignment=Alignment(horizontal='left'))     # left align like text is by default in Excel
 
-    # for table title
-    ten_table_title_style = NamedStyle(name='ten_table_title_style')
-    ten_table_title_style.font = Font(size=18, bold=True)
-    ten_table_title_style.alignment = Alignment(horizontal='center')
+# for table header
+ten_table_header_style = dict(font=Font(bold=True), fill=PatternFill(start_color='8DB4E2', end_color='8DB4E2', fill_type='solid'),
+                              border=Border(top=Side(border_style=BORDER_THIN, color='00000000'), bottom=Side(border_style=BORDER_THIN, color='00000000'),
+                                            left=Side(border_style=BORDER_THIN, color='00000000'), right=Side(border_style=BORDER_THIN, color='00000000')))
 
-    # -----------------------INPUT TAB-----------------------
-    ws_input = wb.active
-    ws_input.title = 'input'
+# for table title
+ten_table_title_style = dict(font=Font(size=18, bold=True), alignment=Alignment(horizontal='center'))
 
-    # provide user selections
-    for row, label in enumerate(['Rank Position', 'Rank By', 'State', 'City', 'Zip Code', 'Place of Service', 'Provider Type', 'Credential', 'HCPCS Code'], start=1):
-        ws_input.cell(column=1, row=row, value=label).font = Font(bold=True)
-
-    ws_input.cell(column=2, row=1, value=', '.join(user_inputs['rank_position']) if 'rank_position' in user_inputs else '')     # (rank position should always be in user inputs, since it's required)
-    ws_input.cell(column=2, row=2, value=', '.join(user_inputs['rank_by']) if 'rank_by' in user_inputs else '')                 # (rank by should always be in user inputs, since it's required)
-    ws_input.cell(column=2, row=3, value=', '.join(user_inputs['state']) if 'state' in user_inputs else '(all)')
-    ws_input.cell(column=2, row=4, value=', '.join(user_inputs['city']) if 'city' in user_inputs else '(all)')
-    ws_input.cell(column=2, row=5, value=', '.join(user_inputs['zip_code']) if 'zip_code' in user_inputs else '(all)')
-    ws_input.cell(column=2, row=6, value=', '.join(user_inputs['place_of_service']) if 'place_of_service' in user_inputs else '(all)')
-    ws_input.cell(column=2, row=7, value=', '.join(user_inputs['provider_type']) if 'provider_type' in user_inputs else '(all)')
-    ws_input.cell(column=2, row=8, value=', '.join(user_inputs['credential']) if 'credential' in user_inputs else '(all)')
-    ws_input.cell(column=2, row=9, value=', '.join(user_inputs['hcpcs_code']) if 'hcpcs_code' in user_inputs else '(all)')
+# for labels/headings and footnotes
+bold_style = dict(font=Font(bold=True))
+footnote_style = dict(font=Font(size=9))
+footnote_heading_style = dict(font=Font(size=9, underline='single'))
+
+
+# (the workbook is written in chunks of this many bytes)
+excel_chunk_size = 64 * 1024
+
+
+
+# STYLED CELL
+# a cell for a write-only worksheet (see excel_workbook() below) with a style from above
+def styled_cell(ws, value, style):
+    cell = WriteOnlyCell(ws, value=value)
+
+    for attribute, style_value in style.items():
+        setattr(cell, attribute, style_value)
+
+    return cell
+
+
+
+# EXCEL WORKBOOK
+# the export workbook, in write-only mode, i.e. each worksheet's rows are written out as they're appended (top to bottom) vs. being held in memory until the workbook is saved; (so column widths
+# are set before a worksheet's rows are appended, and blank rows are appended as empty lists)
+def excel_workbook(user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values):
+    wb = Workbook(write_only=True)
+
+    # -----------------------INPUT TAB-----------------------
+    ws_input = wb.create_sheet(title='input')
 
     for col in ['A', 'B']:
         ws_input.column_dimensions[col].width = 20
 
+    # provide user selections
+    ws_input.append([styled_cell(ws_input, 'Rank Position', bold_style), ', '.join(user_inputs['rank_position']) if 'rank_position' in user_inputs else ''])     # (rank position should always be in user inputs, since it's required)
+    ws_input.append([styled_cell(ws_input, 'Rank By', bold_style), ', '.join(user_inputs['rank_by']) if 'rank_by' in user_inputs else ''])                         # (rank by should always be in user inputs, since it's required)
+
+    for col, label in [('state', 'State'), ('city', 'City'), ('zip_code', 'Zip Code'), ('place_of_service', 'Place of Service'), ('provider_type', 'Provider Type'), ('credential', 'Credential'),
+                       ('hcpcs_code', 'HCPCS Code')]:
+        ws_input.append([styled_cell(ws_input, label, bold_style), ', '.join(user_inputs[col]) if col in user_inputs else '(all)'])
+
+    # (the bar chart bucket settings)
+    for col, label in [('bucketing', 'Chart Buckets'), ('bucket_width', 'Bucket Width'), ('num_buckets', 'Number of Buckets')]:
+        ws_input.append([styled_cell(ws_input, label, bold_style), ', '.join(str(value) for value in user_inputs[col])])
+
     # -----------------------DATA TAB-----------------------
     ws_data = wb.create_sheet(title='data')
 
-    # ----provide table data----
-    for col, label in enumerate(['Provider ID', 'Patients', 'Avg Charged', 'Avg Allowed', 'Avg Paid'], start=1):
-        ws_data.cell(column=col, row=1, value=label)
+    # set column width for table & chart data
+    for col in ['A', 'B', 'C', 'D', 'E', 'H', 'I']:
+        ws_data.column_dimensions[col].width = 16
 
-    for row, data in enumerate(ten_table_data, start=2):
-        ws_data.cell(column=1, row=row, value=data['provider_id'])
-        ws_data.cell(column=2, row=row, value=int(data['patients'].replace(',', ''))).style = comma_no_decimal_style      # transforming string into number (so user can more easily perform calculations in Excel) and formatting
-        ws_data.cell(column=3, row=row, value=int(data['avg_charged'].replace(',', ''))).style = comma_no_decimal_style
-        ws_data.cell(column=4, row=row, value=int(data['avg_allowed'].replace(',', ''))).style = comma_no_decimal_style
-        ws_data.cell(column=5, row=row, value=int(data['avg_paid'].replace(',', ''))).style = comma_no_decimal_style
+    # bold headings for table & chart data
+    ws_data.append([styled_cell(ws_data, label, bold_style) for label in ['Provider ID', 'Patients', 'Avg Charged', 'Avg Allowed', 'Avg Paid']] +
+                   [None, None, styled_cell(ws_data, 'Bar Chart', bold_style)])
 
-    # ----provide chart data----
-    ws_data.cell(column=8, row=1, value='Bar Chart')
+    # ----provide table data (columns A-E) & chart data (columns H-I), side by side----
+    for i in range(max(len(ten_table_data), len(bar_chart_x_axis_values))):
+        row = [None] * 5
 
-    for row, x in enumerate(bar_chart_x_axis_values, start=2):
-        ws_data.cell(column=8, row=row, value=x)
+        if i < len(ten_table_data):
+            data = ten_table_data[i]
+            row = [data['provider_id']] + [styled_cell(ws_data, int(data[col].replace(',', '')), comma_no_decimal_style)           # transforming string into number (so user can more easily perform calculations in Excel) and formatting
+                                           for col in ['patients', 'avg_charged', 'avg_allowed', 'avg_paid']]
 
-    for row, y in enumerate(bar_chart_y_axis_values, start=2):
-        ws_data.cell(column=9, row=row, value=y).style = comma_no_decimal_style
+        if i < len(bar_chart_x_axis_values):
+            row += [None, None, bar_chart_x_axis_values[i], styled_cell(ws_data, bar_chart_y_axis_values[i], comma_no_decimal_style)]
 
-    # set column width and bold headings for table & chart data
-    for col in ['A', 'B', 'C', 'D', 'E', 'H', 'I']:
-        ws_data.column_dimensions[col].width = 16
-        ws_data[f'{col}1'].font = Font(bold=True)
+        ws_data.append(row)
 
     # -----------------------RESULTS TAB-----------------------
     ws_results = wb.create_sheet(title='results')
 
+    for col in ['A', 'B', 'C', 'D', 'E']:
+        ws_results.column_dimensions[col].width = 16
+
     # ---- create and format table ----
     ten_table_title = f"{user_inputs['rank_position'][0]} 10 Providers by {'Number of Patients' if user_inputs['rank_by'][0] == 'Patients' else 'Average Charged Amount'}"
-    ws_results.merge_cells('A1:E1')
-    ws_results.cell(column=1, row=1, value=ten_table_title).style = ten_table_title_style
+    ws_results.merged_cells.add('A1:E1')
+    ws_results.append([styled_cell(ws_results, ten_table_title, ten_table_title_style)])
 
-    for col, label in enumerate(['Provider ID', 'Patients', 'Avg Charged', 'Avg Allowed', 'Avg Paid'], start=1):
-        ws_results.cell(column=col, row=2, value=label).style = ten_table_header_style
+    ws_results.append([styled_cell(ws_results, label, ten_table_header_style) for label in ['Provider ID', 'Patients', 'Avg Charged', 'Avg Allowed', 'Avg Paid']])
 
     for row in range(3, len(ten_table_data)+3):
-        ws_results.cell(column=1, row=row, value=f"=data!A{row-1}")
-        ws_results.cell(column=2, row=row, value=f"=data!B{row-1}").style = comma_no_decimal_style
-        ws_results.cell(column=3, row=row, value=f"=data!C{row-1}").style = comma_no_decimal_style
-        ws_results.cell(column=4, row=row, value=f"=data!D{row-1}").style = comma_no_decimal_style
-        ws_results.cell(column=5, row=row, value=f"=data!E{row-1}").style = comma_no_decimal_style
+        ws_results.append([f"=data!A{row-1}"] + [styled_cell(ws_results, f"=data!{col}{row-1}", comma_no_decimal_style) for col in ['B', 'C', 'D', 'E']])
 
     ten_table = Table(displayName="TenTable", ref=f'A3:E{len(ten_table_data)+2}', headerRowCount=0)     # didn't specify a header so that default column filters aren't created
     ten_table.tableStyleInfo = TableStyleInfo(name="TableStyleLight15", showRowStripes=True)
+    ten_table._initialise_columns()                                                                     # (the columns openpyxl would otherwise add when the workbook is saved, i.e. the same XML)
     ws_results.add_table(ten_table)
 
-    for col in ['A', 'B', 'C', 'D', 'E']:
-        ws_results.column_dimensions[col].width = 16
-
     # ---- create bar chart ----
     bar_chart = BarChart()
     bar_chart.type = 'col'
@@ -122,19 +143,91 @@ def excel_export(user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart
     footnote3 = "Additional data cleaning/transformations on the data set were performed as needed at the sole discretion of the developer."
     footnote4 = "The specific data shown in the above table & graph is based on user selections (see input tab) in the web application."
 
-    ws_results.cell(column=1, row=20, value='Source Data:').font = Font(size=9, underline='single')
+    # (footnotes start on row 20, below the chart)
+    for _ in range(len(ten_table_data)+3, 20):
+        ws_results.append([])
+
+    ws_results.append([styled_cell(ws_results, 'Source Data:', footnote_heading_style)])
 
-    for i, note in enumerate([footnote1, footnote2, footnote3], start=1):
-        ws_results.cell(column=1, row=20+i, value=note).font = Font(size=9)
+    for note in [footnote1, footnote2, footnote3]:
+        ws_results.append([styled_cell(ws_results, note, footnote_style)])
 
-    ws_results.cell(column=1, row=25, value=footnote4).font = Font(size=9)      # writes a couple of lines down from the previous footnote in order to leave a blank line between this last footnote and the prior ones
+    ws_results.append([])       # leave a blank line between this last footnote and the prior ones
+    ws_results.append([styled_cell(ws_results, footnote4, footnote_style)])
 
     # set the results sheet (which is at index 2) as the active worksheet so that the user will be on this sheet when opening the file
     wb.active = 2   # the active worksheet is now the one at index 2
 
-    # save workbook to a stream (vs. saving to a file on disk) to later send to user
-    excel_stream = io.BytesIO()
-    wb.save(excel_stream)
-    excel_stream.seek(0)  # go to the beginning of the stream
+    return wb
+
+
+
+# CHUNK WRITER
+# file-like object the workbook is saved to (from another thread) that passes what's written to it on in chunks, through a queue, to the response; (the queue only holds a few chunks, so saving
+# waits for the chunks to be sent to the user vs. building up the whole file in memory)
+class ChunkWriter(object):
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=4)
+        self.buffer = bytearray()
+        self.cancelled = threading.Event()      # (set if the user disconnects, in which case the rest of the file is thrown away vs. waiting on the queue forever)
+
+    def write(self, data):
+        if self.cancelled.is_set():
+            return len(data)
+
+        self.buffer += data
+
+        if len(self.buffer) >= self.chunk_size:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+
+
+# EXCEL EXPORT
+# the export workbook as a stream of xlsx file chunks to send to the user, i.e. the first chunk is sent as soon as it's written vs. after the whole file is done.
+# (The xlsx file is a zip file, which Python can write to a stream that can't seek [zipfile writes each file's size after its data in that case].)
+def excel_export(user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values, chunk_size=excel_chunk_size):
+    start = time.perf_counter()
+    wb = excel_workbook(user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values)
+    writer = ChunkWriter(chunk_size)
+
+    # save the workbook in another thread, then send what's left in the buffer and None to mark the end (or the error, if saving failed)
+    def save():
+        try:
+            wb.save(writer)
+            writer.put(bytes(writer.buffer))
+            writer.put(None)
+        except Exception as error:
+            writer.put(error)
+
+    threading.Thread(target=save, name='excel_export', daemon=True).start()
+
+    try:
+        while True:
+            chunk = writer.chunks.get()
+
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            yield chunk
+    finally:
+        writer.cancelled.set()
 
-    return excel_stream
\ No newline at end of file
+    # (the time until the last chunk is handed to the response [see metrics.py]; this can't go in the export's Server-Timing header since the header is sent before the chunks are)
+    observe('excel_export_duration_seconds', time.perf_counter() - start)
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+# HISTOGRAM
+# total weights (e.g. patients) per bucket of values (e.g. avg charged amounts), returned as the bucket labels and totals for the bar chart.
+# method: "fixed" for buckets of bucket_width starting at 0 (i.e. 0 - 200, 200 - 400, etc.), so the buckets are the same for every selection and can be compared, or "quantile" for buckets that
+#         each hold about the same total weight (bucket_width isn't used)
+# num_buckets: number of buckets, including the last one which is open ended (e.g. "2,000+")
+# (A value on a bucket edge goes in the bucket above it, e.g. 200 goes in 200 - 400.)
+def histogram(values, weights, method='fixed', bucket_width=200, num_buckets=11):
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+
+    # lower edge of each bucket
+    if method == 'quantile':
+        edges = quantile_edges(values, weights, num_buckets)
+    else:
+        edges = np.arange(num_buckets, dtype=np.float64) * bucket_width
+
+    # find each value's bucket (i.e. the last lower edge at or below the value) and total the weights per bucket
+    buckets = np.maximum(np.searchsorted(edges, values, side='right') - 1, 0)
+    totals = np.bincount(buckets, weights=weights, minlength=len(edges))
+
+    labels = [f'{edges[i]:,.0f} - {edges[i + 1]:,.0f}' for i in range(len(edges) - 1)] + [f'{edges[-1]:,.0f}+']
+
+    return labels, [int(round(total)) for total in totals]
+
+
+
+# QUANTILE EDGES
+# lower bucket edges that split the total weight into (about) equal parts; (edges are rounded down to whole dollars and duplicates are dropped, so there can be fewer buckets than asked for
+# when a lot of the weight is on a few values)
+def quantile_edges(values, weights, num_buckets):
+    if not len(values):
+        return np.zeros(1)
+
+    order = np.argsort(values, kind='mergesort')
+    cumulative_weights = np.cumsum(weights[order])
+
+    targets = cumulative_weights[-1] * np.arange(1, num_buckets) / num_buckets
+    positions = np.minimum(np.searchsorted(cumulative_weights, targets, side='right'), len(values) - 1)
+
+    return np.unique(np.concatenate([[0], np.floor(values[order][positions])]))
@@ -1,26 +1,14 @@
-import collections
-import hashlib
-import pickle
+import functools
 import dash
-from dash.dependencies import Input, Output, State
-from flask import request, send_file, render_template
-from sqlalchemy import Integer, func
-from sqlalchemy.sql.expression import cast
-from app import app, cache
-from app.models import Utilization
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from flask import request, render_template, Response
+from app import app, server_flask, cache
+from app.lookups import hcpcs_descriptions
+from app.results import results_user_inputs, results_cache_key, get_or_calculate_results
+from app.dropdowns import dropdown_columns, typeahead_columns, resolve_dropdowns, search_dropdown_options
 from app.excel_export import excel_export
-
-
-# (note that state is excluded since its default value is set in layout.py; the state dropdown has no upstream dropdowns it depends on)
-dropdown_default_values = {
-    'city':['Nashville'],
-    'zip_code': '',                         # using [''] causes problems so only using ''
-    'place_of_service': ['Non-Facility'],
-    'provider_type': ['Family Practice', 'General Practice'],
-    'credential': '',
-    'hcpcs_code': ['99213', '99214', '99215']
-}
-
+from app.metrics import increment, server_timing
+from app.jobs import job_progress_text, job_state, cancel_job, submit_results_job
 
 
 # EXPORT TO EXCEL FUNCTIONALITY
@@ -36,16 +24,11 @@ def download_excel():
         # unpack data
         user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values = cached_results
 
-        # create Excel output
-        excel_stream = excel_export(user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values)
-
-        # send Excel output
-        return send_file(
-            excel_stream,
+        # create & send Excel output, streamed in chunks as it's written (see excel_export.py)
+        return Response(
+            excel_export(user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values),
             mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            attachment_filename="results.xlsx",
-            as_attachment=True,
-            cache_timeout=0
+            headers={'Content-Disposition': 'attachment; filename=results.xlsx', 'Cache-Control': 'public, max-age=0'}
         )
 
     # the results should be cached & retrieved, but just in case they're not, return an error message (that also contains a link to go back to the dashboard)
@@ -57,72 +40,29 @@ def download_excel():
 # -----------------------------------------------------------------------------------------------------------------------
 # ------------------------------------------------------ CALLBACKS ------------------------------------------------------
 # -----------------------------------------------------------------------------------------------------------------------
+# (The callbacks that only disable/hide/show things, i.e. the dropdown & submit button access, export link, required inputs message and spinner callbacks, are run in the browser [see
+# assets/clientside.js] so they don't each cost a request to the server; the rest look things up and are run here.)
 
 
 # CITY DROPDOWN - ACCESS
 # disabling/enabling dropdown (so that it's disabled when the value of the upstream dropdown changes but enabled when its own options finish updating and change).
 # General Note: Note that all higher upstream dropdown values are used as inputs in these types of functions as all downstream dropdowns are to be disabled as quickly
-# as possible vs. waiting in line for their turn.
-@app.callback(
+# as possible vs. waiting for their options to be updated.  (All of the triggers are checked vs. only the first one since a dropdown's options are updated at the same time as the values of
+# the dropdowns above it are cleared.)
+app.clientside_callback(
+    ClientsideFunction('ui', 'dropdown_access'),
     Output('city_dropdown', 'disabled'),
     [
         Input('state_dropdown', 'value'),
         Input('city_dropdown', 'options')
     ]
 )
-def city_access(*args):
-    context = dash.callback_context.triggered[0]['prop_id']
-    if context != 'city_dropdown.options':
-        return True
-    else:
-        return False
-
-
-
-# CITY DROPDOWN - UPDATING OPTIONS & CLEARING VALUES
-# update dropdown options.
-# General Note: Note that only the next level upstream dropdown value is needed as an input in these types of functions, as changes to values in higher upstream dropdowns will trigger
-# the next lower one to clear and its options to update (and so forth).  If all higher upstream dropdown values are used as inputs in these types of fuctions then the database
-# could be queried multiple times to update the options of a downstream dropdown after only one [real] upstream dropdown value change.  So the intent is for applicable
-# downstream dropdowns to wait their turn for their options to be updated and their values to be cleared.
-@app.callback(
-    [
-        Output('city_dropdown', 'options'),
-        Output('city_dropdown', 'value')
-    ],
-    [
-        Input('state_dropdown', 'value'),
-    ],
-    [
-        State('memory_store', 'data')
-    ]
-)
-def city_update(state_value, memory_store_data):
-    global dropdown_default_values
-    filters = {}
-    loaded_value = memory_store_data['loaded']
-
-    # use the default dropdown value if applicable
-    dropdown_value = '' if loaded_value else dropdown_default_values['city']
-
-    # if not blank, ensure values are in a list; (note that there are no blank or NULL values, but there are "[unknown]" values, in the dataset)
-    state_value = [state_value, ] if state_value and not isinstance(state_value, list) else state_value
-
-    # if not blank, put values in dictionary
-    if state_value: filters['state'] = state_value
-
-    # build query
-    query = Utilization.query.with_entities(Utilization.city).group_by(Utilization.city).order_by(Utilization.city)
-    if filters:
-        for col, value in filters.items():
-            query = query.filter(getattr(Utilization, col).in_(value))
-
-    return [{'label': result[0], 'value': result[0]} for result in query], dropdown_value
 
 
 
 # ZIP_CODE DROPDOWN - ACCESS
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction('ui', 'dropdown_access'),
     Output('zip_code_dropdown', 'disabled'),
     [
         Input('state_dropdown', 'value'),
@@ -130,56 +70,12 @@ def city_update(state_value, memory_store_data):
         Input('zip_code_dropdown', 'options')
     ]
 )
-def zip_code_access(*args):
-    context = dash.callback_context.triggered[0]['prop_id']
-    if context != 'zip_code_dropdown.options':
-        return True
-    else:
-        return False
-
-
-
-# ZIP_CODE CODE DROPDOWN - UPDATING OPTIONS & CLEARING VALUES
-@app.callback(
-    [
-        Output('zip_code_dropdown', 'options'),
-        Output('zip_code_dropdown', 'value')
-    ],
-    [
-        Input('city_dropdown', 'value')
-    ],
-    [
-        State('state_dropdown', 'value'),
-        State('memory_store', 'data')
-    ]
-)
-def zip_code_update(city_value, state_value, memory_store_data):
-    global dropdown_default_values
-    filters = {}
-    loaded_value = memory_store_data['loaded']
-
-    # use the default dropdown value if applicable
-    dropdown_value = '' if loaded_value else dropdown_default_values['zip_code']
-
-    # if not blank, ensure values are in a list
-    state_value = [state_value, ] if state_value and not isinstance(state_value, list) else state_value
-    city_value = [city_value, ] if city_value and not isinstance(city_value, list) else city_value
-
-    # if not blank, put values in dictionary
-    if state_value: filters['state'] = state_value
-    if city_value: filters['city'] = city_value
-
-    # build query
-    query = Utilization.query.with_entities(Utilization.zip_code).group_by(Utilization.zip_code).order_by(Utilization.zip_code)
-    if filters:
-        for col, value in filters.items():
-            query = query.filter(getattr(Utilization, col).in_(value))
 
-    return [{'label': result[0], 'value': result[0]} for result in query], dropdown_value
 
 
 # PLACE_OF_SERVICE DROPDOWN - ACCESS
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction('ui', 'dropdown_access'),
     Output('place_of_service_dropdown', 'disabled'),
     [
         Input('state_dropdown', 'value'),
@@ -188,59 +84,12 @@ def zip_code_update(city_value, state_value, memory_store_data):
         Input('place_of_service_dropdown', 'options')
     ]
 )
-def place_of_service_access(*args):
-    context = dash.callback_context.triggered[0]['prop_id']
-    if context != 'place_of_service_dropdown.options':
-        return True
-    else:
-        return False
-
-
-# PLACE_OF_SERVICE DROPDOWN - UPDATING OPTIONS & CLEARING VALUES
-@app.callback(
-    [
-        Output('place_of_service_dropdown', 'options'),
-        Output('place_of_service_dropdown', 'value')
-    ],
-    [
-        Input('zip_code_dropdown', 'value')
-    ],
-    [
-        State('state_dropdown', 'value'),
-        State('city_dropdown', 'value'),
-        State('memory_store', 'data')
-    ]
-)
-def place_of_service_update(zip_code_value, state_value, city_value, memory_store_data):
-    global dropdown_default_values
-    filters = {}
-    loaded_value = memory_store_data['loaded']
-
-    # use the default dropdown value if applicable
-    dropdown_value = '' if loaded_value else dropdown_default_values['place_of_service']
-
-    # if not blank, ensure values are in a list
-    state_value = [state_value, ] if state_value and not isinstance(state_value, list) else state_value
-    city_value = [city_value, ] if city_value and not isinstance(city_value, list) else city_value
-    zip_code_value = [zip_code_value, ] if zip_code_value and not isinstance(zip_code_value, list) else zip_code_value
-
-    # if not blank, put values in dictionary
-    if state_value: filters['state'] = state_value
-    if city_value: filters['city'] = city_value
-    if zip_code_value: filters['zip_code'] = zip_code_value
-
-    # build query
-    query = Utilization.query.with_entities(Utilization.place_of_service).group_by(Utilization.place_of_service).order_by(Utilization.place_of_service)
-    if filters:
-        for col, value in filters.items():
-            query = query.filter(getattr(Utilization, col).in_(value))
-
-    return [{'label': result[0], 'value': result[0]} for result in query], dropdown_value
 
 
 
 # PROVIDER TYPE DROPDOWN - ACCESS
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction('ui', 'dropdown_access'),
     Output('provider_type_dropdown', 'disabled'),
     [
         Input('state_dropdown', 'value'),
@@ -250,63 +99,12 @@ def place_of_service_update(zip_code_value, state_value, city_value, memory_stor
         Input('provider_type_dropdown', 'options')
     ]
 )
-def provider_type_access(*args):
-    context = dash.callback_context.triggered[0]['prop_id']
-    if context != 'provider_type_dropdown.options':
-        return True
-    else:
-        return False
-
-
-
-# PROVIDER TYPE DROPDOWN - UPDATING OPTIONS & CLEARING VALUES
-@app.callback(
-    [
-        Output('provider_type_dropdown', 'options'),
-        Output('provider_type_dropdown', 'value')
-    ],
-    [
-        Input('place_of_service_dropdown', 'value')
-    ],
-    [
-        State('state_dropdown', 'value'),
-        State('city_dropdown', 'value'),
-        State('zip_code_dropdown', 'value'),
-        State('memory_store', 'data')
-    ]
-)
-def provider_type_update(place_of_service_value, state_value, city_value, zip_code_value, memory_store_data):
-    global dropdown_default_values
-    filters = {}
-    loaded_value = memory_store_data['loaded']
-
-    # use the default dropdown value if applicable
-    dropdown_value = '' if loaded_value else dropdown_default_values['provider_type']
-
-    # if not blank, ensure values are in a list
-    state_value = [state_value, ] if state_value and not isinstance(state_value, list) else state_value
-    city_value = [city_value, ] if city_value and not isinstance(city_value, list) else city_value
-    zip_code_value = [zip_code_value, ] if zip_code_value and not isinstance(zip_code_value, list) else zip_code_value
-    place_of_service_value = [place_of_service_value, ] if place_of_service_value and not isinstance(place_of_service_value, list) else place_of_service_value
-
-    # if not blank, put values in dictionary
-    if state_value: filters['state'] = state_value
-    if city_value: filters['city'] = city_value
-    if zip_code_value: filters['zip_code'] = zip_code_value
-    if place_of_service_value: filters['place_of_service'] = place_of_service_value
-
-    # build query
-    query = Utilization.query.with_entities(Utilization.provider_type).group_by(Utilization.provider_type).order_by(Utilization.provider_type)
-    if filters:
-        for col, value in filters.items():
-            query = query.filter(getattr(Utilization, col).in_(value))
-
-    return [{'label': result[0], 'value': result[0]} for result in query], dropdown_value
 
 
 
 # CREDENTIAL DROPDOWN - ACCESS
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction('ui', 'dropdown_access'),
     Output('credential_dropdown', 'disabled'),
     [
         Input('state_dropdown', 'value'),
@@ -317,66 +115,12 @@ def provider_type_update(place_of_service_value, state_value, city_value, zip_co
         Input('credential_dropdown', 'options')
     ]
 )
-def credential_access(*args):
-    context = dash.callback_context.triggered[0]['prop_id']
-    if context != 'credential_dropdown.options':
-        return True
-    else:
-        return False
-
-
-
-# CREDENTIAL DROPDOWN - UPDATING OPTIONS & CLEARING VALUES
-@app.callback(
-    [
-        Output('credential_dropdown', 'options'),
-        Output('credential_dropdown', 'value')
-    ],
-    [
-        Input('provider_type_dropdown', 'value')
-    ],
-    [
-        State('state_dropdown', 'value'),
-        State('city_dropdown', 'value'),
-        State('zip_code_dropdown', 'value'),
-        State('place_of_service_dropdown', 'value'),
-        State('memory_store', 'data')
-    ]
-)
-def credential_update(provider_type_value, state_value, city_value, zip_code_value, place_of_service_value, memory_store_data):
-    global dropdown_default_values
-    filters = {}
-    loaded_value = memory_store_data['loaded']
-
-    # use the default dropdown value if applicable
-    dropdown_value = '' if loaded_value else dropdown_default_values['credential']
-
-    # if not blank, ensure values are in a list
-    state_value = [state_value, ] if state_value and not isinstance(state_value, list) else state_value
-    city_value = [city_value, ] if city_value and not isinstance(city_value, list) else city_value
-    zip_code_value = [zip_code_value, ] if zip_code_value and not isinstance(zip_code_value, list) else zip_code_value
-    place_of_service_value = [place_of_service_value, ] if place_of_service_value and not isinstance(place_of_service_value, list) else place_of_service_value
-    provider_type_value = [provider_type_value, ] if provider_type_value and not isinstance(provider_type_value, list) else provider_type_value
-
-    # if not blank, put values in dictionary
-    if state_value: filters['state'] = state_value
-    if city_value: filters['city'] = city_value
-    if zip_code_value: filters['zip_code'] = zip_code_value
-    if place_of_service_value: filters['place_of_service'] = place_of_service_value
-    if provider_type_value: filters['provider_type'] = provider_type_value
-
-    # build query
-    query = Utilization.query.with_entities(Utilization.credential).group_by(Utilization.credential).order_by(Utilization.credential)
-    if filters:
-        for col, value in filters.items():
-            query = query.filter(getattr(Utilization, col).in_(value))
-
-    return [{'label': result[0], 'value': result[0]} for result in query], dropdown_value
 
 
 
 # HCPCS CODE DROPDOWN - ACCESS
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction('ui', 'dropdown_access'),
     Output('hcpcs_code_dropdown', 'disabled'),
     [
         Input('state_dropdown', 'value'),
@@ -388,68 +132,99 @@ def credential_update(provider_type_value, state_value, city_value, zip_code_val
         Input('hcpcs_code_dropdown', 'options')
     ]
 )
-def hcpcs_code_access(*args):
-    context = dash.callback_context.triggered[0]['prop_id']
-    if context != 'hcpcs_code_dropdown.options':
-        return True
-    else:
-        return False
 
 
 
-# HCPCS CODE DROPDOWN - UPDATING OPTIONS & CLEARING VALUES
+# ALL DROPDOWNS BELOW STATE - UPDATING OPTIONS & CLEARING VALUES
+# update the options and clear the values of every dropdown downstream of the one that changed, all in one callback and one database query.
+# General Note: This used to be one callback per dropdown, where each one cleared its value and so triggered the next one down (i.e. a state change took six round trips to the server, one after the other).
+# Here the values of the downstream dropdowns are known up front (cleared, or the default values when the app first loads) so all of their options are calculated at once.  Note that the city through credential
+# values are both inputs and outputs of this callback; (Dash allows this for a single callback and doesn't trigger the callback again from its own outputs).  The outputs for the dropdown that changed and the ones
+# above it are left as they are.  (When the typeahead dropdowns are turned on, this is also triggered as the user types in one of them, and then only that dropdown's options change.)
 @app.callback(
     [
+        Output('city_dropdown', 'options'),
+        Output('city_dropdown', 'value'),
+        Output('zip_code_dropdown', 'options'),
+        Output('zip_code_dropdown', 'value'),
+        Output('place_of_service_dropdown', 'options'),
+        Output('place_of_service_dropdown', 'value'),
+        Output('provider_type_dropdown', 'options'),
+        Output('provider_type_dropdown', 'value'),
+        Output('credential_dropdown', 'options'),
+        Output('credential_dropdown', 'value'),
         Output('hcpcs_code_dropdown', 'options'),
         Output('hcpcs_code_dropdown', 'value')
     ],
     [
+        Input('state_dropdown', 'value'),
+        Input('city_dropdown', 'value'),
+        Input('zip_code_dropdown', 'value'),
+        Input('place_of_service_dropdown', 'value'),
+        Input('provider_type_dropdown', 'value'),
         Input('credential_dropdown', 'value')
-    ],
+    ] + [Input(f'{col}_dropdown', 'search_value') for col in typeahead_columns],
     [
-        State('state_dropdown', 'value'),
-        State('city_dropdown', 'value'),
-        State('zip_code_dropdown', 'value'),
-        State('place_of_service_dropdown', 'value'),
-        State('provider_type_dropdown', 'value'),
-        State('memory_store', 'data')
+        State('memory_store', 'data'),
+        State('hcpcs_code_dropdown', 'value')
     ]
 )
-def hcpcs_code_update(credential_value, state_value, city_value, zip_code_value, place_of_service_value, provider_type_value, memory_store_data):
-    global dropdown_default_values
-    filters = {}
+def dropdowns_update(state_value, city_value, zip_code_value, place_of_service_value, provider_type_value, credential_value, *args):
+    # (the search values of the typeahead dropdowns, if turned on, come before the states)
+    *search_values, memory_store_data, hcpcs_code_value = args
+
+    # (every trigger is checked vs. just the first one since picking an option sets the dropdown's search value [to ''] before its value, and Dash can send both changes in one request)
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    value_columns = [prop_id[:-len('_dropdown.value')] for prop_id in triggered if prop_id.endswith('_dropdown.value')]
+    search_columns = [prop_id[:-len('_dropdown.search_value')] for prop_id in triggered if prop_id.endswith('_dropdown.search_value')]
     loaded_value = memory_store_data['loaded']
+    outputs = []
 
-    # use the default dropdown value if applicable
-    dropdown_value = '' if loaded_value else dropdown_default_values['hcpcs_code']
+    selections = {
+        'state': state_value,
+        'city': city_value,
+        'zip_code': zip_code_value,
+        'place_of_service': place_of_service_value,
+        'provider_type': provider_type_value,
+        'credential': credential_value,
+        'hcpcs_code': hcpcs_code_value
+    }
 
-    # if not blank, ensure values are in a list
-    state_value = [state_value, ] if state_value and not isinstance(state_value, list) else state_value
-    city_value = [city_value, ] if city_value and not isinstance(city_value, list) else city_value
-    zip_code_value = [zip_code_value, ] if zip_code_value and not isinstance(zip_code_value, list) else zip_code_value
-    place_of_service_value = [place_of_service_value, ] if place_of_service_value and not isinstance(place_of_service_value, list) else place_of_service_value
-    provider_type_value = [provider_type_value, ] if provider_type_value and not isinstance(provider_type_value, list) else provider_type_value
-    credential_value = [credential_value, ] if credential_value and not isinstance(credential_value, list) else credential_value
+    # only a typeahead dropdown's search value changed (i.e. no value did), so only its options change: the ones that start with the search value (see dropdowns.py)
+    if search_columns and not value_columns:
+        search_options = {col: search_dropdown_options(col, search_values[typeahead_columns.index(col)], selections) for col in search_columns}
 
-    # if not blank, put values in dictionary
-    if state_value: filters['state'] = state_value
-    if city_value: filters['city'] = city_value
-    if zip_code_value: filters['zip_code'] = zip_code_value
-    if place_of_service_value: filters['place_of_service'] = place_of_service_value
-    if provider_type_value: filters['provider_type'] = provider_type_value
-    if credential_value: filters['credential'] = credential_value
+        for col in dropdown_columns[1:]:
+            outputs += [search_options[col], dash.no_update] if col in search_options else [dash.no_update, dash.no_update]
 
-    # build query
-    query = Utilization.query.with_entities(Utilization.hcpcs_code).group_by(Utilization.hcpcs_code).order_by(Utilization.hcpcs_code)
-    if filters:
-        for col, value in filters.items():
-            query = query.filter(getattr(Utilization, col).in_(value))
+        return outputs
 
-    return [{'label': result[0], 'value': result[0]} for result in query], dropdown_value
+    # find the dropdown that changed, the topmost one if several did; (when the app first loads nothing has triggered the callback, so everything below the state dropdown is updated)
+    trigger_column = min(value_columns, key=dropdown_columns.index) if value_columns else 'state'
+
+    dropdown_options, dropdown_values = resolve_dropdowns(selections, trigger_column, loaded_value)
+
+    # leave the dropdowns that aren't downstream of the trigger as they are
+    for col in dropdown_columns[1:]:
+        if col in dropdown_options:
+            outputs += [dropdown_options[col], dropdown_values[col]]
+        else:
+            outputs += [dash.no_update, dash.no_update]
+
+    return outputs
 
 
 
 # HCPCS DESCRIPTION TEXTBOX - VISIBILITY & VALUES
+# (the codes listed are the HCPCS code dropdown's options, which are already filtered by the dropdowns above it, narrowed down to the selected codes if there are any; the descriptions come from
+# a dictionary that's read once per process [see lookups.py], so no query is run.  When the HCPCS code dropdown is searched as the user types [see dropdowns.py], its options, and so the codes
+# listed, are the ones that match the search.)
+@functools.lru_cache(maxsize=256)
+def hcpcs_description_text(hcpcs_codes):
+    descriptions = hcpcs_descriptions()
+    return '\n' + ''.join(f"{code}:\t{descriptions.get(code, '')}\n" for code in hcpcs_codes)
+
+
 @app.callback(
     [
         Output('hcpcs_description_textbox', 'hidden'),
@@ -460,50 +235,20 @@ def hcpcs_code_update(credential_value, state_value, city_value, zip_code_value,
         Input('hcpcs_code_dropdown', 'options')
     ],
     [
-        State('state_dropdown', 'value'),
-        State('city_dropdown', 'value'),
-        State('zip_code_dropdown', 'value'),
-        State('place_of_service_dropdown', 'value'),
-        State('provider_type_dropdown', 'value'),
-        State('credential_dropdown', 'value'),
         State('hcpcs_code_dropdown', 'value')
     ]
 )
-def hcpcs_description_update(hcpcs_description_checkbox_value, hcpcs_code_options, state_value, city_value, zip_code_value, place_of_service_value, provider_type_value, credential_value, hcpcs_code_value):
+def hcpcs_description_update(hcpcs_description_checkbox_value, hcpcs_code_options, hcpcs_code_value):
     if hcpcs_description_checkbox_value and hcpcs_description_checkbox_value[0] == 'yes':
-        filters = {}
-        text = '\n'
-
         # if not blank, ensure values are in a list
-        state_value = [state_value, ] if state_value and not isinstance(state_value, list) else state_value
-        city_value = [city_value, ] if city_value and not isinstance(city_value, list) else city_value
-        zip_code_value = [zip_code_value, ] if zip_code_value and not isinstance(zip_code_value, list) else zip_code_value
-        place_of_service_value = [place_of_service_value, ] if place_of_service_value and not isinstance(place_of_service_value, list) else place_of_service_value
-        provider_type_value = [provider_type_value, ] if provider_type_value and not isinstance(provider_type_value, list) else provider_type_value
-        credential_value = [credential_value, ] if credential_value and not isinstance(credential_value, list) else credential_value
         hcpcs_code_value = [hcpcs_code_value, ] if hcpcs_code_value and not isinstance(hcpcs_code_value, list) else hcpcs_code_value
 
-        # if not blank, put values in dictionary
-        if state_value: filters['state'] = state_value
-        if city_value: filters['city'] = city_value
-        if zip_code_value: filters['zip_code'] = zip_code_value
-        if place_of_service_value: filters['place_of_service'] = place_of_service_value
-        if provider_type_value: filters['provider_type'] = provider_type_value
-        if credential_value: filters['credential'] = credential_value
-        if hcpcs_code_value: filters['hcpcs_code'] = hcpcs_code_value
-
-        # build query
-        # (This query provides the desired result even though an aggregate function isn't specified for the hcpcs desc column [in order to decrease query run time].)
-        query = Utilization.query.with_entities(Utilization.hcpcs_code, Utilization.hcpcs_desc).group_by(Utilization.hcpcs_code).order_by(Utilization.hcpcs_code)
-        if filters:
-            for col, value in filters.items():
-                query = query.filter(getattr(Utilization, col).in_(value))
-
-        # build text
-        for result in query:
-            text = text + f'{result.hcpcs_code}:\t{result.hcpcs_desc}\n'
-
-        return False, text
+        hcpcs_codes = [option['value'] for option in hcpcs_code_options or []]
+        if hcpcs_code_value:
+            hcpcs_codes = [code for code in hcpcs_codes if code in hcpcs_code_value]
+
+        # (the text is cached per set of codes, since the same sets come up over and over, e.g. every time a state is selected)
+        return False, hcpcs_description_text(tuple(sorted(hcpcs_codes)))
     else:
         return True, ''
     
@@ -512,7 +257,8 @@ def hcpcs_description_update(hcpcs_description_checkbox_value, hcpcs_code_option
 # SUBMIT BUTTON - ACCESS
 # (Note that the purpose of disabling the submit button is to help safeguard a user from submitting a set of values that are stale; this could occur if the submit button was pressed
 # while dropdowns were being updated and their values from previous selections had not yet been cleared.)
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction('ui', 'submit_button_visible'),
     [
         Output('submit_button', 'disabled'),
         Output('memory_store', 'data')
@@ -530,16 +276,6 @@ def hcpcs_description_update(hcpcs_description_checkbox_value, hcpcs_code_option
         State('memory_store', 'data')
     ]
 )
-def submit_button_visible(*args):
-    dropdowns_disabled = args[:-1]
-    loaded_value = args[-1]['loaded']
-
-    # disable submit button if any of the applicable dropdowns are disabled, else enable; also change loaded value in memory store if applicable
-    if any(dropdowns_disabled):
-        return True, {'loaded': loaded_value}
-    else:
-        loaded_value = loaded_value if loaded_value else 1
-        return False, {'loaded': loaded_value}
 
 
 
@@ -547,7 +283,8 @@ def submit_button_visible(*args):
 # (Note that the results must be displayed first before the export button is visible.  This is so the export functionality has access to the applicable data and also helps the user export what they intend
 # since the exported data should match what's displayed.)
 # (Fyi, CSS is used to hide/unhide this link, which in turn, hides/unhides the button.)
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction('ui', 'export_button_visible'),
         Output('export_link', 'style'),
     [
         Input('submit_button', 'n_clicks'),
@@ -560,17 +297,12 @@ def submit_button_visible(*args):
         Input('hcpcs_code_dropdown', 'value'),
         Input('rank_position_dropdown', 'value'),
         Input('rank_by_dropdown', 'value'),
+        Input('bucketing_dropdown', 'value'),
+        Input('bucket_width_dropdown', 'value'),
+        Input('num_buckets_dropdown', 'value'),
         Input('results_container', 'style')
     ]
 )
-def export_button_visible(submit_button_clicks, state_value, city_value, zip_code_value, place_of_service_value, provider_type_value, credential_value, hcpcs_code_value, rank_position_value, rank_by_value, results_container_style):
-    context = dash.callback_context.triggered[0]['prop_id']
-
-    # show link [& button] if the results container (style) was the trigger and is visible... else hide link [& button]
-    if context == 'results_container.style' and (results_container_style['display'] != 'none' if 'display' in results_container_style else True):
-        return dict(display='initial')
-    else:
-        return dict(display='none')
 
 
 
@@ -578,7 +310,8 @@ def export_button_visible(submit_button_clicks, state_value, city_value, zip_cod
 # (Note that the Rank Position and Rank By selections are required.  The app (elsewhere... not in this callback) assumes a Rank Position value of "Top" and a Rank By value of "Avg Charged" if the provided values
 # from the user are not valid.  For example, the user could delete a selected value and leave the value of the dropdown as an empty string.  The callback below simply displays a message prompt
 # to inform the user on what value will be assumed if a provided selection is invalid.  Whether the user selects "OK" or "Cancel" on the message prompt does not impact the app's behavior.)
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction('ui', 'required_inputs_message_update'),
     [
         Output('required_inputs_message', 'displayed'),
         Output('required_inputs_message', 'message'),
@@ -591,30 +324,24 @@ def export_button_visible(submit_button_clicks, state_value, city_value, zip_cod
         State('rank_by_dropdown', 'value')
     ]
 )
-def required_inputs_message_update(submit_button_clicks, rank_position_value, rank_by_value):
-    mssg = []
-    mssg += ['"Top" will be used for the Rank Position value'] if rank_position_value not in ['Top', 'Bottom'] else []
-    mssg += ['"Avg Charged" will be used for the Rank By value'] if rank_by_value not in ['Avg Charged', 'Patients'] else []
-    plural_ending = 's' if len(mssg) > 1 else ''
-    mssg = ' and '.join(mssg)
-
-    if mssg:
-        mssg = f'Rank Position and Rank By selections are required.  Instead of the invalid value{plural_ending} provided, ' + mssg + '.'
-        return True, mssg
-    else:
-        return False, mssg
 
 
 
 # RESULTS (all tables/charts) - VISIBILITY & VALUES
 # (Note that the purpose of having the graphs and tables in one callback is so they populate on screen all at once vs piece-meal since some queries/etc. take longer than others.)
+# (When background jobs are turned on [see jobs.py], results that aren't cached are calculated by a job instead: the results stay hidden [and the spinner visible] while the job's progress is polled
+# by the results job interval, and once the job is done the results are shown from the cache the same way as when they're already cached [or an error message is shown if it failed].  Any other trigger, e.g. a dropdown changing,
+# cancels the job.)
 @app.callback(
     [
         Output('results_container', 'style'),
         Output('ten_table', 'data'),
         Output('ten_table_title', 'children'),
         Output('bar_chart', 'figure'),
-        Output('export_link', 'href')
+        Output('export_link', 'href'),
+        Output('results_job_store', 'data'),
+        Output('results_job_interval', 'disabled'),
+        Output('results_job_progress', 'children')
     ],
     [
         Input('submit_button', 'n_clicks'),
@@ -626,12 +353,40 @@ def required_inputs_message_update(submit_button_clicks, rank_position_value, ra
         Input('credential_dropdown', 'value'),
         Input('hcpcs_code_dropdown', 'value'),
         Input('rank_position_dropdown', 'value'),
-        Input('rank_by_dropdown', 'value')
+        Input('rank_by_dropdown', 'value'),
+        Input('bucketing_dropdown', 'value'),
+        Input('bucket_width_dropdown', 'value'),
+        Input('num_buckets_dropdown', 'value'),
+        Input('results_job_interval', 'n_intervals')
+    ],
+    [
+        State('results_job_store', 'data')
     ]
 )
-def results_update(submit_button_clicks, state_value, city_value, zip_code_value, place_of_service_value, provider_type_value, credential_value, hcpcs_code_value, rank_position_value, rank_by_value):
+def results_update(submit_button_clicks, state_value, city_value, zip_code_value, place_of_service_value, provider_type_value, credential_value, hcpcs_code_value, rank_position_value, rank_by_value,
+                   bucketing_value, bucket_width_value, num_buckets_value, results_job_interval_intervals, results_job_data):
     context = dash.callback_context.triggered[0]['prop_id']
 
+    # ---- background job ----
+    job_done = False
+    job_failed = False
+
+    if results_job_data:
+        if context == 'results_job_interval.n_intervals':
+            job = job_state(results_job_data['job_id'])
+
+            # still running, so only the progress changes
+            if job and job['status'] in ['queued', 'running']:
+                return [dash.no_update] * 7 + [job_progress_text.get(job['step'], '')]
+
+            # done, so the results are in the cache; otherwise the job failed, was cancelled or doesn't exist anymore (e.g. its state expired from the cache), and an error message is shown instead
+            # of the results (unless they're in the cache anyway).  (The dropdowns haven't changed since the job was submitted, or it would have been cancelled, so they give the same cache key.)
+            job_done = job is not None and job['status'] == 'done'
+            job_failed = not job_done
+            context = 'submit_button.n_clicks'
+        else:
+            cancel_job(results_job_data['job_id'])
+
     # set various variables so that results are blank and hidden in case the submit button/etc. was not the trigger
     results_container_style = {'minHeight': '100%', 'maxHeight': '100%', 'minWidth': '75%', 'maxWidth': '75%', 'display':'none'}        # the display value is set to "none" to hide results
     ten_table_data = ''
@@ -646,43 +401,25 @@ def results_update(submit_button_clicks, state_value, city_value, zip_code_value
         # make the results visible (by setting the container's display attribute to it's default value)
         results_container_style['display'] = 'initial'
 
-        user_inputs = collections.OrderedDict()
-
         # rank position and rank by are required inputs so make sure they're not blank since it's possible for a user to submit these as such
         rank_position_value = 'Top' if not rank_position_value else rank_position_value
         rank_by_value = 'Avg Charged' if not rank_by_value else rank_by_value
 
         ten_table_title = f"{rank_position_value} 10 Providers Ranked by {'Average Charged Amount' if rank_by_value == 'Avg Charged' else 'Number of Patients'}"
 
-        # if not blank, ensure values are in a list
-        state_value = [state_value, ] if state_value and not isinstance(state_value, list) else state_value
-        city_value = [city_value, ] if city_value and not isinstance(city_value, list) else city_value
-        zip_code_value = [zip_code_value, ] if zip_code_value and not isinstance(zip_code_value, list) else zip_code_value
-        place_of_service_value = [place_of_service_value, ] if place_of_service_value and not isinstance(place_of_service_value, list) else place_of_service_value
-        provider_type_value = [provider_type_value, ] if provider_type_value and not isinstance(provider_type_value, list) else provider_type_value
-        credential_value = [credential_value, ] if credential_value and not isinstance(credential_value, list) else credential_value
-        hcpcs_code_value = [hcpcs_code_value, ] if hcpcs_code_value and not isinstance(hcpcs_code_value, list) else hcpcs_code_value
-
-        # if not blank, put values [i.e. alphabetized lists] in an ordered dictionary; (in case order impacts the cache key calculation, as the desire is to have the same cache key for the same selections regardless of order,
-        # lists are sorted [and an ordered dictionary is used]; also note that there are no blank or NULL values, but there are "[unknown]" values, in the dataset)
-        if state_value: user_inputs['state'] = sorted(state_value)
-        if city_value: user_inputs['city'] = sorted(city_value)
-        if zip_code_value: user_inputs['zip_code'] = sorted(zip_code_value)
-        if place_of_service_value: user_inputs['place_of_service'] = sorted(place_of_service_value)
-        if provider_type_value: user_inputs['provider_type'] = sorted(provider_type_value)
-        if credential_value: user_inputs['credential'] = sorted(credential_value)
-        if hcpcs_code_value: user_inputs['hcpcs_code'] = sorted(hcpcs_code_value)
-
-        # include required user selections in ordered dictionary by putting them in a list
-        user_inputs['rank_position'] = [rank_position_value, ]
-        user_inputs['rank_by'] = [rank_by_value, ]
-
-        # convert the ordered dictionary into a bytes object using the pickle library, then hash this bytes object using md5 algorithm from the hashlib library; (fyi, md5 is the default for the Flask-Caching library;
-        # the reason we're not using its memoize() function outright is so we can specify the cache key explicitly in order to send it to the href of the Export button to retrieve data when/if needed.
-        hash_user_inputs = hashlib.md5(pickle.dumps(user_inputs))
+        selections = {
+            'state': state_value,
+            'city': city_value,
+            'zip_code': zip_code_value,
+            'place_of_service': place_of_service_value,
+            'provider_type': provider_type_value,
+            'credential': credential_value,
+            'hcpcs_code': hcpcs_code_value
+        }
 
-        # create the cache key using the hexadecimal hash string
-        cache_key = hash_user_inputs.hexdigest()
+        # put the selections [and the bar chart bucket settings] in an ordered dictionary and create the cache key from it (see results.py)
+        user_inputs = results_user_inputs(selections, rank_position_value, rank_by_value, bucketing_value, bucket_width_value, num_buckets_value)
+        cache_key = results_cache_key(user_inputs)
 
         # create link and include cache key so data can be looked up later if needed to create Excel export
         export_link_href = r'/download_excel?cache_key={0}'.format(cache_key)
@@ -690,6 +427,10 @@ def results_update(submit_button_clicks, state_value, city_value, zip_code_value
         # retrieve cached results; (returns None if the results are not already cached)
         cached_results = cache.get(cache_key)
 
+        # (count cache hits & misses [see metrics.py])
+        increment('results_cache_requests_total', result='hit' if cached_results else 'miss')
+        server_timing('cache', desc='hit' if cached_results else 'miss')
+
         # --------------------------- RESULTS ARE ALREADY CACHED ----------------------------------------
 
         if cached_results:
@@ -738,77 +479,22 @@ def results_update(submit_button_clicks, state_value, city_value, zip_code_value
 
         # --------------------------- RESULTS ARE NOT CACHED (so they need to be calculated) ---------------------------
 
+        # (the background job calculating them didn't finish, so the message takes the place of the table's title [and the results are empty] until they're submitted again)
+        elif job_failed:
+            ten_table_title = 'The results could not be calculated. Please try submitting again.'
+            ten_table_data = []
+            bar_chart_figure = {'data': [], 'layout': {'xaxis': {'visible': False}, 'yaxis': {'visible': False}}}
+            export_link_href = ''
+
+        # (calculated by a background job if turned on; the results stay as they are [i.e. hidden] until the job is done)
+        elif server_flask.config['RESULTS_JOBS'] and not job_done:
+            job_id = submit_results_job(user_inputs, cache_key)
+            return [dash.no_update] * 5 + [{'job_id': job_id}, False, job_progress_text['queued']]
+
         else:
-            order_by_col = ''
-            bar_chart_increment = 200
-            bar_chart_num_groupings = 11
-            bar_chart_x_values = []
-            bar_chart_x_axis_values = []
-            bar_chart_y_axis_values = []
-            bar_chart_last_y_value = 0
-
-            # map rank by input to associated column in underlying database table
-            order_by_col = 'avg_charged' if user_inputs['rank_by'][0] == 'Avg Charged' else 'num_beneficiaries'
-
-            # query for table
-            ten_table_query = Utilization.query.with_entities(Utilization.provider_id, Utilization.num_beneficiaries, Utilization.avg_charged, Utilization.avg_allowed, Utilization.avg_paid)
-
-            # (find the avg charged groupings by [rounding to the nearest multiple of the increment] and grouping these up while summing up the number of patients)
-            bar_chart_query = Utilization.query.with_entities(((cast(Utilization.avg_charged / bar_chart_increment, Integer) + 1) * bar_chart_increment).label('charged_group'),
-                func.sum(Utilization.num_beneficiaries).label('patients'))\
-                .group_by(((cast(Utilization.avg_charged / bar_chart_increment, Integer) + 1) * bar_chart_increment))\
-                .order_by(((cast(Utilization.avg_charged / bar_chart_increment, Integer) + 1) * bar_chart_increment))
-
-            for col, value in user_inputs.items():
-                if col not in ['rank_position', 'rank_by']:             # rank position and rank by do not represent a column in the underlying database table
-                    ten_table_query = ten_table_query.filter(getattr(Utilization, col).in_(value))
-                    bar_chart_query = bar_chart_query.filter(getattr(Utilization, col).in_(value))
-
-            # finalize ten table query
-            if user_inputs['rank_position'][0] == 'Top':
-                ten_table_query = ten_table_query.order_by(getattr(Utilization, order_by_col).desc())
-            else:
-                ten_table_query = ten_table_query.order_by(getattr(Utilization, order_by_col))
-
-            ten_table_query = ten_table_query.limit(10)
-
-            # get ten table results and format as strings
-            # (number formatting: commas but no decimals [also rounds to the nearest units]; fyi, you can use the DataTable's format attribute in Dash instead of taking this approach)
-            ten_table_data = [{'provider_id': f'{result.provider_id:,.0f}', 'patients': f'{result.num_beneficiaries:,.0f}',
-                               'avg_charged': f'{result.avg_charged:,.0f}', 'avg_allowed': f'{result.avg_allowed:,.0f}',
-                               'avg_paid': f'{result.avg_paid:,.0f}'} for result in ten_table_query]
-
-            # ------- get bar chart results -------
-            # build up the x values starting with the lowest one (i.e. the first one) in the query
-            bar_chart_x_values.append(bar_chart_query[0].charged_group)
-
-            # then increment a certain number of times based on the number of groupings, to end up with n-1 x values; afterwards, add the last x value by using the same value as in the n-1 position
-            for i in range(bar_chart_num_groupings - 2):
-                bar_chart_x_values.append(bar_chart_x_values[i] + bar_chart_increment)
-            else:
-                bar_chart_x_values.append(bar_chart_x_values[-1])
-
-            # build the x axis values
-            bar_chart_x_axis_values = [None] * len(bar_chart_x_values)
-
-            for i in range(bar_chart_num_groupings):
-                if i != 0 and i != bar_chart_num_groupings - 1:
-                    bar_chart_x_axis_values[i] = f'{bar_chart_x_values[i - 1]:,} - {bar_chart_x_values[i]:,}'
-                elif i == 0:
-                    bar_chart_x_axis_values[i] = f'0 - {bar_chart_x_values[i]:,}'
-                else:
-                    bar_chart_x_axis_values[i] = f'{bar_chart_x_values[i]:,}+'
-
-            # build y values
-            bar_chart_y_axis_values = [None] * len(bar_chart_x_values)
-
-            for result in bar_chart_query:
-                if result.charged_group in bar_chart_x_values[:-1]:
-                    bar_chart_y_axis_values[bar_chart_x_values[:-1].index(result.charged_group)] = result.patients
-                else:
-                    bar_chart_last_y_value += result.patients
-            else:
-                bar_chart_y_axis_values[-1] = bar_chart_last_y_value
+            # query for and format the table & chart data, and cache them (see results.py); (if another request is already calculating the same results, they're waited for instead)
+            # (this is also where a job's results end up when the job is done but they've already been evicted from the cache, vs. submitting another job whose results could be evicted again)
+            user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values = get_or_calculate_results(user_inputs, cache_key)
 
             bar_chart_figure = {
                 'data':
@@ -848,27 +534,20 @@ def results_update(submit_button_clicks, state_value, city_value, zip_code_value
                     }
             }
 
-            # cache data on the server for future use by specifying the cache key and the data to be cached; (fyi, caching the user inputs for Excel exporting and chose to cache the bar chart axis values instead of the figure)
-            cache.set(cache_key, (user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values))
 
-    # return applicable items to be rendered in user's browser/etc.
-    return results_container_style, ten_table_data, ten_table_title, bar_chart_figure, export_link_href
+    # return applicable items to be rendered in user's browser/etc.; (there's no job [anymore] at this point, so the job store is cleared and its interval turned off)
+    return results_container_style, ten_table_data, ten_table_title, bar_chart_figure, export_link_href, None, True, ''
 
 
 
 # SPINNER - VISIBILITY
-@app.callback(
+# (shown if the submit button (n_clicks) was the trigger and it has a value (i.e. it was actually pressed and doesn't have a value of None) and the results are hidden (so that pressing the submit button again after
+# the results have already been populated doesn't show a spinner)... else hidden)
+app.clientside_callback(
+    ClientsideFunction('ui', 'spinner_visible'),
     Output('spinner_container', 'style'),
     [
         Input('submit_button', 'n_clicks'),
         Input('results_container', 'style')
     ]
 )
-def spinner_visible(submit_button_clicks, results_container_style):
-    context = dash.callback_context.triggered[0]['prop_id']
-
-    # show spinner if the submit button (n_clicks) was the trigger and it has a value (i.e. it was actually pressed and doesn't have a value of None) and the results are hidden (so that pressing the submit button again after the results have already been populated doesn't show a spinner)... else hide spinner
-    if context == 'submit_button.n_clicks' and submit_button_clicks and (results_container_style['display'] == 'none' if 'display' in results_container_style else False):
-        return {'minHeight': '100%', 'maxHeight': '100%', 'minWidth': '100%', 'maxWidth': '100%', 'display': 'initial'}
-    else:
-        return {'display': 'none'}
\ No newline at end of file
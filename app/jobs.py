@@ -0,0 +1,159 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import os
+import threading
+import time
+import uuid
+from sqlalchemy import event
+from app import server_flask, db, cache
+from app.results import get_or_calculate_results
+from app.metrics import increment
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------- RESULTS JOBS -----------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+# When RESULTS_JOBS is turned on in the config file, results that aren't cached are calculated by a background thread pool (in each gunicorn worker) instead of inside the callback's request, so a
+# few broad selections can't tie up every worker.  results_update submits a job and returns its id, and the browser polls for it with the results_job_interval timer (see layout.py &
+# interactivity.py) until it's done; changing a dropdown cancels it.
+# (A job's state and its cancellation are kept in the cache, which all of the workers share, since a poll can be answered by any worker; the results land in the cache under the usual cache key,
+# i.e. where results_update and /download_excel/ look for them.)
+
+
+# the text shown under the spinner for each state/step of a job
+job_progress_text = {
+    'queued': 'Waiting for a free worker...',
+    'ten_table': 'Ranking the providers...',
+    'bar_chart': 'Totaling the patients...'
+}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+
+# ---- job state (in the cache) ----
+def job_key(job_id):
+    return f'results_job_{job_id}'
+
+
+def job_cancelled_key(job_id):
+    return f'results_job_{job_id}_cancelled'
+
+
+# (status is "queued", "running", "done", "cancelled" or "failed" and step is the step a running job is on; returns None for a job that doesn't exist [anymore])
+def job_state(job_id):
+    return cache.get(job_key(job_id))
+
+
+def set_job_state(job_id, status, step=None):
+    cache.set(job_key(job_id), {'status': status, 'step': step}, timeout=server_flask.config['RESULTS_JOB_TIMEOUT'])
+
+
+# (cancelling is a separate cache entry vs. a status so that it can't be overwritten by the job updating its own state at the same time)
+def cancel_job(job_id):
+    cache.set(job_cancelled_key(job_id), True, timeout=server_flask.config['RESULTS_JOB_TIMEOUT'])
+
+
+def job_cancelled(job_id):
+    return cache.get(job_cancelled_key(job_id)) is not None
+
+
+
+# ---- thread pool ----
+# (created on first use in each process, so that a gunicorn worker forked from a preloaded app gets its own threads)
+executor = None
+executor_pid = None
+executor_lock = threading.Lock()
+
+
+def job_executor():
+    global executor, executor_pid
+
+    with executor_lock:
+        if executor is None or executor_pid != os.getpid():
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=server_flask.config['RESULTS_JOB_WORKERS'], thread_name_prefix='results_job')
+            executor_pid = os.getpid()
+
+        return executor
+
+
+
+# CANCELLABLE QUERIES
+# interrupt the SQL queries run within this block (including the ones it runs in other threads with run_concurrently(), see results.py) once cancelled() returns True; SQLite calls the progress
+# handler every so many steps of a query, and cancelled() is checked at most every check_interval seconds since it reads the cache.
+# (The check is kept in a context variable so that it carries over to those threads, and set on the connection of each statement before it runs; the listener is on the app's [SQLite] engine only.)
+query_cancelled = contextvars.ContextVar('query_cancelled', default=None)
+
+
+@contextlib.contextmanager
+def cancellable_queries(cancelled, check_interval=0.25):
+    token = query_cancelled.set((cancelled, check_interval))
+    try:
+        yield
+    finally:
+        query_cancelled.reset(token)
+
+
+@event.listens_for(db.get_engine(server_flask), 'before_cursor_execute')
+def set_query_progress_handler(connection, cursor, statement, parameters, context, executemany):
+    sqlite_connection = connection.connection.connection
+
+    if query_cancelled.get() is None:
+        sqlite_connection.set_progress_handler(None, 0)
+        return
+
+    cancelled, check_interval = query_cancelled.get()
+    last_check = [time.monotonic()]
+
+    def progress_handler():
+        if time.monotonic() - last_check[0] < check_interval:
+            return 0
+
+        last_check[0] = time.monotonic()
+        return 1 if cancelled() else 0
+
+    sqlite_connection.set_progress_handler(progress_handler, 10000)
+
+
+
+# RUN RESULTS JOB
+# calculate & cache the results of a set of user inputs (see results.py), checking for cancellation before each step and while the queries run
+def run_results_job(job_id, user_inputs, cache_key):
+    with server_flask.app_context():
+        def progress(step):
+            if job_cancelled(job_id):
+                raise JobCancelled()
+
+            set_job_state(job_id, 'running', step)
+
+        try:
+            # (if another request is already calculating the same results, they're waited for instead)
+            with cancellable_queries(lambda: job_cancelled(job_id)):
+                get_or_calculate_results(user_inputs, cache_key, progress)
+
+            status = 'done'
+        except Exception as error:
+            # (an interrupted query raises an "interrupted" error from SQLite)
+            if isinstance(error, JobCancelled) or job_cancelled(job_id):
+                status = 'cancelled'
+            else:
+                server_flask.logger.exception(f'Results job {job_id} failed')
+                status = 'failed'
+
+        set_job_state(job_id, status)
+        increment('results_jobs_total', status=status)
+
+
+
+# SUBMIT RESULTS JOB
+# queue the calculation of a set of user inputs' results and return the job's id
+def submit_results_job(user_inputs, cache_key):
+    job_id = uuid.uuid4().hex
+
+    set_job_state(job_id, 'queued', 'queued')
+    job_executor().submit(run_results_job, job_id, user_inputs, cache_key)
+
+    return job_id
@@ -1,11 +1,28 @@
+import functools
+import hashlib
+import json
+import flask
+import plotly
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table as dt
-from app import app
-from app.models import Utilization
+from app import app, server_flask
+from app.models import DropdownCombination
+from app.dropdowns import default_state_value
 
 
-app.layout = html.Div(id='app_container', style={'minHeight':'100%', 'maxHeight':'100%', 'minWidth':'25%', 'maxWidth':'100%', 'display':'flex', 'flexDirection':'row', 'alignItems':'flex-start', 'padding':'0 1rem'},
+# STATE OPTIONS
+# (the only part of the layout that comes from the database; queried once per process [or once in total with gunicorn's --preload] vs. every time the layout is served)
+@functools.lru_cache(maxsize=None)
+def state_options():
+    return [{'label':result[0], 'value':result[0]} for result in DropdownCombination.query.with_entities(DropdownCombination.state).group_by(DropdownCombination.state).order_by(DropdownCombination.state)]
+
+
+
+# LAYOUT
+# (built by a function so that nothing is queried when the app is imported, e.g. by the flask commands; see serve_layout_json() below for how it's served)
+def build_layout(state_dropdown_options):
+    layout = html.Div(id='app_container', style={'minHeight':'100%', 'maxHeight':'100%', 'minWidth':'25%', 'maxWidth':'100%', 'display':'flex', 'flexDirection':'row', 'alignItems':'flex-start', 'padding':'0 1rem'},
                       children=[
                           html.Div(id='menu_section', style={'minHeight':'100%', 'maxHeight':'100%', 'minWidth':'25%', 'maxWidth':'25%', 'display':'flex', 'flexDirection':'column', 'alignItems':'flex-start', 'padding':'1.25rem 1rem'},
                                    children=[
@@ -23,10 +40,32 @@ app.layout = html.Div(id='app_container', style={'minHeight':'100%', 'maxHeight'
                                                                  dcc.Dropdown(id='rank_by_dropdown', options=[{'label':result, 'value':result} for result in ('Avg Charged', 'Patients')], value='Avg Charged', style={'minWidth':'12.5rem'}, clearable=False)
                                                              ]
                                                              ),
+                                                    # (the bar chart's buckets; the defaults & choices are set in the config file)
+                                                    html.Div(id='bucketing_section', style={'minWidth':'100%', 'maxWidth':'100%', 'display': 'flex', 'flexDirection': 'row', 'alignItems': 'flex-start', 'padding': '0 1rem'},
+                                                             children=[
+                                                                 html.P(id='bucketing_label', style={'width':'12.5rem'}, children=['Chart Buckets']),
+                                                                 dcc.Dropdown(id='bucketing_dropdown', options=[{'label': label, 'value': value} for label, value in (('Fixed Width', 'fixed'), ('Quantile', 'quantile'))],
+                                                                              value=server_flask.config['BAR_CHART_BUCKETING'], style={'minWidth':'12.5rem'}, clearable=False)
+                                                             ]
+                                                             ),
+                                                    html.Div(id='bucket_width_section', style={'minWidth':'100%', 'maxWidth':'100%', 'display': 'flex', 'flexDirection': 'row', 'alignItems': 'flex-start', 'padding': '0 1rem'},
+                                                             children=[
+                                                                 html.P(id='bucket_width_label', style={'width':'12.5rem'}, children=['Bucket Width']),
+                                                                 dcc.Dropdown(id='bucket_width_dropdown', options=[{'label': f'${width:,}', 'value': width} for width in server_flask.config['BAR_CHART_BUCKET_WIDTH_CHOICES']],
+                                                                              value=server_flask.config['BAR_CHART_BUCKET_WIDTH'], style={'minWidth':'12.5rem'}, clearable=False)
+                                                             ]
+                                                             ),
+                                                    html.Div(id='num_buckets_section', style={'minWidth':'100%', 'maxWidth':'100%', 'display': 'flex', 'flexDirection': 'row', 'alignItems': 'flex-start', 'padding': '0 1rem'},
+                                                             children=[
+                                                                 html.P(id='num_buckets_label', style={'width':'12.5rem'}, children=['Number of Buckets']),
+                                                                 dcc.Dropdown(id='num_buckets_dropdown', options=[{'label': str(count), 'value': count} for count in server_flask.config['BAR_CHART_NUM_BUCKETS_CHOICES']],
+                                                                              value=server_flask.config['BAR_CHART_NUM_BUCKETS'], style={'minWidth':'12.5rem'}, clearable=False)
+                                                             ]
+                                                             ),
                                                     html.Div(id='state_section', style={'minWidth':'100%', 'maxWidth':'100%', 'display': 'flex', 'flexDirection': 'row', 'alignItems': 'flex-start', 'padding': '0 1rem'},
                                                              children=[
                                                                  html.P(id='state_label', style={'width':'12.5rem'}, children=['State']),
-                                                                 dcc.Dropdown(id='state_dropdown', options=[{'label':result[0], 'value':result[0]} for result in Utilization.query.with_entities(Utilization.state).group_by(Utilization.state).order_by(Utilization.state)], value='TN', placeholder='(all)', style={'minWidth':'12.5rem'}, multi=True)
+                                                                 dcc.Dropdown(id='state_dropdown', options=state_dropdown_options, value=default_state_value, placeholder='(all)', style={'minWidth':'12.5rem'}, multi=True)
                                                              ]
                                                              ),
                                                     html.Div(id='city_section', style={'minWidth':'100%', 'maxWidth':'100%', 'display': 'flex', 'flexDirection': 'row', 'alignItems': 'flex-start', 'padding': '0 1rem'},
@@ -124,10 +163,48 @@ app.layout = html.Div(id='app_container', style={'minHeight':'100%', 'maxHeight'
                                                                 html.Div(id='spin11'),
                                                                 html.Div(id='spin12')
                                                     ]
-                                                    )
+                                                    ),
+                                                   # (progress of the background job calculating the results, if any; see jobs.py)
+                                                   html.P(id='results_job_progress', style={'text-align':'center', 'font-style':'italic', 'font-size':'12px', 'font-weight':400, 'font-family':['Open Sans', 'HelveticaNeue', 'Helvetica Neue', 'Helvetica', 'Arial', 'sans-serif']}, children='')
                                                 ]),
-                                       dcc.Store(id='memory_store', data={'loaded': 0})
+                                       dcc.Store(id='memory_store', data={'loaded': 0}),
+                                       # (the background job the results are being calculated by [if any] and the timer that polls it; the timer is only turned on while there's a job)
+                                       dcc.Store(id='results_job_store', data=None),
+                                       dcc.Interval(id='results_job_interval', interval=server_flask.config['RESULTS_JOB_POLL_INTERVAL_MS'], disabled=True)
                                    ]
                                    )
                           ]
-                      )
\ No newline at end of file
+                      )
+
+    return layout
+
+
+def serve_layout():
+    return build_layout(state_options())
+
+
+
+# LAYOUT JSON
+# the layout serialized (the same way Dash does it) once, with an ETag so browsers that already have it get a "304 Not Modified" instead of the layout again
+@functools.lru_cache(maxsize=None)
+def layout_json():
+    layout = json.dumps(serve_layout(), cls=plotly.utils.PlotlyJSONEncoder)
+    return layout, hashlib.md5(layout.encode()).hexdigest()
+
+
+def serve_layout_json():
+    layout, etag = layout_json()
+
+    response = flask.Response(layout, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True      # (browsers check the ETag every time vs. using a copy that could be out of date)
+
+    return response.make_conditional(flask.request)
+
+
+# (Dash calls a layout function to validate the component ids when it's set, so a layout without the state options is given for that instead [the ids are the same] to avoid querying at import time)
+app.validation_layout = build_layout([])
+app.layout = serve_layout
+
+# serve the cached layout JSON in place of Dash's layout route (which serializes the layout on every page load)
+server_flask.view_functions[app.config.routes_pathname_prefix + '_dash-layout'] = serve_layout_json
@@ -0,0 +1,67 @@
+import functools
+from app.models import lookup_models, HcpcsCodeLookup
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ------------------------------------------------------- LOOKUPS -------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+# The city, place of service, provider type, credential and HCPCS code columns are stored as integer codes that point to lookup tables (see models.py), while the dropdowns, the cache keys and
+# the filters passed around the app use the labels.  These translate between the two: filters are translated to codes right before a query is built and codes back to labels for display.
+# (The lookup tables are small and don't change while the app is running, so each one is read once per process.)
+
+
+# the columns that are stored as codes
+coded_columns = list(lookup_models)
+
+
+
+# ---- labels & codes ----
+@functools.lru_cache(maxsize=None)
+def label_codes(col):
+    return {row.label: row.id for row in lookup_models[col].query}
+
+
+@functools.lru_cache(maxsize=None)
+def code_labels(col):
+    return {code: label for label, code in label_codes(col).items()}
+
+
+def label(col, value):
+    return code_labels(col)[value] if col in coded_columns else value
+
+
+# HCPCS code -> description (for the HCPCS description textbox)
+@functools.lru_cache(maxsize=None)
+def hcpcs_descriptions():
+    return {row.label: row.description for row in HcpcsCodeLookup.query}
+
+
+# read all of the lookup tables, e.g. when the app starts so that the gunicorn workers forked from it already have them
+def load_lookups():
+    for col in coded_columns:
+        code_labels(col)
+
+    hcpcs_descriptions()
+
+
+# the name of a filter column in the tables, e.g. "city_id" for "city"
+def column_name(col):
+    return f'{col}_id' if col in coded_columns else col
+
+
+def column(model, col):
+    return getattr(model, column_name(col))
+
+
+
+# FILTER QUERY
+# filter a query on a model with coded columns (i.e. Utilization, DropdownCombination or a rollup table) by the non-blank dropdown values, in lists, by column name.
+# (Labels that aren't in a lookup table get code 0, which no row has, so they match nothing, same as comparing the labels would.)
+def filter_query(query, model, filters):
+    for col, value in filters.items():
+        if col in coded_columns:
+            value = [label_codes(col).get(label, 0) for label in value]
+
+        query = query.filter(column(model, col).in_(value))
+
+    return query
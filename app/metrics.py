@@ -0,0 +1,225 @@
+import collections
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import flask
+from sqlalchemy import event
+from app import app, server_flask, db
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ------------------------------------------------------- METRICS -------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+# Latency histograms & counters for the Dash callbacks (by output id), the SQL statements, the results cache and the Excel export, shown in Prometheus' text format at /metrics; each request's
+# timings are also sent back in its Server-Timing header (shown in the browser's developer tools).
+# (Each gunicorn worker keeps its own metrics in memory and saves a snapshot of them to a SQLite file [METRICS_FILE in the config file] at most once every METRICS_SAVE_INTERVAL seconds, and
+# /metrics adds up the snapshots of all of the workers, so it doesn't matter which worker answers it.)
+
+
+# upper bounds of the histogram buckets, in seconds
+duration_buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+metric_help = {
+    'dash_callback_duration_seconds': 'Time to run a Dash callback, by output id.',
+    'sql_statement_duration_seconds': 'Time to run a SQL statement, by statement (lists of parameters are collapsed, e.g. "IN (?)").',
+    'results_cache_requests_total': 'Results (i.e. results_update) cache lookups, by result (hit or miss).',
+    'dropdown_cache_requests_total': 'Dropdown options cache lookups (one per dropdown refreshed), by result (hit or miss).',
+    'excel_export_duration_seconds': 'Time to create & send an Excel export.',
+    'results_single_flight_total': 'Results calculations on a cache miss (see get_or_calculate_results() in results.py), by result: calculated, coalesced (waited for another request\'s results) or gave_up_waiting.',
+    'results_jobs_total': 'Finished background results jobs (see jobs.py), by status (done, cancelled or failed).',
+    'dataset_swaps_total': 'Switches to a new dataset, i.e. database file (see datasets.py).',
+    'dataset_cache_purged_total': 'Cache entries of swapped out datasets that were purged.'
+}
+
+
+
+# METRIC STORE
+# the metrics of this process; histograms are (name, labels) -> [count per bucket..., +Inf count, sum] and counters are (name, labels) -> count, where labels is a tuple of (label, value) pairs
+class MetricStore(object):
+    def __init__(self):
+        self.reset()
+
+    # (also called in each gunicorn worker when it's forked [e.g. with --preload], so that a worker doesn't start with the metrics, or a held lock, of the process it was forked from)
+    def reset(self):
+        self.lock = threading.Lock()
+        self.histograms = collections.defaultdict(lambda: [0] * (len(duration_buckets) + 2))
+        self.counters = collections.defaultdict(int)
+        self.saved = 0
+
+    def observe(self, name, duration, labels):
+        with self.lock:
+            histogram = self.histograms[(name, labels)]
+            histogram[next((i for i, bound in enumerate(duration_buckets) if duration <= bound), len(duration_buckets))] += 1
+            histogram[-1] += duration
+
+    def increment(self, name, labels, count=1):
+        with self.lock:
+            self.counters[(name, labels)] += count
+
+    def snapshot(self):
+        with self.lock:
+            return {'histograms': {key: list(value) for key, value in self.histograms.items()}, 'counters': dict(self.counters)}
+
+
+metric_store = MetricStore()
+os.register_at_fork(after_in_child=metric_store.reset)
+
+
+
+# ---- recording ----
+def observe(name, duration, **labels):
+    metric_store.observe(name, duration, tuple(sorted(labels.items())))
+
+
+def increment(name, count=1, **labels):
+    metric_store.increment(name, tuple(sorted(labels.items())), count)
+
+
+# add a timing to the Server-Timing header of the current request (if any); duration is in seconds
+def server_timing(name, duration=None, desc=None):
+    if flask.has_request_context():
+        flask.g.setdefault('server_timings', []).append((name, duration, desc))
+
+
+
+# ---- saving & combining snapshots (of all of the workers) ----
+def metrics_connection():
+    connection = sqlite3.connect(server_flask.config['METRICS_FILE'], timeout=30, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS metric_snapshot (pid INTEGER PRIMARY KEY, snapshot BLOB)')
+    return connection
+
+
+def save_snapshot(force=False):
+    if not force and time.time() - metric_store.saved < server_flask.config['METRICS_SAVE_INTERVAL']:
+        return
+
+    metric_store.saved = time.time()
+    connection = metrics_connection()
+    try:
+        connection.execute('INSERT OR REPLACE INTO metric_snapshot (pid, snapshot) VALUES (?, ?)', (os.getpid(), pickle.dumps(metric_store.snapshot())))
+    finally:
+        connection.close()
+
+
+# (counts are cumulative per process, so the snapshots of workers that have since been restarted are still included)
+def combined_snapshot():
+    histograms = collections.defaultdict(lambda: [0] * (len(duration_buckets) + 2))
+    counters = collections.defaultdict(int)
+
+    connection = metrics_connection()
+    try:
+        snapshots = [pickle.loads(row[0]) for row in connection.execute('SELECT snapshot FROM metric_snapshot')]
+    finally:
+        connection.close()
+
+    for snapshot in snapshots:
+        for key, value in snapshot['histograms'].items():
+            histograms[key] = [total + count for total, count in zip(histograms[key], value)]
+        for key, value in snapshot['counters'].items():
+            counters[key] += value
+
+    return histograms, counters
+
+
+
+# ---- Prometheus text format ----
+def label_text(labels):
+    if not labels:
+        return ''
+
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + '}'
+
+
+def prometheus_text(histograms, counters):
+    lines = []
+
+    for name in sorted({name for name, _ in histograms}):
+        lines += [f'# HELP {name} {metric_help.get(name, name)}', f'# TYPE {name} histogram']
+
+        for (_, labels), histogram in sorted((key, value) for key, value in histograms.items() if key[0] == name):
+            cumulative_count = 0
+            for bound, count in zip(duration_buckets + ['+Inf'], histogram[:-1]):
+                cumulative_count += count
+                lines.append(f"{name}_bucket{label_text(labels + (('le', bound), ))} {cumulative_count}")
+
+            lines.append(f'{name}_sum{label_text(labels)} {histogram[-1]:.6f}')
+            lines.append(f'{name}_count{label_text(labels)} {cumulative_count}')
+
+    for name in sorted({name for name, _ in counters}):
+        lines += [f'# HELP {name} {metric_help.get(name, name)}', f'# TYPE {name} counter']
+        lines += [f'{name}{label_text(labels)} {count}' for (_, labels), count in sorted((key, value) for key, value in counters.items() if key[0] == name)]
+
+    return '\n'.join(lines) + '\n'
+
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------- INSTRUMENTATION --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+
+# METRICS ENDPOINT
+@app.server.route('/metrics')
+def metrics_endpoint():
+    save_snapshot(force=True)
+    return flask.Response(prometheus_text(*combined_snapshot()), mimetype='text/plain; version=0.0.4')
+
+
+
+# DASH CALLBACKS
+# (every callback is a POST to the same url, so the callback is found from the output id in the request body)
+@server_flask.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+@server_flask.after_request
+def record_request(response):
+    if flask.request.path.endswith('/_dash-update-component') and 'request_start' in flask.g:
+        duration = time.perf_counter() - flask.g.request_start
+        output = (flask.request.get_json(silent=True) or {}).get('output', '')
+
+        observe('dash_callback_duration_seconds', duration, output=output)
+        server_timing('callback', duration, output)
+
+    timings = flask.g.get('server_timings', [])
+    sql_durations = flask.g.get('sql_durations', [])
+    if sql_durations:
+        timings.append(('sql', sum(sql_durations), f'{len(sql_durations)} statements'))
+
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(name + (f';desc={json.dumps(desc)}' if desc else '') + (f';dur={duration * 1000:.1f}' if duration is not None else '')
+                                                      for name, duration, desc in timings)
+
+    save_snapshot()
+
+    return response
+
+
+
+# SQL STATEMENTS
+# (statements are labeled by the query they run, from a small fixed set that's given with execution_options(metric=...) where they're executed [e.g. "ten_table" or "dropdown_options", see
+# results.py & dropdowns.py], and the rest as "other"; vs. by their text, which has a shape per combination of filters, split queries & partitions, i.e. thousands of long labels)
+def statement_label(context):
+    return context.execution_options.get('metric', 'other')
+
+
+# (the start time is kept on the statement's execution context, vs. a stack on the connection, so that nothing is left behind when a statement fails [e.g. a cancelled job's, see jobs.py] and
+# after_cursor_execute isn't called; the listeners are on the app's engine only)
+@event.listens_for(db.get_engine(server_flask), 'before_cursor_execute')
+def start_statement_timer(connection, cursor, statement, parameters, context, executemany):
+    context.statement_start = time.perf_counter()
+
+
+@event.listens_for(db.get_engine(server_flask), 'after_cursor_execute')
+def record_statement(connection, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - context.statement_start
+
+    observe('sql_statement_duration_seconds', duration, statement=statement_label(context))
+
+    if flask.has_request_context():
+        flask.g.setdefault('sql_durations', []).append(duration)
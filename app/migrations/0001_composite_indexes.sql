@@ -0,0 +1,37 @@
+-- Composite & covering indexes for the dropdown and results queries.
+-- (SQLite only uses one index per table in a query, so each index below starts with the filter columns of a query shape the callbacks use [state, then city, etc.] and ends with the column(s) the
+-- query groups/orders by; the results indexes also include the columns the query reads so that the utilization rows themselves don't need to be read.  Run "flask check-query-plans" after
+-- changing these or the queries.)
+
+
+-- ---- dropdown options (see dropdowns.py) ----
+-- state changed: options of every dropdown below it, filtered by state
+CREATE INDEX IF NOT EXISTS ix_dropdown_combination_all ON dropdown_combination (state, city, zip_code, place_of_service, provider_type, credential, hcpcs_code);
+CREATE INDEX IF NOT EXISTS ix_dropdown_combination_state_zip_code ON dropdown_combination (state, zip_code);
+CREATE INDEX IF NOT EXISTS ix_dropdown_combination_state_place_of_service ON dropdown_combination (state, place_of_service);
+CREATE INDEX IF NOT EXISTS ix_dropdown_combination_state_provider_type ON dropdown_combination (state, provider_type);
+CREATE INDEX IF NOT EXISTS ix_dropdown_combination_state_credential ON dropdown_combination (state, credential);
+CREATE INDEX IF NOT EXISTS ix_dropdown_combination_state_hcpcs_code ON dropdown_combination (state, hcpcs_code);
+
+-- city changed: options of every dropdown below it, filtered by state & city (zip code is covered by ix_dropdown_combination_all)
+CREATE INDEX IF NOT EXISTS ix_dropdown_combination_state_city_place_of_service ON dropdown_combination (state, city, place_of_service);
+CREATE INDEX IF NOT EXISTS ix_dropdown_combination_state_city_provider_type ON dropdown_combination (state, city, provider_type);
+CREATE INDEX IF NOT EXISTS ix_dropdown_combination_state_city_credential ON dropdown_combination (state, city, credential);
+CREATE INDEX IF NOT EXISTS ix_dropdown_combination_state_city_hcpcs_code ON dropdown_combination (state, city, hcpcs_code);
+
+
+-- ---- results (see results.py; broader selections are answered from the rollup tables) ----
+-- ten table, by city (the rows are read in rank order so the query stops after 10 matching rows; record id is included since it breaks ties)
+CREATE INDEX IF NOT EXISTS ix_utilization_state_city_avg_charged ON utilization (state, city, avg_charged, record_id);
+CREATE INDEX IF NOT EXISTS ix_utilization_state_city_num_beneficiaries ON utilization (state, city, num_beneficiaries, record_id);
+
+-- ten table, by HCPCS code
+CREATE INDEX IF NOT EXISTS ix_utilization_hcpcs_code_avg_charged ON utilization (hcpcs_code, avg_charged, record_id);
+CREATE INDEX IF NOT EXISTS ix_utilization_hcpcs_code_num_beneficiaries ON utilization (hcpcs_code, num_beneficiaries, record_id);
+
+-- bar chart, by city & by HCPCS code; (the avg charged grouping expression needs to match the one in results.py exactly for SQLite to use these indexes.  The rest of the filter columns are included so
+-- these indexes cover the query no matter which other dropdowns have values.)
+CREATE INDEX IF NOT EXISTS ix_utilization_state_city_charged_group ON utilization (state, city, (CAST(avg_charged / 200 AS INTEGER) + 1) * 200, num_beneficiaries, zip_code, place_of_service, provider_type, credential, hcpcs_code);
+CREATE INDEX IF NOT EXISTS ix_utilization_hcpcs_code_charged_group ON utilization (hcpcs_code, (CAST(avg_charged / 200 AS INTEGER) + 1) * 200, num_beneficiaries, state, city, zip_code, place_of_service, provider_type, credential);
+
+ANALYZE;
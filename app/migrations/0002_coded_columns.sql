@@ -0,0 +1,132 @@
+-- Stores the repeated string columns of the utilization & dropdown_combination tables as integer codes that point to lookup tables (see models.py & lookups.py).
+-- (The city, place of service, provider type, credential and HCPCS code/description strings were repeated on every one of the ~9M utilization rows; as codes the rows, and the indexes on these
+-- columns, are much smaller and the filters compare integers.  State & zip code are left as they are since they're about as small as a code.  The codes are assigned in label order.)
+-- The rollup tables are dropped since they're keyed by the old columns; run "flask build-rollups" after this migration.
+
+
+BEGIN;
+
+-- ---- lookup tables ----
+CREATE TABLE city_lookup (id INTEGER NOT NULL, label VARCHAR(35), PRIMARY KEY (id), UNIQUE (label));
+INSERT INTO city_lookup (label) SELECT DISTINCT city FROM utilization WHERE city IS NOT NULL ORDER BY city;
+
+CREATE TABLE place_of_service_lookup (id INTEGER NOT NULL, label VARCHAR(15), PRIMARY KEY (id), UNIQUE (label));
+INSERT INTO place_of_service_lookup (label) SELECT DISTINCT place_of_service FROM utilization WHERE place_of_service IS NOT NULL ORDER BY place_of_service;
+
+CREATE TABLE provider_type_lookup (id INTEGER NOT NULL, label VARCHAR(50), PRIMARY KEY (id), UNIQUE (label));
+INSERT INTO provider_type_lookup (label) SELECT DISTINCT provider_type FROM utilization WHERE provider_type IS NOT NULL ORDER BY provider_type;
+
+CREATE TABLE credential_lookup (id INTEGER NOT NULL, label VARCHAR(25), PRIMARY KEY (id), UNIQUE (label));
+INSERT INTO credential_lookup (label) SELECT DISTINCT credential FROM utilization WHERE credential IS NOT NULL ORDER BY credential;
+
+-- (a code has the same description on all of its rows; MIN just picks one)
+CREATE TABLE hcpcs_code_lookup (id INTEGER NOT NULL, label VARCHAR(5), description VARCHAR(260), PRIMARY KEY (id), UNIQUE (label));
+INSERT INTO hcpcs_code_lookup (label, description) SELECT hcpcs_code, MIN(hcpcs_desc) FROM utilization WHERE hcpcs_code IS NOT NULL GROUP BY hcpcs_code ORDER BY hcpcs_code;
+
+
+-- ---- utilization ----
+CREATE TABLE utilization_coded (
+    record_id INTEGER NOT NULL,
+    provider_id INTEGER,
+    credential_id INTEGER,
+    city_id INTEGER,
+    zip_code VARCHAR(5),
+    state VARCHAR(2),
+    provider_type_id INTEGER,
+    place_of_service_id INTEGER,
+    hcpcs_code_id INTEGER,
+    num_beneficiaries INTEGER,
+    avg_allowed FLOAT,
+    avg_charged FLOAT,
+    avg_paid FLOAT,
+    PRIMARY KEY (record_id)
+);
+
+INSERT INTO utilization_coded
+SELECT utilization.record_id, utilization.provider_id, credential_lookup.id, city_lookup.id, utilization.zip_code, utilization.state, provider_type_lookup.id, place_of_service_lookup.id,
+       hcpcs_code_lookup.id, utilization.num_beneficiaries, utilization.avg_allowed, utilization.avg_charged, utilization.avg_paid
+FROM utilization
+LEFT JOIN credential_lookup ON credential_lookup.label = utilization.credential
+LEFT JOIN city_lookup ON city_lookup.label = utilization.city
+LEFT JOIN provider_type_lookup ON provider_type_lookup.label = utilization.provider_type
+LEFT JOIN place_of_service_lookup ON place_of_service_lookup.label = utilization.place_of_service
+LEFT JOIN hcpcs_code_lookup ON hcpcs_code_lookup.label = utilization.hcpcs_code
+ORDER BY utilization.record_id;
+
+-- (dropping the old table also drops its indexes, including the ones from 0001_composite_indexes.sql, which are recreated on the codes below)
+DROP TABLE utilization;
+ALTER TABLE utilization_coded RENAME TO utilization;
+
+
+-- ---- dropdown_combination ----
+DROP TABLE dropdown_combination;
+
+CREATE TABLE dropdown_combination (
+    id INTEGER NOT NULL,
+    state VARCHAR(2),
+    city_id INTEGER,
+    zip_code VARCHAR(5),
+    place_of_service_id INTEGER,
+    provider_type_id INTEGER,
+    credential_id INTEGER,
+    hcpcs_code_id INTEGER,
+    PRIMARY KEY (id)
+);
+
+INSERT INTO dropdown_combination (state, city_id, zip_code, place_of_service_id, provider_type_id, credential_id, hcpcs_code_id)
+SELECT DISTINCT state, city_id, zip_code, place_of_service_id, provider_type_id, credential_id, hcpcs_code_id
+FROM utilization
+ORDER BY state, city_id, zip_code, place_of_service_id, provider_type_id, credential_id, hcpcs_code_id;
+
+
+-- ---- rollup tables ----
+DROP TABLE IF EXISTS charged_group_rollup;
+DROP TABLE IF EXISTS ranking_rollup;
+
+
+-- ---- indexes ----
+-- (the single column indexes of the models, then the composite & covering indexes of 0001_composite_indexes.sql with the codes in place of the strings; see that file for what each one is for)
+CREATE INDEX ix_utilization_provider_id ON utilization (provider_id);
+CREATE INDEX ix_utilization_credential_id ON utilization (credential_id);
+CREATE INDEX ix_utilization_city_id ON utilization (city_id);
+CREATE INDEX ix_utilization_zip_code ON utilization (zip_code);
+CREATE INDEX ix_utilization_state ON utilization (state);
+CREATE INDEX ix_utilization_provider_type_id ON utilization (provider_type_id);
+CREATE INDEX ix_utilization_place_of_service_id ON utilization (place_of_service_id);
+CREATE INDEX ix_utilization_hcpcs_code_id ON utilization (hcpcs_code_id);
+
+CREATE INDEX ix_utilization_state_city_avg_charged ON utilization (state, city_id, avg_charged, record_id);
+CREATE INDEX ix_utilization_state_city_num_beneficiaries ON utilization (state, city_id, num_beneficiaries, record_id);
+CREATE INDEX ix_utilization_hcpcs_code_avg_charged ON utilization (hcpcs_code_id, avg_charged, record_id);
+CREATE INDEX ix_utilization_hcpcs_code_num_beneficiaries ON utilization (hcpcs_code_id, num_beneficiaries, record_id);
+CREATE INDEX ix_utilization_state_city_charged_group ON utilization (state, city_id, (CAST(avg_charged / 200 AS INTEGER) + 1) * 200, num_beneficiaries, zip_code, place_of_service_id, provider_type_id,
+                                                                     credential_id, hcpcs_code_id);
+CREATE INDEX ix_utilization_hcpcs_code_charged_group ON utilization (hcpcs_code_id, (CAST(avg_charged / 200 AS INTEGER) + 1) * 200, num_beneficiaries, state, city_id, zip_code, place_of_service_id,
+                                                                     provider_type_id, credential_id);
+
+CREATE INDEX ix_dropdown_combination_state ON dropdown_combination (state);
+CREATE INDEX ix_dropdown_combination_city_id ON dropdown_combination (city_id);
+CREATE INDEX ix_dropdown_combination_zip_code ON dropdown_combination (zip_code);
+CREATE INDEX ix_dropdown_combination_place_of_service_id ON dropdown_combination (place_of_service_id);
+CREATE INDEX ix_dropdown_combination_provider_type_id ON dropdown_combination (provider_type_id);
+CREATE INDEX ix_dropdown_combination_credential_id ON dropdown_combination (credential_id);
+CREATE INDEX ix_dropdown_combination_hcpcs_code_id ON dropdown_combination (hcpcs_code_id);
+
+CREATE INDEX ix_dropdown_combination_all ON dropdown_combination (state, city_id, zip_code, place_of_service_id, provider_type_id, credential_id, hcpcs_code_id);
+CREATE INDEX ix_dropdown_combination_state_zip_code ON dropdown_combination (state, zip_code);
+CREATE INDEX ix_dropdown_combination_state_place_of_service ON dropdown_combination (state, place_of_service_id);
+CREATE INDEX ix_dropdown_combination_state_provider_type ON dropdown_combination (state, provider_type_id);
+CREATE INDEX ix_dropdown_combination_state_credential ON dropdown_combination (state, credential_id);
+CREATE INDEX ix_dropdown_combination_state_hcpcs_code ON dropdown_combination (state, hcpcs_code_id);
+CREATE INDEX ix_dropdown_combination_state_city_place_of_service ON dropdown_combination (state, city_id, place_of_service_id);
+CREATE INDEX ix_dropdown_combination_state_city_provider_type ON dropdown_combination (state, city_id, provider_type_id);
+CREATE INDEX ix_dropdown_combination_state_city_credential ON dropdown_combination (state, city_id, credential_id);
+CREATE INDEX ix_dropdown_combination_state_city_hcpcs_code ON dropdown_combination (state, city_id, hcpcs_code_id);
+
+COMMIT;
+
+
+-- (gives the space of the old tables back, i.e. shrinks the file)
+VACUUM;
+
+ANALYZE;
@@ -2,22 +2,152 @@ from app import db
 
 
 # (indexed the columns that feed dropdowns so that dropdown options will update faster as users are making selections; indexing these columns should also speed up
-# other queries as these columns are used to filter the data set.)
+# other queries as these columns are used to filter the data set.  The repeated string columns are stored as integer codes that point to the lookup tables below [see migrations], so the
+# filters compare small integers and the labels are only looked up for display; see lookups.py.)
 class Utilization(db.Model):
     record_id = db.Column(db.Integer, primary_key=True)
     provider_id = db.Column(db.Integer, index=True)
-    credential = db.Column(db.String(25), index=True)
-    city = db.Column(db.String(35), index=True)
+    credential_id = db.Column(db.Integer, index=True)
+    city_id = db.Column(db.Integer, index=True)
     zip_code = db.Column(db.String(5), index=True)
     state = db.Column(db.String(2), index=True)
-    provider_type = db.Column(db.String(50), index=True)
-    place_of_service = db.Column(db.String(15), index=True)
-    hcpcs_code = db.Column(db.String(5), index=True)
-    hcpcs_desc = db.Column(db.String(260))
+    provider_type_id = db.Column(db.Integer, index=True)
+    place_of_service_id = db.Column(db.Integer, index=True)
+    hcpcs_code_id = db.Column(db.Integer, index=True)
     num_beneficiaries = db.Column(db.Integer)
     avg_allowed = db.Column(db.Float(precision=9))
     avg_charged = db.Column(db.Float(precision=9))
     avg_paid = db.Column(db.Float(precision=9))
 
     def __repr__(self):
-        return '<Utilization {}>'.format(self.record_id)
\ No newline at end of file
+        return '<Utilization {}>'.format(self.record_id)
+
+
+# LOOKUP TABLES
+# (one per coded column: the code [id] and label of each distinct value; the codes are assigned in label order when the tables are built.  The HCPCS code lookup also holds the code's description,
+# which used to be repeated on every utilization row.)
+class CityLookup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    label = db.Column(db.String(35), unique=True)
+
+    def __repr__(self):
+        return '<CityLookup {}>'.format(self.label)
+
+
+class PlaceOfServiceLookup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    label = db.Column(db.String(15), unique=True)
+
+    def __repr__(self):
+        return '<PlaceOfServiceLookup {}>'.format(self.label)
+
+
+class ProviderTypeLookup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    label = db.Column(db.String(50), unique=True)
+
+    def __repr__(self):
+        return '<ProviderTypeLookup {}>'.format(self.label)
+
+
+class CredentialLookup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    label = db.Column(db.String(25), unique=True)
+
+    def __repr__(self):
+        return '<CredentialLookup {}>'.format(self.label)
+
+
+class HcpcsCodeLookup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    label = db.Column(db.String(5), unique=True)
+    description = db.Column(db.String(260))
+
+    def __repr__(self):
+        return '<HcpcsCodeLookup {}>'.format(self.label)
+
+
+# the lookup table of each coded column, by the column's (label) name
+lookup_models = {
+    'city': CityLookup,
+    'place_of_service': PlaceOfServiceLookup,
+    'provider_type': ProviderTypeLookup,
+    'credential': CredentialLookup,
+    'hcpcs_code': HcpcsCodeLookup
+}
+
+
+# (distinct combinations of the columns that feed the dropdowns; the dropdown options are queried from this table instead of the utilization table since it's a fraction of the size.
+# This table is built from the utilization table by create_dropdown_combination.sql and then coded like the utilization table by the migrations [see Dockerfile], so it needs to be rebuilt whenever
+# the utilization table changes.)
+class DropdownCombination(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    state = db.Column(db.String(2), index=True)
+    city_id = db.Column(db.Integer, index=True)
+    zip_code = db.Column(db.String(5), index=True)
+    place_of_service_id = db.Column(db.Integer, index=True)
+    provider_type_id = db.Column(db.Integer, index=True)
+    credential_id = db.Column(db.Integer, index=True)
+    hcpcs_code_id = db.Column(db.Integer, index=True)
+
+    def __repr__(self):
+        return '<DropdownCombination {}>'.format(self.id)
+
+
+# ROLLUP TABLES
+# (Precomputed results for the results section, built from the utilization table by the "flask build-rollups" command [see commands.py].  There is one set of rows per rollup level [see ROLLUP_LEVELS in
+# the config file], where a level is a list of the filter columns the rows are grouped by; the level's name is its columns joined by commas [the columns not in the level are left NULL].)
+
+# total patients per avg charged grouping (i.e. the bar chart)
+class ChargedGroupRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    level = db.Column(db.String(100))
+    state = db.Column(db.String(2))
+    city_id = db.Column(db.Integer)
+    zip_code = db.Column(db.String(5))
+    place_of_service_id = db.Column(db.Integer)
+    provider_type_id = db.Column(db.Integer)
+    credential_id = db.Column(db.Integer)
+    hcpcs_code_id = db.Column(db.Integer)
+    charged_group = db.Column(db.Integer)
+    patients = db.Column(db.Integer)
+
+    # (the rows are read in grouping order; the first index is for levels where the selection includes a state and the second for the level without filters)
+    __table_args__ = (
+        db.Index('ix_charged_group_rollup_level_state_charged_group', 'level', 'state', 'charged_group', 'patients'),
+        db.Index('ix_charged_group_rollup_level_charged_group', 'level', 'charged_group', 'patients')
+    )
+
+    def __repr__(self):
+        return '<ChargedGroupRollup {}>'.format(self.id)
+
+
+# the top & bottom few records per rank by column (i.e. the ten table); (the top ten records of a set of groups are always within the combined top ten records of each group)
+class RankingRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    level = db.Column(db.String(100))
+    rank_by = db.Column(db.String(20))
+    rank_position = db.Column(db.String(6))
+    state = db.Column(db.String(2))
+    city_id = db.Column(db.Integer)
+    zip_code = db.Column(db.String(5))
+    place_of_service_id = db.Column(db.Integer)
+    provider_type_id = db.Column(db.Integer)
+    credential_id = db.Column(db.Integer)
+    hcpcs_code_id = db.Column(db.Integer)
+    rank_value = db.Column(db.Float(precision=9))        # (value of the rank by column, so one index can be used for both rank by columns)
+    record_id = db.Column(db.Integer)
+    provider_id = db.Column(db.Integer)
+    num_beneficiaries = db.Column(db.Integer)
+    avg_allowed = db.Column(db.Float(precision=9))
+    avg_charged = db.Column(db.Float(precision=9))
+    avg_paid = db.Column(db.Float(precision=9))
+
+    # (the rows are read in rank order [record id breaks ties]; the first index is for levels where the selection includes a state and the second for the level without filters)
+    __table_args__ = (
+        db.Index('ix_ranking_rollup_level_rank_by_rank_position_state_rank_value', 'level', 'rank_by', 'rank_position', 'state', 'rank_value', 'record_id'),
+        db.Index('ix_ranking_rollup_level_rank_by_rank_position_rank_value', 'level', 'rank_by', 'rank_position', 'rank_value', 'record_id')
+    )
+
+    def __repr__(self):
+        return '<RankingRollup {}>'.format(self.id)
\ No newline at end of file
@@ -0,0 +1,87 @@
+import concurrent.futures
+import contextvars
+import functools
+import os
+import re
+import threading
+from sqlalchemy import MetaData, Table, Column
+from app import server_flask, db
+from app.models import Utilization
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ------------------------------------------------- STATE PARTITIONS ----------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+# Most selections are of one or a few states, but a selection that the rollup tables don't answer is queried from the utilization table (i.e. through indexes over all ~9M rows).  When
+# STATE_PARTITIONS is turned on and "flask build-partitions" has been run, such a selection is answered from copies of the utilization table's rows per state instead (the partitions, e.g.
+# utilization_tn), with the same query run on just the selected states' partitions [or on all of them at the same time when no state is selected and STATE_PARTITION_THREADS is 2 or more] and the
+# results merged (see PARTITION QUERIES in results.py).  (The partitions are tables in the same database file, listed in the utilization_partition table, with the utilization table's indexes minus
+# the state column [see build-partitions in commands.py]; they double the size of the file.  The utilization table is kept as it is since the rollup tables, the columnar engine and the
+# dropdown_combination table are built from it.)
+
+
+# ---- partition tables ----
+partition_metadata = MetaData()
+
+
+# the table of a partition, with the utilization table's columns (and no indexes, since those are created by build-partitions)
+def partition_table(table_name):
+    if table_name in partition_metadata.tables:
+        return partition_metadata.tables[table_name]
+
+    return Table(table_name, partition_metadata, *[Column(column.name, column.type, primary_key=column.primary_key) for column in Utilization.__table__.columns])
+
+
+def partition_table_name(state):
+    return 'utilization_' + re.sub('[^a-z0-9]', '_', state.lower())
+
+
+# the partition tables by state, if turned on and built (otherwise an empty dictionary); (read once per process, like the lookup tables)
+@functools.lru_cache(maxsize=None)
+def partition_tables():
+    if not server_flask.config['STATE_PARTITIONS']:
+        return {}
+
+    if not db.engine.dialect.has_table(db.engine, 'utilization_partition'):
+        server_flask.logger.warning('STATE_PARTITIONS is turned on but the partitions have not been built; run "flask build-partitions".')
+        return {}
+
+    return {row.state: partition_table(row.table_name) for row in db.session.execute('SELECT state, table_name FROM utilization_partition')}
+
+
+
+# FAN OUT
+# run a function on groups of the partition tables at the same time, one group per thread of a small pool (STATE_PARTITION_THREADS per process) that's separate from the results query threads [see
+# run_concurrently() in results.py], which run the functions that fan out; each run has its own app context, i.e. its own database session & connection.  Returns the results of each group.
+# (The tables are grouped vs. run one at a time since a query on a small state's partition takes less time than its overhead; they're dealt out in turn so the large states end up in different groups.)
+executor = None
+executor_pid = None
+executor_lock = threading.Lock()
+
+
+def partition_executor():
+    global executor, executor_pid
+
+    # (created on first use in each process, so that a gunicorn worker forked from a preloaded app gets its own threads)
+    with executor_lock:
+        if executor is None or executor_pid != os.getpid():
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=server_flask.config['STATE_PARTITION_THREADS'], thread_name_prefix='partition_query')
+            executor_pid = os.getpid()
+
+        return executor
+
+
+def fan_out(function, tables):
+    group_count = min(server_flask.config['STATE_PARTITION_THREADS'], len(tables))
+
+    # (all at once, in the calling thread, if turned off or there's only one table)
+    if group_count < 2:
+        return [function(tables)] if tables else []
+
+    def run(group):
+        with server_flask.app_context():
+            return function(group)
+
+    futures = [partition_executor().submit(contextvars.copy_context().run, run, tables[start::group_count]) for start in range(group_count)]
+
+    return [future.result() for future in futures]
@@ -0,0 +1,109 @@
+from app import db
+from app.dropdowns import dropdowns_queries
+from app.results import ten_table_query, bar_chart_query, use_partitions, partition_ten_table_query, partition_bar_chart_query, partition_filters
+from app.partitions import partition_tables
+
+
+# example values for each dropdown (one value each, like a typical selection; the values don't need to match any rows since the queries are only explained, not run)
+example_selections = {
+    'state': ['TN'],
+    'city': ['Nashville'],
+    'zip_code': ['37203'],
+    'place_of_service': ['Non-Facility'],
+    'provider_type': ['Family Practice'],
+    'credential': ['MD'],
+    'hcpcs_code': ['99213']
+}
+
+# the same with several values each (e.g. the default HCPCS code selection), since a query filtered on several values of an index's leading column reads a range per value vs. one range in order
+# (see SPLIT FILTERS in results.py)
+example_multiple_selections = {
+    'state': ['TN', 'KY'],
+    'city': ['Nashville', 'Franklin'],
+    'zip_code': ['37203', '37064'],
+    'place_of_service': ['Facility', 'Non-Facility'],
+    'provider_type': ['Family Practice', 'Internal Medicine'],
+    'credential': ['MD', 'DO'],
+    'hcpcs_code': ['99213', '99214', '99215']
+}
+
+# the filter columns of the results selections the indexes are built for; (the selections that line up with a rollup level are explained against the rollup tables)
+results_filter_columns = [
+    [],
+    ['state'],
+    ['state', 'city'],
+    ['state', 'city', 'zip_code'],
+    ['state', 'city', 'place_of_service', 'provider_type', 'hcpcs_code'],
+    ['state', 'city', 'zip_code', 'place_of_service', 'provider_type', 'credential', 'hcpcs_code'],
+    ['hcpcs_code'],
+    ['place_of_service', 'hcpcs_code']
+]
+
+
+
+# QUERY SHAPES
+# the queries the callbacks run, built by the same functions the callbacks use, as (name, query, sort accepted) tuples; (a shape whose sort is accepted is only listed as a problem if it reads a
+# whole table)
+def query_shapes():
+    shapes = []
+
+    # ---- dropdown options ----
+    # (after the app has loaded: the state dropdown cleared [i.e. all states], the state dropdown changed and the city dropdown changed.  With several states/cities selected, each option's rows
+    # are read from a range per state/city of the dropdown_combination table's indexes and the distinct options are sorted; that sort is accepted since it's of the few options of the selected
+    # states/cities, vs. rows of the utilization table)
+    for trigger_column, selections in [('state', {}), ('state', example_selections), ('city', example_selections), ('state', example_multiple_selections), ('city', example_multiple_selections)]:
+        queries, dropdown_values = dropdowns_queries(selections, trigger_column, 1)
+        for col, query in zip(dropdown_values, queries):
+            multiple = selections is example_multiple_selections
+            shapes.append((f"dropdown {col} (trigger: {trigger_column}{'' if selections else ', all states'}{', multiple values' if multiple else ''})", query, multiple))
+
+    # ---- results ----
+    for filter_columns in results_filter_columns:
+        for selections, values_name in [(example_selections, ''), (example_multiple_selections, ', multiple values')]:
+            if not filter_columns and values_name:
+                continue
+
+            filters = {col: selections[col] for col in filter_columns}
+            filters_name = (', '.join(filter_columns) or 'no filters') + values_name
+
+            for order_by_col in ['avg_charged', 'num_beneficiaries']:
+                for rank_position in ['Top', 'Bottom']:
+                    shapes.append((f'ten table {rank_position} by {order_by_col} ({filters_name})', ten_table_query(filters, order_by_col, rank_position), False))
+
+            shapes.append((f'bar chart ({filters_name})', bar_chart_query(filters), False))
+
+            # (the state partitions, if turned on & built, answer the selections that the rollup tables don't; each one is explained against the example state's partition, which a selection
+            # without a state queries too [when they're queried in parallel], vs. e.g. the first one; the smallest states' partitions can get other plans, which don't matter at their size)
+            if use_partitions(filters):
+                tables, table_filters = partition_filters({**filters, 'state': example_selections['state']})
+                table = tables[0] if tables else next(iter(partition_tables().values()))
+
+                for order_by_col in ['avg_charged', 'num_beneficiaries']:
+                    for rank_position in ['Top', 'Bottom']:
+                        shapes.append((f'partition ten table {rank_position} by {order_by_col} ({filters_name})',
+                                       partition_ten_table_query([table], table_filters, order_by_col, rank_position), False))
+
+                shapes.append((f'partition bar chart ({filters_name})', partition_bar_chart_query([table], table_filters), False))
+
+    return shapes
+
+
+
+# CHECK QUERY PLANS
+# explain each query shape and list its problems; a query plan is a problem if it reads a whole table (vs. an index) or sorts the rows with a temp b-tree, as both are slow on the utilization table.
+# (Scanning a covering index is allowed since that's the fastest way to get e.g. the options of a dropdown for all states.)
+def check_query_plans():
+    problems = []
+    plans = []
+
+    for name, query, sort_accepted in query_shapes():
+        # (the values are put straight into the SQL since EXPLAIN QUERY PLAN needs a complete statement)
+        sql = str(query.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        plan = [row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN ' + sql)]
+        plans.append((name, plan))
+
+        for step in plan:
+            if (step.startswith('SCAN') and 'COVERING INDEX' not in step) or ('USE TEMP B-TREE' in step and not sort_accepted):
+                problems.append((name, step))
+
+    return plans, problems
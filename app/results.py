@@ -0,0 +1,395 @@
+import collections
+import concurrent.futures
+import contextvars
+import hashlib
+import itertools
+import os
+import pickle
+import threading
+import time
+import numpy as np
+from sqlalchemy import Integer, func, select, union_all
+from sqlalchemy.sql.expression import literal_column
+from app import server_flask, db, cache, columnar
+from app.models import Utilization, ChargedGroupRollup, RankingRollup
+from app.lookups import filter_query
+from app.partitions import partition_tables, fan_out
+from app.database import dataset_cache_prefix
+from app.histogram import histogram
+from app.metrics import increment
+
+
+# width of the avg charged groupings the bar chart queries total the patients by (the bar chart's buckets are built from these groupings when the data comes from the database)
+bar_chart_increment = 200
+
+# (find the avg charged groupings by rounding up to the nearest multiple of the increment; this is literal SQL vs. bound parameters so that it matches the indexes on this expression [see migrations])
+charged_group_sql = f'(CAST(utilization.avg_charged / {bar_chart_increment} AS INTEGER) + 1) * {bar_chart_increment}'
+# (the same without the table name, for the state partitions' indexes & queries [see PARTITION QUERIES below]; SQLite doesn't allow table names in an index's expressions)
+partition_charged_group_sql = f'(CAST(avg_charged / {bar_chart_increment} AS INTEGER) + 1) * {bar_chart_increment}'
+
+
+
+# ROLLUP LEVEL (i.e. query planner)
+# find the smallest rollup level that contains all of the filtered columns; (returns None if there isn't one, in which case the utilization table needs to be queried).
+# The filtered columns don't need to match the level's columns exactly, e.g. a selection of just a state can be answered from the state/city level by combining the rows of all the cities.
+def rollup_level(filters):
+    for level in sorted(server_flask.config['ROLLUP_LEVELS'], key=len):
+        if set(filters) <= set(level):
+            return level
+
+    return None
+
+
+
+# SPLIT FILTERS
+# An index on e.g. (hcpcs code, avg charged, record id) is read in avg charged order for one HCPCS code, but a selection of several codes reads a range of it per code, which SQLite then has to sort.
+# So the filters are split into one set per combination of the values of the index's leading (seek) columns, each of which reads one range in order, and the queries of the sets are run as one
+# statement: the ten table's as a UNION ALL that SQLite merges in rank order (see ranked_statement()) and the bar chart's as a UNION ALL whose totals per grouping are added up (see
+# charged_group_totals()).  Returns the filters as they are when no seek column has more than one value, or when there would be more than max_split_queries sets (those selections are sorted).
+# (the seek columns of the indexes the ten table & bar chart queries read, per table, in the order the query planner prefers them; a query is split on the first ones that are all filtered)
+utilization_seek_columns = [['hcpcs_code'], ['state', 'city']]
+rollup_seek_columns = [['state']]
+partition_seek_columns = [['hcpcs_code'], ['city']]
+max_split_queries = 64
+
+
+def split_filters(filters, seek_columns):
+    for cols in seek_columns:
+        if set(cols) <= set(filters):
+            split_cols = [col for col in cols if len(filters[col]) > 1]
+            combinations = list(itertools.product(*[filters[col] for col in split_cols]))
+
+            if split_cols and len(combinations) <= max_split_queries:
+                return [{**filters, **{col: [value] for col, value in zip(split_cols, values)}} for values in combinations]
+
+            break
+
+    return [filters]
+
+
+
+# TEN TABLE QUERY
+# (filters are the non-blank dropdown values, in lists, by column name; order_by_col is the utilization column to rank by and rank_position is "Top" or "Bottom")
+def ten_table_query(filters, order_by_col, rank_position):
+    level = rollup_level(filters)
+
+    if level is not None:
+        model = RankingRollup
+        rank_col = RankingRollup.rank_value
+        query = RankingRollup.query.filter(RankingRollup.level == ','.join(level), RankingRollup.rank_by == order_by_col, RankingRollup.rank_position == rank_position)
+        seek_columns = rollup_seek_columns
+    else:
+        model = Utilization
+        rank_col = getattr(Utilization, order_by_col)
+        query = Utilization.query
+        seek_columns = utilization_seek_columns
+
+    query = query.with_entities(model.record_id, rank_col.label('rank_value'), model.provider_id, model.num_beneficiaries, model.avg_charged, model.avg_allowed, model.avg_paid)
+
+    return ranked_statement([filter_query(query, model, split) for split in split_filters(filters, seek_columns)], rank_position)
+
+
+# RANKED STATEMENT
+# the top/bottom 10 rows of queries with rank_value & record_id columns, as one statement: the query itself, or a UNION ALL of the queries, which SQLite reads side by side in rank order [each one
+# from its index] and stops after 10 rows.  (record id breaks ties, in the same direction as the rank so an index on the rank column & record id can be read in order; this way the results are the
+# same whether or not they come from the rollup table)
+def ranked_statement(queries, rank_position):
+    statement = queries[0].statement if len(queries) == 1 else union_all(*[query.statement for query in queries])
+
+    if rank_position == 'Top':
+        statement = statement.order_by(literal_column('rank_value').desc(), literal_column('record_id').desc())
+    else:
+        statement = statement.order_by(literal_column('rank_value'), literal_column('record_id'))
+
+    return statement.limit(10)
+
+
+def ten_table_results(filters, order_by_col, rank_position):
+    # (the rollup tables are used first since they're precomputed, then the columnar engine if it's turned on, then the state partitions if they're turned on, then the utilization table)
+    # (the columnar table is read once since it's dropped while a new dataset's table is loaded, see datasets.py)
+    table = columnar.columnar_table
+
+    if rollup_level(filters) is None and table is not None:
+        return table.top_n(filters, order_by_col, rank_position, 10)
+
+    if use_partitions(filters):
+        return partition_ten_table_results(filters, order_by_col, rank_position)
+
+    return db.session.execute(ten_table_query(filters, order_by_col, rank_position).execution_options(metric='ten_table')).fetchall()
+
+
+
+# BAR CHART QUERY
+# total patients per avg charged grouping; (a grouping can be in more than one row when the query is split [see SPLIT FILTERS], so the rows are added up by charged_group_totals())
+ChargedGroupTotal = collections.namedtuple('ChargedGroupTotal', ['charged_group', 'patients'])
+
+
+def bar_chart_query(filters):
+    level = rollup_level(filters)
+
+    if level is not None:
+        model = ChargedGroupRollup
+        charged_group = ChargedGroupRollup.charged_group
+        query = ChargedGroupRollup.query.with_entities(charged_group.label('charged_group'), func.sum(ChargedGroupRollup.patients).label('patients'))\
+            .filter(ChargedGroupRollup.level == ','.join(level))
+        seek_columns = rollup_seek_columns
+    else:
+        model = Utilization
+        charged_group = literal_column(charged_group_sql, Integer)
+        query = Utilization.query.with_entities(charged_group.label('charged_group'), func.sum(Utilization.num_beneficiaries).label('patients'))
+        seek_columns = utilization_seek_columns
+
+    return grouped_statement([filter_query(query, model, split).group_by(charged_group) for split in split_filters(filters, seek_columns)])
+
+
+# (the queries as one statement; a UNION ALL isn't ordered since SQLite would sort each query's groupings for it, vs. reading them in order from its index)
+def grouped_statement(queries):
+    return queries[0].statement if len(queries) == 1 else union_all(*[query.statement for query in queries])
+
+
+# the total patients per grouping of the rows of bar chart queries, in grouping order
+def charged_group_totals(results):
+    totals = collections.Counter()
+    for result in results:
+        totals[result.charged_group] += result.patients
+
+    return [ChargedGroupTotal(charged_group, patients) for charged_group, patients in sorted(totals.items())]
+
+
+# BAR CHART HISTOGRAM
+# bar chart labels & total patients per avg charged bucket (see histogram.py for the method/bucket_width/num_buckets arguments).
+# (The columnar engine has every row's avg charged amount so any buckets can be used.  Otherwise the totals per grouping from the database are bucketed instead [each grouping is placed at its lower
+# edge], in which case the bucket width needs to be a multiple of the grouping increment so the groupings aren't split; it's rounded to the nearest multiple if not.)
+def bar_chart_histogram(filters, method='fixed', bucket_width=bar_chart_increment, num_buckets=11):
+    table = columnar.columnar_table
+
+    if rollup_level(filters) is None and table is not None:
+        values, weights = table.charged_values(filters)
+    else:
+        results = partition_bar_chart_results(filters) if use_partitions(filters) else charged_group_totals(db.session.execute(bar_chart_query(filters).execution_options(metric='bar_chart')))
+        values = np.array([result.charged_group - bar_chart_increment for result in results], dtype=np.float64)
+        weights = np.array([result.patients for result in results], dtype=np.float64)
+        bucket_width = max(1, int(round(bucket_width / bar_chart_increment))) * bar_chart_increment
+
+    return histogram(values, weights, method, bucket_width, num_buckets)
+
+
+
+# PARTITION QUERIES
+# the ten table & bar chart queries on the state partitions (see partitions.py), which are run on the selected states' partitions [or all of them when no state is selected] with the rest of the
+# filters, in groups at the same time if STATE_PARTITION_THREADS is set, and their results merged, so that the results are the same as the utilization table's.  A group's partitions are queried in
+# one statement, i.e. each partition's query as a subquery of a UNION ALL, which SQLite runs one after the other with each one's indexes.
+# (The partitions are only used for the selections that the rollup tables don't answer, and not with the columnar engine.  A selection without a state is only answered from them when they're
+# queried in parallel [STATE_PARTITION_THREADS of 2 or more], since querying every partition one after the other measured slower than the utilization table's indexes; with 0 or 1 threads it's
+# answered from the utilization table.  A selection of HCPCS codes without a state is answered from the utilization table either way, since its HCPCS code indexes read just the code's rows in order,
+# which takes less time than building & running a query per partition.)
+def use_partitions(filters):
+    if rollup_level(filters) is not None or columnar.columnar_table is not None or not partition_tables():
+        return False
+
+    return 'state' in filters or ('hcpcs_code' not in filters and server_flask.config['STATE_PARTITION_THREADS'] > 1)
+
+
+# the partition tables of the selected states (or all of them if no state is selected), in state order, and the filters without the state
+def partition_filters(filters):
+    tables = partition_tables()
+    states = sorted(filters['state']) if 'state' in filters else sorted(tables)
+
+    return [tables[state] for state in states if state in tables], {col: value for col, value in filters.items() if col != 'state'}
+
+
+# (same as ten_table_query(), per partition, so that the top/bottom 10 of each partition can be merged; SQLite doesn't allow ORDER BY or LIMIT on the queries of a UNION ALL themselves, so each
+# partition's statement is selected from as a subquery)
+def partition_ten_table_query(tables, filters, order_by_col, rank_position):
+    statements = []
+
+    for table in tables:
+        query = db.session.query(table.c.record_id, table.c[order_by_col].label('rank_value'), table.c.provider_id, table.c.num_beneficiaries, table.c.avg_charged, table.c.avg_allowed,
+                                 table.c.avg_paid)
+
+        statements.append(ranked_statement([filter_query(query, table.c, split) for split in split_filters(filters, partition_seek_columns)], rank_position))
+
+    return statements[0] if len(statements) == 1 else union_all(*[select([statement.alias()]) for statement in statements])
+
+
+# (the top/bottom 10 overall are the top/bottom 10 of the partitions' top/bottom 10s)
+def partition_ten_table_results(filters, order_by_col, rank_position):
+    tables, filters = partition_filters(filters)
+
+    results = itertools.chain.from_iterable(fan_out(lambda group: db.session.execute(partition_ten_table_query(group, filters, order_by_col, rank_position).execution_options(metric='partition_ten_table')).fetchall(), tables))
+
+    return sorted(results, key=lambda result: (result['rank_value'], result['record_id']), reverse=rank_position == 'Top')[:10]
+
+
+def partition_bar_chart_query(tables, filters):
+    queries = []
+
+    for table in tables:
+        charged_group = literal_column(partition_charged_group_sql, Integer)
+        query = db.session.query(charged_group.label('charged_group'), func.sum(table.c.num_beneficiaries).label('patients')).select_from(table)
+
+        queries += [filter_query(query, table.c, split).group_by(charged_group) for split in split_filters(filters, partition_seek_columns)]
+
+    return grouped_statement(queries)
+
+
+# (the partitions' totals per grouping are added up)
+def partition_bar_chart_results(filters):
+    tables, filters = partition_filters(filters)
+
+    return charged_group_totals(itertools.chain.from_iterable(fan_out(lambda group: db.session.execute(partition_bar_chart_query(group, filters).execution_options(metric='partition_bar_chart')).fetchall(), tables)))
+
+
+
+
+# RESULTS USER INPUTS
+# the user's selections as an ordered dictionary, which is what the results are cached by and what the Excel export lists on its input tab.
+# (selections are the dropdown values by column name, as they come from the dropdowns; rank position and rank by should already be filled in if blank.  The bar chart's bucket settings are the
+# config file's defaults if they're not given or aren't one of the choices [see config.py], so that a request can't ask for e.g. millions of buckets.)
+bar_chart_bucketing_choices = ['fixed', 'quantile']
+
+# (the user inputs that aren't filters)
+result_settings = ['rank_position', 'rank_by', 'bucketing', 'bucket_width', 'num_buckets']
+
+
+def results_user_inputs(selections, rank_position_value, rank_by_value, bucketing_value=None, bucket_width_value=None, num_buckets_value=None):
+    user_inputs = collections.OrderedDict()
+
+    # if not blank, ensure values are in a list, and put values [i.e. alphabetized lists] in an ordered dictionary; (in case order impacts the cache key calculation, as the desire is to have the same
+    # cache key for the same selections regardless of order, lists are sorted [and an ordered dictionary is used]; also note that there are no blank or NULL values, but there are "[unknown]" values,
+    # in the dataset)
+    for col in ['state', 'city', 'zip_code', 'place_of_service', 'provider_type', 'credential', 'hcpcs_code']:
+        value = selections.get(col)
+        value = [value, ] if value and not isinstance(value, list) else value
+
+        if value: user_inputs[col] = sorted(value)
+
+    # include required user selections in ordered dictionary by putting them in a list
+    user_inputs['rank_position'] = [rank_position_value, ]
+    user_inputs['rank_by'] = [rank_by_value, ]
+
+    # include the bar chart bucket settings the same way
+    config = server_flask.config
+    user_inputs['bucketing'] = [bucketing_value if bucketing_value in bar_chart_bucketing_choices else config['BAR_CHART_BUCKETING'], ]
+    user_inputs['bucket_width'] = [bucket_width_value if bucket_width_value in config['BAR_CHART_BUCKET_WIDTH_CHOICES'] else config['BAR_CHART_BUCKET_WIDTH'], ]
+    user_inputs['num_buckets'] = [num_buckets_value if num_buckets_value in config['BAR_CHART_NUM_BUCKETS_CHOICES'] else config['BAR_CHART_NUM_BUCKETS'], ]
+
+    return user_inputs
+
+
+
+# RESULTS CACHE KEY
+# convert the ordered dictionary into a bytes object using the pickle library, then hash this bytes object using md5 algorithm from the hashlib library; (fyi, md5 is the default for the Flask-Caching library;
+# the reason we're not using its memoize() function outright is so we can specify the cache key explicitly in order to send it to the href of the Export button to retrieve data when/if needed.)
+# (The key starts with the dataset version's prefix [see database.py] so that a new data set gets new keys and the old one's entries can be purged.  The bar chart bucket settings are part of the
+# user inputs, so the results of different buckets get different keys.)
+def results_cache_key(user_inputs):
+    return dataset_cache_prefix(server_flask.config['DATASET_VERSION']) + hashlib.md5(pickle.dumps(user_inputs)).hexdigest()
+
+
+
+# RUN CONCURRENTLY
+# run functions at the same time, each in a thread of a small pool (RESULTS_QUERY_THREADS per process) with its own app context, i.e. its own database session & connection, and return their
+# results in order; (SQLite and most NumPy operations release the GIL, so the queries do run in parallel.  Context variables, e.g. a job's cancel check [see jobs.py], carry over to the threads.)
+query_executor = None
+query_executor_pid = None
+query_executor_lock = threading.Lock()
+
+
+def results_query_executor():
+    global query_executor, query_executor_pid
+
+    # (created on first use in each process, so that a gunicorn worker forked from a preloaded app gets its own threads)
+    with query_executor_lock:
+        if query_executor is None or query_executor_pid != os.getpid():
+            query_executor = concurrent.futures.ThreadPoolExecutor(max_workers=server_flask.config['RESULTS_QUERY_THREADS'], thread_name_prefix='results_query')
+            query_executor_pid = os.getpid()
+
+        return query_executor
+
+
+def run_concurrently(*functions):
+    # (one at a time if turned off)
+    if not server_flask.config['RESULTS_QUERY_THREADS']:
+        return [function() for function in functions]
+
+    def run(function):
+        with server_flask.app_context():
+            return function()
+
+    futures = [results_query_executor().submit(contextvars.copy_context().run, run, function) for function in functions]
+
+    return [future.result() for future in futures]
+
+
+
+# CALCULATE RESULTS
+# the ten table data (formatted) and the bar chart axis values for a set of user inputs, i.e. what's cached per cache key along with the user inputs
+# (progress, if given, is called with the name of each step before it starts, i.e. "ten_table" and "bar_chart"; see jobs.py)
+def calculate_results(user_inputs, progress=None):
+    # map rank by input to associated column in underlying database table
+    order_by_col = 'avg_charged' if user_inputs['rank_by'][0] == 'Avg Charged' else 'num_beneficiaries'
+
+    # rank position, rank by and the bar chart bucket settings do not represent a column in the underlying database table
+    filters = {col: value for col, value in user_inputs.items() if col not in result_settings}
+
+    # get ten table results and format as strings
+    # (number formatting: commas but no decimals [also rounds to the nearest units]; fyi, you can use the DataTable's format attribute in Dash instead of taking this approach)
+    def ten_table():
+        if progress: progress('ten_table')
+
+        return [{'provider_id': f'{result.provider_id:,.0f}', 'patients': f'{result.num_beneficiaries:,.0f}',
+                 'avg_charged': f'{result.avg_charged:,.0f}', 'avg_allowed': f'{result.avg_allowed:,.0f}',
+                 'avg_paid': f'{result.avg_paid:,.0f}'} for result in ten_table_results(filters, order_by_col, user_inputs['rank_position'][0])]
+
+    # get bar chart results; (x axis values are the bucket labels, e.g. "0 - 200", and y axis values are the total patients per bucket; the buckets are chosen by the user [see results_user_inputs()])
+    def bar_chart():
+        if progress: progress('bar_chart')
+
+        return bar_chart_histogram(filters, user_inputs['bucketing'][0], user_inputs['bucket_width'][0], user_inputs['num_buckets'][0])
+
+    # (the two don't depend on each other, so they're calculated at the same time and the results take as long as the slower of the two vs. both)
+    ten_table_data, (bar_chart_x_axis_values, bar_chart_y_axis_values) = run_concurrently(ten_table, bar_chart)
+
+    return ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values
+
+
+
+# GET OR CALCULATE RESULTS (single flight)
+# the cached results of a set of user inputs (as cached, i.e. user inputs, ten table data and bar chart axis values), calculating & caching them first if they're not cached.  When several requests [in
+# any of the gunicorn workers] miss the same cache key at once, only the first one calculates the results: it takes a lease on the cache key [a cache entry that can only be added if it doesn't exist
+# yet] and the others wait for the results to show up in the cache, for up to RESULTS_LEASE_WAIT seconds, after which [or once the lease is gone without results, e.g. the calculation failed] they
+# calculate the results themselves.  The lease expires after RESULTS_LEASE_TIMEOUT seconds in case its worker dies.  (progress is passed on to calculate_results().)
+def get_or_calculate_results(user_inputs, cache_key, progress=None):
+    lease_key = f'results_lease_{cache_key}'
+    leased = cache.add(lease_key, os.getpid(), timeout=server_flask.config['RESULTS_LEASE_TIMEOUT'])
+
+    if not leased:
+        deadline = time.monotonic() + server_flask.config['RESULTS_LEASE_WAIT']
+
+        while time.monotonic() < deadline:
+            time.sleep(server_flask.config['RESULTS_LEASE_POLL_INTERVAL'])
+
+            cached_results = cache.get(cache_key)
+            if cached_results is not None:
+                increment('results_single_flight_total', result='coalesced')
+                return cached_results
+
+            if cache.get(lease_key) is None:
+                break
+
+        increment('results_single_flight_total', result='gave_up_waiting')
+    else:
+        increment('results_single_flight_total', result='calculated')
+
+    try:
+        ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values = calculate_results(user_inputs, progress)
+
+        # (fyi, caching the user inputs for Excel exporting and the bar chart axis values instead of the figure)
+        cached_results = (user_inputs, ten_table_data, bar_chart_x_axis_values, bar_chart_y_axis_values)
+        cache.set(cache_key, cached_results)
+    finally:
+        if leased:
+            cache.delete(lease_key)
+
+    return cached_results
@@ -0,0 +1,75 @@
+import json
+import threading
+from app import server_flask, cache
+from app.dropdowns import dropdown_columns, dropdown_default_values, default_state_value, resolve_dropdowns
+from app.results import results_user_inputs, results_cache_key, get_or_calculate_results
+
+
+# DEFAULT SELECTIONS
+# the selection the app starts with (see dropdowns.py), for every rank position & rank by combination since those are the first things a user is likely to change
+def default_selections():
+    selections = []
+
+    for rank_position_value in ['Top', 'Bottom']:
+        for rank_by_value in ['Avg Charged', 'Patients']:
+            selection = dict(dropdown_default_values, state=default_state_value, rank_position=rank_position_value, rank_by=rank_by_value)
+            selections.append(selection)
+
+    return selections
+
+
+
+# LOAD SELECTIONS
+# read a list of selections from a JSON file, e.g. the most popular selections; each selection is an object of dropdown values by column name (state, city, zip_code, place_of_service, provider_type,
+# credential, hcpcs_code, rank_position and rank_by), where blank dropdowns can be left out and rank position/rank by default to "Top"/"Avg Charged"
+def load_selections(file_name):
+    with open(file_name) as selections_file:
+        return json.load(selections_file)
+
+
+
+# WARM CACHE
+# calculate & cache the results of each selection under the same cache key results_update uses (so the results and the Excel export are ready straight away), and query the dropdown options the
+# user would go through to make the selection; returns the number of results that were calculated (vs. already cached).
+def warm_cache(selections):
+    calculated_count = 0
+
+    for selection in selections:
+        # ---- dropdown options ----
+        # (when the app first loads, and then as each dropdown is filled in going down)
+        if selection.get('state') == default_state_value:
+            resolve_dropdowns({'state': default_state_value}, 'state', 0)
+
+        for col in dropdown_columns[:-1]:
+            resolve_dropdowns(selection, col, 1)
+
+        # ---- results ----
+        user_inputs = results_user_inputs(selection, selection.get('rank_position') or 'Top', selection.get('rank_by') or 'Avg Charged', selection.get('bucketing'), selection.get('bucket_width'),
+                                          selection.get('num_buckets'))
+        cache_key = results_cache_key(user_inputs)
+
+        # (the workers that warm the cache at the same time, i.e. without --preload, wait for each other's results vs. calculating them again)
+        if cache.get(cache_key) is None:
+            get_or_calculate_results(user_inputs, cache_key)
+            calculated_count += 1
+
+    return calculated_count
+
+
+
+# WARM CACHE ON STARTUP
+# warm the cache with the default selections and the selections file from the config file (if any), in a background thread so the app can start serving requests in the meantime
+def start_warm_cache_thread():
+    selections = default_selections()
+
+    if server_flask.config['CACHE_WARMUP_SELECTIONS_FILE']:
+        selections += load_selections(server_flask.config['CACHE_WARMUP_SELECTIONS_FILE'])
+
+    def run():
+        with server_flask.app_context():
+            warm_cache(selections)
+
+    thread = threading.Thread(target=run, name='warm_cache', daemon=True)
+    thread.start()
+
+    return thread
@@ -0,0 +1,66 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import synthetic_data
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ------------------------------------------------------ BENCHMARK ------------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+# Times the callbacks and the Excel export at several data set sizes, using synthetic databases (see synthetic_data.py), and writes the results as JSON so runs can be compared, e.g.
+#
+#   python benchmark.py --sizes 100000,1000000,9000000 --output benchmark.json
+#
+# Each database is created once (in --data-dir) and reused by later runs.  The timing itself is done by "flask benchmark" (see app/benchmark.py), in a separate process per database since the
+# database is set when the app is imported; environment variables such as COLUMNAR_ENGINE are passed on, so the same sizes can be compared with different settings.
+
+
+def run_flask(args, database_file, cache_dir):
+    env = dict(os.environ, FLASK_APP='dashboard.py', DATABASE_URL='sqlite:///' + os.path.abspath(database_file), CACHE_DIR=cache_dir,
+               METRICS_FILE=os.path.join(cache_dir, 'metrics.db'))
+    subprocess.run([sys.executable, '-m', 'flask'] + args, env=env, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the callbacks and the Excel export at several data set sizes.')
+    parser.add_argument('--sizes', default='100000,1000000', help='comma separated numbers of utilization rows')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the synthetic data')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times to run each callback')
+    parser.add_argument('--data-dir', default='benchmark-data', help='folder for the synthetic databases (and their caches)')
+    parser.add_argument('--output', default=None, help='file to write the JSON results to (instead of printing them)')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    runs = []
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        database_file = os.path.join(args.data_dir, f'synthetic_{size}_{args.seed}.db')
+        cache_dir = os.path.join(os.path.abspath(args.data_dir), f'cache_{size}_{args.seed}')
+        results_file = os.path.join(args.data_dir, f'results_{size}_{args.seed}.json')
+
+        # create the database, with the same indexes & rollup tables as the real one (see Dockerfile)
+        if not os.path.exists(database_file):
+            synthetic_data.generate(database_file, size, args.seed, log=lambda message: print(message, file=sys.stderr))
+            run_flask(['migrate'], database_file, cache_dir)
+            run_flask(['build-rollups'], database_file, cache_dir)
+
+        print(f'Benchmarking {size:,} rows...', file=sys.stderr)
+        run_flask(['benchmark', '--repeat', str(args.repeat), '--output', results_file], database_file, cache_dir)
+
+        with open(results_file) as results_json:
+            runs.append(dict(json.load(results_json), seed=args.seed))
+
+    # ---- summary (median milliseconds per size) ----
+    print(f"{'rows':<55}" + ''.join(f"{run['rows']:>12,}" for run in runs), file=sys.stderr)
+
+    for i, result in enumerate(runs[0]['results']):
+        print(f"{result['name']:<55}" + ''.join(f"{run['results'][i]['median_ms']:>12,.1f}" for run in runs), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(runs, output_file, indent=2)
+    else:
+        print(json.dumps(runs, indent=2))
@@ -6,4 +6,5 @@ source venv/bin/activate
 
 # run gunicorn with 4 workers & bind to the specified server socket;
 # (on why "exec" and the "-" following the log files are used, see https://blog.miguelgrinberg.com/post/the-flask-mega-tutorial-part-xix-deployment-on-docker-containers)
-exec gunicorn -w 4 -b :5000 --access-logfile - --error-logfile - dashboard:server_flask
+# (--preload loads the app once, before the workers are forked, so the startup work [e.g. the layout and the columnar table] is done once and shared by the workers)
+exec gunicorn -w 4 -b :5000 --preload --access-logfile - --error-logfile - dashboard:server_flask
@@ -9,6 +9,87 @@ class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'secret key placeholder'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    CACHE_TYPE = 'filesystem'
-    CACHE_DIR = 'cache-directory'
-    CACHE_THRESHOLD = 100           # (fyi, you don't want this number to be less than the maximum number of concurrent users)
\ No newline at end of file
+
+    # open the database read-only & immutable with a pool of connections (per gunicorn worker) and read-optimized pragmas, since the data doesn't change while the app is running (see database.py);
+    # leave this off for the flask commands that write to the database (e.g. "flask migrate" and "flask build-rollups")
+    SQLITE_READ_ONLY = os.environ.get('SQLITE_READ_ONLY', '').lower() in ['1', 'true', 'yes']
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE') or 0)     # (connections per worker; 0 derives it from the threads that query [see sqlite_pool_size() in database.py], set it e.g. with gunicorn's --threads)
+    SQLITE_MMAP_SIZE = 4 * 1024 * 1024 * 1024
+    SQLITE_CACHE_SIZE_KB = 64 * 1024
+    SQLITE_PREFAULT = True          # read the database file into the operating system's page cache when the app starts (read-only mode only)
+    # (the default cache is a SQLite file in CACHE_DIR that's shared by all of the gunicorn workers and evicts the least recently used results once they take up more than CACHE_MAX_BYTES
+    # [see cache_backends.py]; CACHE_TYPE can also be set to one of Flask-Caching's types, e.g. "redis")
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'app.cache_backends.sqlite_lru'
+    CACHE_DIR = os.environ.get('CACHE_DIR') or 'cache-directory'
+    CACHE_MAX_BYTES = 256 * 1024 * 1024
+    CACHE_THRESHOLD = 100           # (only used by the "filesystem" type; fyi, you don't want this number to be less than the maximum number of concurrent users)
+    # (the dropdown options are cached per dropdown & upstream selections in the same cache, without a timeout since they only change with the data; their keys, like the results', include
+    # DATASET_VERSION, which defaults to the name, size & modification time of the database file [see database.py], so a new database file gets new keys)
+    DROPDOWN_CACHE_TIMEOUT = 0
+    DATASET_VERSION = os.environ.get('DATASET_VERSION')
+
+    # how often, in seconds, each worker checks whether the database file has been swapped for a new data set (e.g. by "flask swap-dataset") and switches to it; 0 turns this off (see datasets.py).
+    # (The old data set's cache entries are purged by one worker, which holds the purge for DATASET_PURGE_TIMEOUT seconds.)
+    DATASET_SWAP_CHECK_INTERVAL = 1
+    DATASET_PURGE_TIMEOUT = 3600
+
+    # search the dropdowns in DROPDOWN_TYPEAHEAD_COLUMNS as the user types, so that the ones with more than DROPDOWN_TYPEAHEAD_LIMIT options only get that many at a time (see dropdowns.py); the
+    # sorted indexes the options are searched in are kept in memory for the DROPDOWN_TYPEAHEAD_INDEXES most recently used dropdowns & upstream selections per gunicorn worker
+    DROPDOWN_TYPEAHEAD = os.environ.get('DROPDOWN_TYPEAHEAD', '').lower() in ['1', 'true', 'yes']
+    DROPDOWN_TYPEAHEAD_COLUMNS = ['city', 'zip_code', 'hcpcs_code']
+    DROPDOWN_TYPEAHEAD_LIMIT = 100
+    DROPDOWN_TYPEAHEAD_INDEXES = 256
+
+    # the filter columns the rollup tables are grouped by (one list per rollup level; an empty list is the level for no filters at all); a selection is answered from the rollup tables when all of its
+    # filtered columns are within a level, otherwise the utilization table is queried.  (Run "flask build-rollups" after changing these; set to an empty list to turn the rollup tables off.)
+    ROLLUP_LEVELS = [[], ['state'], ['state', 'city'], ['state', 'place_of_service'], ['state', 'provider_type']]
+    ROLLUP_TOP_K = 10               # number of records kept per group in the ranking rollup (needs to be at least 10 for the ten table)
+
+    # answer the selections that the rollup tables don't from per-state copies of the utilization table (built by "flask build-partitions"), i.e. only the selected states' partitions are queried
+    # (see partitions.py); they're queried one after the other unless STATE_PARTITION_THREADS is set, in which case they're queried STATE_PARTITION_THREADS at a time per gunicorn worker, and
+    # with 2 or more threads a selection without a state is answered by querying all of them at the same time (vs. from the utilization table); only worth it with spare CPU cores
+    STATE_PARTITIONS = os.environ.get('STATE_PARTITIONS', '').lower() in ['1', 'true', 'yes']
+    STATE_PARTITION_THREADS = int(os.environ.get('STATE_PARTITION_THREADS') or 0)
+
+    # hold the utilization table in memory as NumPy arrays and answer the dropdown & results queries from them instead of the database (loaded when the app starts; uses roughly 1GB of memory
+    # for the full data set, which the gunicorn workers share when it's loaded before they're forked [i.e. with --preload, see boot.sh])
+    COLUMNAR_ENGINE = os.environ.get('COLUMNAR_ENGINE', '').lower() in ['1', 'true', 'yes']
+    # (memory map the columnar table from a snapshot folder [created by "flask export-columnar-snapshot"] instead of reading it from the database; the workers then share one copy of it whether or not
+    # the app is preloaded, and start up without reading the whole table)
+    COLUMNAR_SNAPSHOT_DIR = os.environ.get('COLUMNAR_SNAPSHOT_DIR')
+
+    # the default bar chart buckets of avg charged amounts: "fixed" for buckets of BAR_CHART_BUCKET_WIDTH starting at 0 or "quantile" for buckets with about the same number of patients each, and the
+    # widths & numbers of buckets the user can choose from instead (see layout.py)
+    # (BAR_CHART_NUM_BUCKETS includes the last, open ended, bucket; the width should be a multiple of 200 unless the columnar engine is turned on [see bar_chart_histogram() in results.py])
+    BAR_CHART_BUCKETING = 'fixed'
+    BAR_CHART_BUCKET_WIDTH = 200
+    BAR_CHART_NUM_BUCKETS = 11
+    BAR_CHART_BUCKET_WIDTH_CHOICES = [200, 400, 1000, 2000]
+    BAR_CHART_NUM_BUCKETS_CHOICES = [6, 11, 16, 21]
+
+    # threads per gunicorn worker that the ten table & bar chart queries run in at the same time (see run_concurrently() in results.py); 0 runs them one after the other in the request's thread
+    RESULTS_QUERY_THREADS = int(os.environ.get('RESULTS_QUERY_THREADS') or 2)
+
+    # when several requests miss the same results at once, one calculates them while the others wait up to RESULTS_LEASE_WAIT seconds for them (see get_or_calculate_results() in results.py)
+    RESULTS_LEASE_TIMEOUT = 120
+    RESULTS_LEASE_WAIT = 30
+    RESULTS_LEASE_POLL_INTERVAL = 0.05
+
+    # calculate results that aren't cached in a background thread pool (RESULTS_JOB_WORKERS threads per gunicorn worker) instead of inside the request, with the browser polling for them every
+    # RESULTS_JOB_POLL_INTERVAL_MS, so broad selections don't tie up the gunicorn workers (see jobs.py); a job's state is kept in the cache for RESULTS_JOB_TIMEOUT seconds
+    RESULTS_JOBS = os.environ.get('RESULTS_JOBS', '').lower() in ['1', 'true', 'yes']
+    RESULTS_JOB_WORKERS = int(os.environ.get('RESULTS_JOB_WORKERS') or 2)
+    RESULTS_JOB_POLL_INTERVAL_MS = 500
+    RESULTS_JOB_TIMEOUT = 600
+
+    # build & serialize the layout and read the lookup tables (e.g. the HCPCS code descriptions) when the app starts vs. on the first page load/use (see layout.py & lookups.py)
+    LAYOUT_WARMUP_ON_STARTUP = os.environ.get('LAYOUT_WARMUP_ON_STARTUP', '').lower() in ['1', 'true', 'yes']
+
+    # calculate & cache the results of the default selection, plus the selections in CACHE_WARMUP_SELECTIONS_FILE (a JSON list, e.g. of the most popular selections; see warmup.py) if given, when the
+    # app starts; (the same can be done on demand with "flask warm-cache")
+    CACHE_WARMUP_ON_STARTUP = os.environ.get('CACHE_WARMUP_ON_STARTUP', '').lower() in ['1', 'true', 'yes']
+    CACHE_WARMUP_SELECTIONS_FILE = os.environ.get('CACHE_WARMUP_SELECTIONS_FILE')
+
+    # where each gunicorn worker saves its metrics (shown at /metrics; see metrics.py) and how often, in seconds
+    METRICS_FILE = os.environ.get('METRICS_FILE') or 'metrics.db'
+    METRICS_SAVE_INTERVAL = 5
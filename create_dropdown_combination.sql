@@ -0,0 +1,34 @@
+-- Builds the dropdown_combination table from the utilization table.
+-- (This table holds the distinct combinations of the columns that feed the dropdowns.  It's much smaller than the utilization table since the per provider/per service rows collapse
+-- into one row per combination, so the dropdown options are queried from this table instead of the utilization table.  Run this after the utilization table is loaded from utilization.sql, i.e. while
+-- its columns are still strings; migration 0002 [see app/migrations] then rebuilds it with codes along with the utilization table.)
+
+DROP TABLE IF EXISTS dropdown_combination;
+
+CREATE TABLE dropdown_combination (
+    id INTEGER NOT NULL,
+    state VARCHAR(2),
+    city VARCHAR(35),
+    zip_code VARCHAR(5),
+    place_of_service VARCHAR(15),
+    provider_type VARCHAR(50),
+    credential VARCHAR(25),
+    hcpcs_code VARCHAR(5),
+    PRIMARY KEY (id)
+);
+
+INSERT INTO dropdown_combination (state, city, zip_code, place_of_service, provider_type, credential, hcpcs_code)
+SELECT DISTINCT state, city, zip_code, place_of_service, provider_type, credential, hcpcs_code
+FROM utilization
+ORDER BY state, city, zip_code, place_of_service, provider_type, credential, hcpcs_code;
+
+-- (indexes are created after the insert since that's faster than maintaining them row by row)
+CREATE INDEX ix_dropdown_combination_state ON dropdown_combination (state);
+CREATE INDEX ix_dropdown_combination_city ON dropdown_combination (city);
+CREATE INDEX ix_dropdown_combination_zip_code ON dropdown_combination (zip_code);
+CREATE INDEX ix_dropdown_combination_place_of_service ON dropdown_combination (place_of_service);
+CREATE INDEX ix_dropdown_combination_provider_type ON dropdown_combination (provider_type);
+CREATE INDEX ix_dropdown_combination_credential ON dropdown_combination (credential);
+CREATE INDEX ix_dropdown_combination_hcpcs_code ON dropdown_combination (hcpcs_code);
+
+ANALYZE dropdown_combination;
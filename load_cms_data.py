@@ -0,0 +1,173 @@
+import argparse
+import csv
+import gzip
+import io
+import itertools
+import os
+import sqlite3
+import time
+from synthetic_data import create_utilization_sql, utilization_index_columns
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------- CMS DATA LOADER --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+# Creates a SQLite database with the utilization & dropdown_combination tables from the raw CMS Provider Utilization and Payment Data file (see readme.md), i.e. the same database the Dockerfile
+# builds from utilization.sql, without the SQL dump.  The file is read as a stream, a chunk of rows at a time, so it's never all in memory, and the rows are inserted in large transactions with the
+# indexes created once they're all in.  (This is a standalone script vs. a flask command since the app needs the tables to exist before it can be imported.)
+#
+#   python load_cms_data.py Medicare_Provider_Util_Payment_PUF_CY2017.txt app.db
+#
+# Then run "flask migrate" and "flask build-rollups" against it (i.e. with DATABASE_URL=sqlite:///app.db), same as for the database built from utilization.sql.
+#
+# Cleaning rules: only providers listed as individuals (entity type "I") within the 50 states/DC are loaded; blank strings become "[unknown]"; the place of service codes become "Facility" &
+# "Non-Facility"; cities are title cased, credentials are upper cased without periods (e.g. "M.D." -> "MD") and zip codes are cut to 5 digits; providers are given a generated id (in the order
+# they're first seen) vs. their NPI; and rows with a missing or invalid number are skipped.
+
+
+# the 50 states + DC
+states = {
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ',
+    'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY'
+}
+
+place_of_service_labels = {'F': 'Facility', 'O': 'Non-Facility'}
+
+# the raw file's column for each field, by its name in the downloadable (tab delimited) file or its name in the CSV export of data.cms.gov (the header is matched case-insensitively)
+source_columns = {
+    'npi': ['npi', 'national provider identifier'],
+    'entity_type': ['nppes_entity_code', 'entity type of the provider'],
+    'credential': ['nppes_credentials', 'credentials of the provider'],
+    'city': ['nppes_provider_city', 'city of the provider'],
+    'zip_code': ['nppes_provider_zip', 'zip code of the provider'],
+    'state': ['nppes_provider_state', 'state code of the provider'],
+    'provider_type': ['provider_type', 'provider type'],
+    'place_of_service': ['place_of_service', 'place of service'],
+    'hcpcs_code': ['hcpcs_code', 'hcpcs code'],
+    'hcpcs_desc': ['hcpcs_description', 'hcpcs description'],
+    'num_beneficiaries': ['bene_unique_cnt', 'number of medicare beneficiaries'],
+    'avg_allowed': ['average_medicare_allowed_amt', 'average medicare allowed amount'],
+    'avg_charged': ['average_submitted_chrg_amt', 'average submitted charge amount'],
+    'avg_paid': ['average_medicare_payment_amt', 'average medicare payment amount']
+}
+
+rows_per_chunk = 50000                  # (rows per executemany)
+rows_per_transaction = 1000000
+
+
+
+# READ
+# the rows of the raw file (plain or gzipped, comma or tab delimited) as dictionaries of the fields above
+def read_source_rows(source_file):
+    opener = gzip.open if source_file.endswith('.gz') else open
+
+    with opener(source_file, 'rt', newline='', encoding='latin-1') as source:
+        header = source.readline()
+        delimiter = '\t' if '\t' in header else ','
+        header = [name.strip().lower() for name in next(csv.reader(io.StringIO(header), delimiter=delimiter))]
+
+        positions = {}
+        for field, names in source_columns.items():
+            position = next((header.index(name) for name in names if name in header), None)
+            if position is None:
+                raise SystemExit(f"{source_file} has no {field} column (looked for: {', '.join(names)}).")
+            positions[field] = position
+
+        for values in csv.reader(source, delimiter=delimiter):
+            if len(values) == len(header):
+                yield {field: values[position].strip() for field, position in positions.items()}
+
+
+
+# CLEAN
+# the utilization row (without its record id) of a raw row, or None if the row isn't loaded
+def clean_row(row, provider_ids):
+    if row['entity_type'] != 'I' or row['state'] not in states:
+        return None
+
+    try:
+        numbers = [int(float(row['num_beneficiaries'])), float(row['avg_allowed']), float(row['avg_charged']), float(row['avg_paid'])]
+    except ValueError:
+        return None
+
+    credential = row['credential'].replace('.', '').upper()
+    city = row['city'].title()
+    zip_code = row['zip_code'][:5]
+    place_of_service = place_of_service_labels.get(row['place_of_service'], row['place_of_service'])
+
+    strings = [value or '[unknown]' for value in [credential, city, zip_code, row['state'], row['provider_type'], place_of_service, row['hcpcs_code'], row['hcpcs_desc']]]
+
+    return [provider_ids.setdefault(row['npi'], len(provider_ids) + 1)] + strings + numbers
+
+
+
+# LOAD
+# create the database file (which must not exist yet) from the raw file
+def load(source_file, database_file, log=print):
+    if os.path.exists(database_file):
+        raise SystemExit(f'{database_file} already exists.')
+
+    start = time.perf_counter()
+
+    connection = sqlite3.connect(database_file, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=OFF')
+    connection.execute('PRAGMA synchronous=OFF')
+    connection.execute('PRAGMA cache_size=-262144')           # (256MB, in KB)
+    connection.execute(create_utilization_sql)
+
+    provider_ids = {}
+    read_count = 0
+    loaded_count = 0
+    source_rows = read_source_rows(source_file)
+
+    connection.execute('BEGIN')
+
+    while True:
+        chunk = list(itertools.islice(source_rows, rows_per_chunk))
+        if not chunk:
+            break
+
+        read_count += len(chunk)
+        rows = [row for row in (clean_row(row, provider_ids) for row in chunk) if row is not None]
+
+        connection.executemany('INSERT INTO utilization VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               ([record_id] + row for record_id, row in enumerate(rows, start=loaded_count + 1)))
+
+        # (a new transaction every so many rows, which only matters for how much SQLite has to hold before writing since the journal is off)
+        if (loaded_count + len(rows)) // rows_per_transaction > loaded_count // rows_per_transaction:
+            connection.execute('COMMIT')
+            connection.execute('BEGIN')
+
+            log(f'Read {read_count:,} rows, loaded {loaded_count + len(rows):,} ({read_count / (time.perf_counter() - start):,.0f} rows/sec).')
+
+        loaded_count += len(rows)
+
+    connection.execute('COMMIT')
+
+    load_seconds = time.perf_counter() - start
+    log(f'Loaded {loaded_count:,} of {read_count:,} rows ({len(provider_ids):,} providers) in {load_seconds:,.1f} seconds ({read_count / load_seconds:,.0f} rows/sec); creating indexes.')
+
+    index_start = time.perf_counter()
+
+    for col in utilization_index_columns:
+        connection.execute(f'CREATE INDEX ix_utilization_{col} ON utilization ({col})')
+
+    # build the dropdown_combination table (same as for the database built from utilization.sql; see Dockerfile)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'create_dropdown_combination.sql')) as sql_file:
+        connection.executescript(sql_file.read())
+
+    connection.execute('ANALYZE')
+    connection.close()
+
+    log(f'Created indexes in {time.perf_counter() - index_start:,.1f} seconds.')
+    log(f'Created {database_file} in {time.perf_counter() - start:,.1f} seconds.')
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create a SQLite database from the raw CMS Provider Utilization and Payment Data file.')
+    parser.add_argument('source_file', help='raw CMS file (.txt/.csv, optionally gzipped)')
+    parser.add_argument('database_file', help='database file to create (must not exist yet)')
+    args = parser.parse_args()
+
+    load(args.source_file, args.database_file)
@@ -0,0 +1,251 @@
+import argparse
+import os
+import sqlite3
+import time
+import numpy as np
+
+
+# -----------------------------------------------------------------------------------------------------------------------
+# ------------------------------------------------- SYNTHETIC DATA SET --------------------------------------------------
+# -----------------------------------------------------------------------------------------------------------------------
+# Creates a SQLite database with a utilization table of made-up records (with string columns like the real data set's utilization.sql, which "flask migrate" turns into codes) and its
+# dropdown_combination table, e.g. for benchmarking (see benchmark.py) without the real database.  The data is random but deterministic, i.e. the same number of rows & seed always gives the same database.
+# (This is a standalone script vs. a flask command since the app needs the tables to exist before it can be imported.)
+#
+#   python synthetic_data.py synthetic.db --rows 1000000 --seed 0
+#
+# Then run "flask migrate" and "flask build-rollups" against it (i.e. with DATABASE_URL=sqlite:///synthetic.db), same as for the real database.
+
+
+# states with their (approximate, 2017) populations in millions, which the providers are spread across
+state_populations = {
+    'CA': 39.5, 'TX': 28.3, 'FL': 21.0, 'NY': 19.8, 'PA': 12.8, 'IL': 12.8, 'OH': 11.7, 'GA': 10.4, 'NC': 10.3, 'MI': 10.0, 'NJ': 9.0, 'VA': 8.5, 'WA': 7.4, 'AZ': 7.0,
+    'MA': 6.9, 'TN': 6.7, 'IN': 6.7, 'MO': 6.1, 'MD': 6.1, 'WI': 5.8, 'CO': 5.6, 'MN': 5.6, 'SC': 5.0, 'AL': 4.9, 'LA': 4.7, 'KY': 4.5, 'OR': 4.1, 'OK': 3.9,
+    'CT': 3.6, 'UT': 3.1, 'IA': 3.1, 'NV': 3.0, 'AR': 3.0, 'MS': 3.0, 'KS': 2.9, 'NM': 2.1, 'NE': 1.9, 'WV': 1.8, 'ID': 1.7, 'HI': 1.4, 'NH': 1.3, 'ME': 1.3,
+    'MT': 1.1, 'RI': 1.1, 'DE': 1.0, 'SD': 0.9, 'ND': 0.8, 'AK': 0.7, 'DC': 0.7, 'VT': 0.6, 'WY': 0.6
+}
+
+# (the default city [see dropdowns.py] is included so the default selection has results)
+named_cities = {'TN': 'Nashville'}
+
+# provider types with their share of providers and the credentials their providers have (with the share of each)
+provider_types = [
+    ('Internal Medicine', 14, {'MD': 85, 'DO': 12, '[unknown]': 3}),
+    ('Family Practice', 12, {'MD': 75, 'DO': 22, '[unknown]': 3}),
+    ('Nurse Practitioner', 11, {'NP': 80, 'APRN': 15, '[unknown]': 5}),
+    ('Physician Assistant', 7, {'PA': 80, 'PA-C': 17, '[unknown]': 3}),
+    ('Physical Therapist', 6, {'PT': 85, 'DPT': 12, '[unknown]': 3}),
+    ('Diagnostic Radiology', 5, {'MD': 92, 'DO': 8}),
+    ('Emergency Medicine', 5, {'MD': 80, 'DO': 17, '[unknown]': 3}),
+    ('Cardiology', 4, {'MD': 92, 'DO': 8}),
+    ('Anesthesiology', 4, {'MD': 88, 'DO': 12}),
+    ('Orthopedic Surgery', 3, {'MD': 90, 'DO': 10}),
+    ('Ophthalmology', 3, {'MD': 95, 'DO': 5}),
+    ('Optometry', 3, {'OD': 97, '[unknown]': 3}),
+    ('Chiropractic', 3, {'DC': 97, '[unknown]': 3}),
+    ('General Practice', 2, {'MD': 70, 'DO': 25, '[unknown]': 5}),
+    ('Dermatology', 2, {'MD': 93, 'DO': 7}),
+    ('Psychiatry', 2, {'MD': 88, 'DO': 12}),
+    ('Clinical Psychologist', 2, {'PHD': 80, 'PSYD': 20}),
+    ('Podiatry', 2, {'DPM': 97, '[unknown]': 3}),
+    ('Gastroenterology', 1, {'MD': 93, 'DO': 7}),
+    ('Urology', 1, {'MD': 94, 'DO': 6})
+]
+
+# the most common HCPCS codes (most common first) and their descriptions; the rest of the codes are made up
+common_hcpcs_codes = [
+    ('99213', 'Established patient office or other outpatient visit, typically 15 minutes'),
+    ('99214', 'Established patient office or other outpatient, visit typically 25 minutes'),
+    ('36415', 'Insertion of needle into vein for collection of blood sample'),
+    ('99232', 'Subsequent hospital inpatient care, typically 25 minutes per day'),
+    ('97110', 'Therapeutic exercise to develop strength, endurance, range of motion, and flexibility, each 15 minutes'),
+    ('99215', 'Established patient office or other outpatient, visit typically 40 minutes'),
+    ('85025', 'Complete blood cell count (red cells, white blood cell, platelets), automated test'),
+    ('80053', 'Blood test, comprehensive group of blood chemicals'),
+    ('71046', 'X-ray of chest, 2 views'),
+    ('93000', 'Routine electrocardiogram (ECG) using at least 12 leads including interpretation and report'),
+    ('99233', 'Subsequent hospital inpatient care, typically 35 minutes per day'),
+    ('97140', 'Manual (physical) therapy techniques to 1 or more regions, each 15 minutes'),
+    ('G0439', 'Annual wellness visit, includes a personalized prevention plan of service (pps), subsequent visit'),
+    ('99212', 'Established patient office or other outpatient visit, typically 10 minutes'),
+    ('99283', 'Emergency department visit, moderately severe problem'),
+    ('20610', 'Aspiration and/or injection of large joint or joint capsule'),
+    ('99204', 'New patient office or other outpatient visit, typically 45 minutes'),
+    ('J1100', 'Injection, dexamethasone sodium phosphate, 1 mg'),
+    ('97530', 'Therapeutic activities to improve function, with one-on-one contact between patient and provider, each 15 minutes'),
+    ('99203', 'New patient office or other outpatient visit, typically 30 minutes')
+]
+
+number_of_hcpcs_codes = 3000
+rows_per_provider = 20                  # (on average; it varies a lot from provider to provider)
+rows_per_chunk = 250000
+
+create_utilization_sql = '''
+CREATE TABLE utilization (
+    record_id INTEGER NOT NULL,
+    provider_id INTEGER,
+    credential VARCHAR(25),
+    city VARCHAR(35),
+    zip_code VARCHAR(5),
+    state VARCHAR(2),
+    provider_type VARCHAR(50),
+    place_of_service VARCHAR(15),
+    hcpcs_code VARCHAR(5),
+    hcpcs_desc VARCHAR(260),
+    num_beneficiaries INTEGER,
+    avg_allowed FLOAT,
+    avg_charged FLOAT,
+    avg_paid FLOAT,
+    PRIMARY KEY (record_id)
+);
+'''
+
+# (same indexes as the Utilization model; created after the inserts since that's faster than maintaining them row by row)
+utilization_index_columns = ['provider_id', 'credential', 'city', 'zip_code', 'state', 'provider_type', 'place_of_service', 'hcpcs_code']
+
+
+
+# WEIGHTED CHOICE
+# (probabilities from weights)
+def probabilities(weights):
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights / weights.sum()
+
+
+
+# PROVIDERS
+# each provider's state, city, zip code, provider type & credential, as arrays of labels (indexed by provider)
+def generate_providers(rng, number_of_providers):
+    # ---- locations ----
+    # (cities per state in proportion to population; within a state, a few cities have most of the providers [Zipf-like], and each city has 1 to 8 zip codes)
+    cities, city_states, city_weights, city_zip_codes = [], [], [], []
+    next_zip_code = 10001
+
+    for state, population in state_populations.items():
+        state_city_count = max(5, int(population * 12))
+        state_city_weights = population / np.arange(1, state_city_count + 1) ** 1.1
+
+        for i in range(state_city_count):
+            cities.append(named_cities[state] if i == 0 and state in named_cities else f'City {i + 1:03d}')
+            city_states.append(state)
+            city_weights.append(state_city_weights[i])
+
+            zip_code_count = int(rng.integers(1, 9))
+            city_zip_codes.append([f'{next_zip_code + j:05d}' for j in range(zip_code_count)])
+            next_zip_code += zip_code_count
+
+    provider_cities = rng.choice(len(cities), size=number_of_providers, p=probabilities(city_weights))
+
+    # ---- provider types & credentials ----
+    provider_type_choices = rng.choice(len(provider_types), size=number_of_providers, p=probabilities([share for _, share, _ in provider_types]))
+    provider_credentials = np.empty(number_of_providers, dtype=object)
+
+    for i, (_, _, credentials) in enumerate(provider_types):
+        providers = np.flatnonzero(provider_type_choices == i)
+        provider_credentials[providers] = rng.choice(list(credentials), size=len(providers), p=probabilities(list(credentials.values())))
+
+    return {
+        'state': np.array(city_states, dtype=object)[provider_cities],
+        'city': np.array(cities, dtype=object)[provider_cities],
+        'zip_code': np.array([zip_codes[rng.integers(len(zip_codes))] for zip_codes in (city_zip_codes[city] for city in provider_cities)], dtype=object),
+        'provider_type': np.array([provider_type for provider_type, _, _ in provider_types], dtype=object)[provider_type_choices],
+        'credential': provider_credentials
+    }
+
+
+
+# HCPCS CODES
+# codes, descriptions, weights (a few codes make up most of the records [Zipf-like]) and a typical charge per code (log-normal, so most services are cheap and a few are very expensive)
+def generate_hcpcs_codes(rng):
+    codes = [code for code, _ in common_hcpcs_codes]
+    descriptions = [description for _, description in common_hcpcs_codes]
+
+    for i in range(number_of_hcpcs_codes - len(common_hcpcs_codes)):
+        codes.append(f'{10000 + i * 29:05d}')
+        descriptions.append(f'Synthetic procedure {codes[-1]}')
+
+    weights = 1 / np.arange(1, number_of_hcpcs_codes + 1) ** 1.05
+    typical_charges = rng.lognormal(mean=5.0, sigma=1.1, size=number_of_hcpcs_codes)
+
+    return np.array(codes, dtype=object), np.array(descriptions, dtype=object), probabilities(weights), typical_charges
+
+
+
+# GENERATE
+# create the database file (which must not exist yet) with the given number of utilization rows
+def generate(database_file, rows, seed=0, log=print):
+    if os.path.exists(database_file):
+        raise SystemExit(f'{database_file} already exists.')
+
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+
+    number_of_providers = max(1, rows // rows_per_provider)
+    providers = generate_providers(rng, number_of_providers)
+    hcpcs_codes, hcpcs_descriptions, hcpcs_probabilities, typical_charges = generate_hcpcs_codes(rng)
+
+    # (some providers have many more records than others)
+    provider_probabilities = probabilities(rng.pareto(2.0, size=number_of_providers) + 0.1)
+
+    connection = sqlite3.connect(database_file)
+    connection.execute('PRAGMA journal_mode=OFF')
+    connection.execute('PRAGMA synchronous=OFF')
+    connection.execute(create_utilization_sql)
+
+    for chunk_start in range(0, rows, rows_per_chunk):
+        chunk_rows = min(rows_per_chunk, rows - chunk_start)
+
+        provider_rows = rng.choice(number_of_providers, size=chunk_rows, p=provider_probabilities)
+        hcpcs_rows = rng.choice(number_of_hcpcs_codes, size=chunk_rows, p=hcpcs_probabilities)
+        place_of_service = np.where(rng.random(chunk_rows) < 0.65, 'Non-Facility', 'Facility').astype(object)
+
+        # (CMS leaves out services with fewer than 11 patients; charges vary by provider around the code's typical charge, and Medicare allows/pays a fraction of the charge)
+        num_beneficiaries = 11 + np.floor(rng.lognormal(mean=2.8, sigma=1.2, size=chunk_rows)).astype(np.int64)
+        avg_charged = np.round(typical_charges[hcpcs_rows] * rng.lognormal(mean=0.0, sigma=0.45, size=chunk_rows), 2)
+        avg_allowed = np.round(avg_charged * rng.uniform(0.25, 0.65, size=chunk_rows), 2)
+        avg_paid = np.round(avg_allowed * rng.uniform(0.70, 0.80, size=chunk_rows), 2)
+
+        columns = [
+            np.arange(chunk_start + 1, chunk_start + chunk_rows + 1).tolist(),
+            (provider_rows + 1).tolist(),
+            providers['credential'][provider_rows].tolist(),
+            providers['city'][provider_rows].tolist(),
+            providers['zip_code'][provider_rows].tolist(),
+            providers['state'][provider_rows].tolist(),
+            providers['provider_type'][provider_rows].tolist(),
+            place_of_service.tolist(),
+            hcpcs_codes[hcpcs_rows].tolist(),
+            hcpcs_descriptions[hcpcs_rows].tolist(),
+            num_beneficiaries.tolist(),
+            avg_allowed.tolist(),
+            avg_charged.tolist(),
+            avg_paid.tolist()
+        ]
+
+        connection.executemany('INSERT INTO utilization VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', zip(*columns))
+        connection.commit()
+
+        log(f'Inserted {chunk_start + chunk_rows:,} of {rows:,} rows.')
+
+    for col in utilization_index_columns:
+        connection.execute(f'CREATE INDEX ix_utilization_{col} ON utilization ({col})')
+
+    # build the dropdown_combination table (same as for the real database; see Dockerfile)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'create_dropdown_combination.sql')) as sql_file:
+        connection.executescript(sql_file.read())
+
+    connection.execute('ANALYZE')
+    connection.close()
+
+    log(f'Created {database_file} in {time.perf_counter() - start:,.1f} seconds.')
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create a SQLite database with a synthetic utilization table.')
+    parser.add_argument('database_file', help='database file to create (must not exist yet)')
+    parser.add_argument('--rows', type=int, default=9000000, help='number of utilization rows (the real data set has about 9M)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed; the same rows & seed always give the same data')
+    args = parser.parse_args()
+
+    generate(args.database_file, args.rows, args.seed)
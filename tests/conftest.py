@@ -0,0 +1,31 @@
+import os
+import tempfile
+import pytest
+import synthetic_data
+
+
+# (the app is imported by the tests, which opens the database & cache in the config file; these point it at a small synthetic database [see synthetic_data.py] and a cache in a temporary folder
+# vs. the real ones.  The database is always a new one since the fixture below migrates it and builds tables in it, and it's created before the app is imported since the app needs the tables.)
+test_dir = tempfile.mkdtemp(prefix='providers_dashboard_tests_')
+test_database_file = os.path.join(test_dir, 'app.db')
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + test_database_file
+os.environ.setdefault('CACHE_DIR', os.path.join(test_dir, 'cache-directory'))
+os.environ.setdefault('METRICS_FILE', os.path.join(test_dir, 'metrics.db'))
+os.environ.setdefault('DROPDOWN_TYPEAHEAD', '1')
+
+synthetic_data.generate(test_database_file, rows=5000, seed=0, log=lambda message: None)
+
+
+
+# the app with its database migrated and its rollup tables & state partitions built (whether they're used is up to the config, see test_parity.py)
+@pytest.fixture(scope='session')
+def server():
+    from app import server_flask
+
+    runner = server_flask.test_cli_runner()
+    for command in ['migrate', 'build-rollups', 'build-partitions']:
+        result = runner.invoke(args=[command])
+        assert result.exit_code == 0, result.output
+
+    return server_flask
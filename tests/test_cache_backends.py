@@ -0,0 +1,138 @@
+import multiprocessing
+import random
+import sqlite3
+import time
+from app.cache_backends import SQLiteLRUCache
+
+
+# (the cache is shared by the gunicorn workers, which are forked from the app like these processes are forked from the test)
+worker_count = 4
+operation_count = 300
+lease_count = 50
+
+
+def entry_bytes(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute('SELECT COALESCE(SUM(size), 0) FROM cache_entry').fetchone()[0]
+    finally:
+        connection.close()
+
+
+# (run in each process: sets, reads & deletes keys at random, and takes leases [in a cache without eviction pressure, so that only add() decides who gets one]; returns the number of keys read
+# and the leases it got)
+def run_worker(cache, lease_cache, seed, results):
+    rng = random.Random(seed)
+    read_count = 0
+    leases = []
+
+    try:
+        for operation in range(operation_count):
+            key = f'key_{rng.randrange(100)}'
+            choice = rng.random()
+
+            if choice < 0.4:
+                cache.set(key, 'x' * rng.randrange(100, 5000), timeout=rng.choice([0, 60]))
+            elif choice < 0.8:
+                keys = [key, f'key_{rng.randrange(100)}']
+                cache.get_many(*keys)
+                read_count += len(keys)
+            elif choice < 0.9:
+                lease_key = f'lease_{rng.randrange(lease_count)}'
+                if lease_cache.add(lease_key, seed, timeout=0):
+                    leases.append(lease_key)
+            else:
+                cache.delete(key)
+
+        # (writes this worker's pending access times & hit/miss counts)
+        cache.stats()
+        results.put((seed, read_count, leases, None))
+    except Exception as error:
+        results.put((seed, read_count, leases, repr(error)))
+
+
+def test_workers_share_one_cache_file(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = SQLiteLRUCache(path, max_bytes=64 * 1024, default_timeout=0, access_flush_interval=0.01)
+    lease_cache = SQLiteLRUCache(str(tmp_path / 'leases.db'))
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=run_worker, args=(cache, lease_cache, seed, results)) for seed in range(worker_count)]
+
+    for process in processes:
+        process.start()
+
+    outcomes = [results.get(timeout=120) for process in processes]
+
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+
+    # (no worker got an error, e.g. "database is locked")
+    assert [error for seed, read_count, leases, error in outcomes if error] == []
+
+    # (a lease key can only be added by one worker)
+    leases = [lease for seed, read_count, worker_leases, error in outcomes for lease in worker_leases]
+    assert len(leases) == len(set(leases))
+
+    stats = cache.stats()
+
+    # (every read was counted as a hit or a miss, and the running total of the entries' sizes matches the entries, within the budget)
+    assert stats['hits'] + stats['misses'] == sum(read_count for seed, read_count, leases, error in outcomes)
+    assert stats['bytes'] == entry_bytes(path)
+    assert stats['bytes'] <= 64 * 1024
+
+
+def test_reads_dont_wait_for_the_write_lock(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = SQLiteLRUCache(path, access_flush_interval=0)
+    cache.set('key', 'value')
+
+    # (another worker holding the write lock, e.g. while it evicts)
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+
+    try:
+        start = time.monotonic()
+        assert cache.get('key') == 'value'
+        assert cache.get_many('key', 'missing') == ['value', None]
+        assert time.monotonic() - start < 1
+    finally:
+        writer.execute('ROLLBACK')
+        writer.close()
+
+    # (the access times & counts that couldn't be written then are written with the next write)
+    cache.set('other_key', 'value')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 1)
+
+
+def test_running_byte_total_and_eviction(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = SQLiteLRUCache(path, max_bytes=10 * 1024, access_flush_interval=0)
+
+    cache.set('replaced', 'x' * 1000)
+    cache.set('replaced', 'x' * 2000)
+    cache.set('deleted', 'x' * 1000)
+    cache.delete('deleted')
+    cache.set_many({f'prefix_{number}': 'x' * 500 for number in range(4)})
+    cache.delete_prefix('prefix_')
+    cache.set('expired', 'x' * 1000, timeout=0.01)
+    time.sleep(0.02)
+    cache.set('kept', 'x' * 1000)
+
+    assert cache.stats()['bytes'] == entry_bytes(path)
+    assert cache.get('expired') is None
+
+    # (the least recently read entries are evicted first once the budget is exceeded)
+    for number in range(10):
+        cache.set(f'key_{number}', 'x' * 1000)
+        cache.get('kept')
+
+    assert cache.get('kept') is not None
+    assert cache.get('replaced') is None and cache.get('key_0') is None
+    assert cache.stats()['bytes'] == entry_bytes(path) <= 10 * 1024
+
+    cache.clear()
+    assert cache.stats()['bytes'] == entry_bytes(path) == 0
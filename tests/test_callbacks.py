@@ -0,0 +1,36 @@
+import os
+import dash_renderer
+import pytest
+import dashboard                                       # (registers the callbacks)
+from app.benchmark import callbacks_per_interaction, callback_request
+
+
+# (the most server-side callbacks [i.e. requests to /_dash-update-component] each user interaction may trigger; the rest of the callbacks are clientside [see clientside.js])
+@pytest.mark.parametrize('changed_props, max_server_requests', [
+    ([], 3),
+    (['state_dropdown.value'], 3),
+    (['city_dropdown.value'], 3),
+    (['hcpcs_code_dropdown.value'], 1),
+    (['rank_by_dropdown.value'], 1),
+    (['submit_button.n_clicks'], 1)
+])
+def test_server_requests_per_interaction(changed_props, max_server_requests):
+    assert callbacks_per_interaction(changed_props)['server_requests'] <= max_server_requests
+
+
+# (dropdown_access in clientside.js reads dash_clientside.callback_context.inputs_list, which not every dash-renderer version sets for clientside callbacks)
+def test_renderer_sets_clientside_inputs_list():
+    with open(os.path.join(os.path.dirname(dash_renderer.__file__), 'dash_renderer.dev.js')) as file:
+        assert 'callback_context.inputs_list = ' in file.read()
+
+
+# (picking an option in a typeahead dropdown sets its search value [to ''] before its value, and Dash can send both changes in one request; the value change clears the dropdowns below it)
+def test_dropdown_value_and_search_value_changed_together(server):
+    values = {'state_dropdown.value': ['TN'], 'city_dropdown.value': ['Nashville'], 'city_dropdown.search_value': '', 'memory_store.data': {'loaded': 1}}
+    request = callback_request('dropdowns_update', values, ['city_dropdown.search_value', 'city_dropdown.value'])
+
+    response = server.test_client().post('/_dash-update-component', json=request).get_json()['response']
+
+    assert 'city_dropdown' not in response
+    assert all(response[f'{col}_dropdown']['value'] == '' for col in ['zip_code', 'place_of_service', 'provider_type', 'credential', 'hcpcs_code'])
+    assert response['zip_code_dropdown']['options']
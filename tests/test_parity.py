@@ -0,0 +1,91 @@
+import itertools
+import numpy as np
+import pytest
+from app import cache, columnar
+from app.partitions import partition_tables
+from app.results import results_user_inputs, calculate_results
+from app.dropdowns import dropdown_columns, dropdowns_filters, dropdowns_options
+
+
+# (every way the app can answer a selection has to give the same results & dropdown options as the utilization table [and dropdown_combination table] do: the rollup tables, the columnar engine
+# and the state partitions, one after the other and fanned out; the config settings of each, on top of all of them being turned off)
+paths = {
+    'rollup tables': {'ROLLUP_LEVELS': [[], ['state'], ['state', 'city'], ['state', 'place_of_service'], ['state', 'provider_type']]},
+    'columnar engine': {'COLUMNAR_ENGINE': True},
+    'state partitions': {'STATE_PARTITIONS': True, 'STATE_PARTITION_THREADS': 0},
+    'state partitions, fanned out': {'STATE_PARTITIONS': True, 'STATE_PARTITION_THREADS': 4}
+}
+
+
+def use_path(server, settings):
+    server.config.update({'ROLLUP_LEVELS': [], 'COLUMNAR_ENGINE': False, 'STATE_PARTITIONS': False, 'STATE_PARTITION_THREADS': 0}, **settings)
+
+    with server.app_context():
+        columnar.columnar_table = columnar.read_columnar_table() if server.config['COLUMNAR_ENGINE'] else None
+
+    partition_tables.cache_clear()
+    cache.clear()
+
+
+# the most common values of a column within a selection
+def common_values(table, col, count, filters=None):
+    counts = np.bincount(table.codes[col][table.mask(filters or {})], minlength=len(table.labels[col]))
+    return table.labels[col][np.argsort(-counts, kind='stable')[:count]].tolist()
+
+
+# selections of one and several values of each column, and of combinations of columns, that are answered from each of the paths (e.g. some of them match a rollup level and some don't)
+@pytest.fixture(scope='module')
+def selections(server):
+    with server.app_context():
+        table = columnar.read_columnar_table()
+
+    states = common_values(table, 'state', 3)
+    state = {'state': states[:1]}
+    selections = [{}, {'state': states}]
+
+    for col in dropdown_columns[1:]:
+        selections += [{col: common_values(table, col, 1)}, {col: common_values(table, col, 3)}, dict(state, **{col: common_values(table, col, 2, state)})]
+
+    for first_col, second_col in itertools.combinations(['place_of_service', 'provider_type', 'credential', 'hcpcs_code'], 2):
+        first_values = common_values(table, first_col, 2)
+        selections.append({first_col: first_values, second_col: common_values(table, second_col, 2, {first_col: first_values})})
+
+    city = common_values(table, 'city', 1, state)
+    selections.append(dict(state, city=city, provider_type=common_values(table, 'provider_type', 2, dict(state, city=city))))
+
+    return selections
+
+
+def path_results(server, selections):
+    results = []
+
+    with server.app_context():
+        for selection in selections:
+            for rank_position, rank_by in [('Top', 'Avg Charged'), ('Bottom', 'Patients')]:
+                results.append(calculate_results(results_user_inputs(selection, rank_position, rank_by)))
+
+            # (the dropdown options below each column of the selection, i.e. as if each of its dropdowns had just changed)
+            for col in [col for col in dropdown_columns[:-1] if col in selection]:
+                results.append(dropdowns_options(dropdowns_filters(selection, col, 1)[0]))
+
+    return results
+
+
+@pytest.fixture(scope='module')
+def utilization_results(server, selections):
+    use_path(server, {})
+    yield path_results(server, selections)
+    use_path(server, {})
+
+
+@pytest.mark.parametrize('path', list(paths))
+def test_paths_match_the_utilization_table(server, selections, utilization_results, path):
+    use_path(server, paths[path])
+
+    try:
+        results = path_results(server, selections)
+    finally:
+        use_path(server, {})
+
+    assert [index for index, (result, expected) in enumerate(zip(results, utilization_results)) if result != expected] == []
+    assert len(results) == len(utilization_results)